@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+拼接基准测试
+
+比较原先基于AudioSegment.__add__的递归/线程池合并（parallel_merge的旧实现）
+与一次分配输出缓冲区的concat_segments，分别测试10、100、1000个片段的耗时和峰值内存。
+
+用法：
+    python benchmarks/bench_concat.py --seconds 1
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+# 确保项目根目录在Python路径中
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from pydub import AudioSegment
+
+from src.utils import utils
+
+
+def legacy_merge_segments(seg_list):
+    """旧实现：递归使用+合并"""
+    if len(seg_list) == 1:
+        return seg_list[0]
+    elif len(seg_list) == 2:
+        return seg_list[0] + seg_list[1]
+    mid = len(seg_list) // 2
+    return legacy_merge_segments(seg_list[:mid]) + legacy_merge_segments(seg_list[mid:])
+
+
+def legacy_parallel_merge(segments, num_workers=8, min_segments=50):
+    """旧实现：分块后用线程池合并，再递归合并各块结果"""
+    if len(segments) < min_segments:
+        return legacy_merge_segments(segments)
+    num_chunks = max(4, utils.next_power_of_2(len(segments)))
+    chunk_size = (len(segments) + num_chunks - 1) // num_chunks
+    chunks = [segments[i:i + chunk_size] for i in range(0, len(segments), chunk_size)]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        merged_chunks = list(executor.map(legacy_merge_segments, chunks))
+    return legacy_merge_segments(merged_chunks)
+
+
+def make_segments(count, seconds, frame_rate=44100, channels=2, sample_width=2):
+    """生成指定数量的合成音频片段（随机PCM）"""
+    frame_bytes = int(seconds * frame_rate) * channels * sample_width
+    return [
+        AudioSegment(data=os.urandom(frame_bytes), sample_width=sample_width,
+                     frame_rate=frame_rate, channels=channels)
+        for _ in range(count)
+    ]
+
+
+def measure(func, segments):
+    """返回 (耗时秒数, 峰值内存字节数, 结果长度字节数)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(segments)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, len(result.raw_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='拼接基准测试')
+    parser.add_argument('--counts', type=int, nargs='+', default=[10, 100, 1000], help='片段数量')
+    parser.add_argument('--seconds', type=float, default=1.0, help='每个片段的时长（秒）')
+    args = parser.parse_args()
+
+    print(f"{'片段数':>6} {'实现':<16} {'耗时(s)':>10} {'峰值内存(MB)':>14} {'输出(MB)':>10}")
+    for count in args.counts:
+        segments = make_segments(count, args.seconds)
+        for name, func in (("parallel_merge旧", legacy_parallel_merge), ("concat_segments", utils.concat_segments)):
+            elapsed, peak, size = measure(func, segments)
+            print(f"{count:>6} {name:<16} {elapsed:>10.3f} {peak / 1024 / 1024:>14.1f} {size / 1024 / 1024:>10.1f}")
+        del segments
+
+
+if __name__ == '__main__':
+    main()
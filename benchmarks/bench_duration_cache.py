@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+时长缓存加载基准测试
+
+生成N个条目的时长缓存，分别保存为JSON（cache_utils.save_duration_cache）和二进制快照
+（duration_snapshot），每种格式在新的子进程中加载，输出加载耗时、加载后增加的常驻内存（RSS）、
+随机查询1000个键的耗时（二进制快照第一次查询时建立键索引，计入其中）以及查询后增加的常驻内存。
+
+用法：
+    python benchmarks/bench_duration_cache.py --entries 100000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+# 确保项目根目录在Python路径中
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+LOOKUPS = 1000
+
+
+def current_rss():
+    """当前进程的常驻内存（字节），无法获取时返回0"""
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb
+        )
+        return counters.WorkingSetSize
+    return 0
+
+
+def generate(directory, count):
+    """生成count个条目，写入JSON和二进制快照，返回两个文件的路径"""
+    from src.utils import cache_utils
+    from src.utils import duration_journal
+    from src.utils import duration_snapshot
+
+    now = time.time()
+    rng = random.Random(1)
+    entries = {
+        f"歌曲{index:06d}_{rng.randrange(16 ** 6):06x}.mp3": {
+            "duration": rng.uniform(60, 600), "cache_time": now - rng.uniform(0, 20 * 24 * 3600)
+        }
+        for index in range(count)
+    }
+    json_file = os.path.join(directory, "duration_cache.json")
+    cache_utils.save_duration_cache(json_file, entries)
+    binary_dir = os.path.join(directory, "binary")
+    os.makedirs(binary_dir, exist_ok=True)
+    binary_json = os.path.join(binary_dir, "duration_cache.json")
+    duration_snapshot.write_snapshot(duration_journal.snapshot_path(binary_json), entries)
+    with open(os.path.join(directory, "keys.json"), 'w', encoding='utf-8') as f:
+        json.dump(rng.sample(sorted(entries), min(LOOKUPS, count)), f, ensure_ascii=False)
+    return json_file, binary_json
+
+
+def child(kind, cache_file, keys_file):
+    """在子进程中加载一种格式，输出一行JSON结果"""
+    with open(keys_file, encoding='utf-8') as f:
+        keys = json.load(f)
+    from src.utils import cache_utils
+    from src.utils import duration_journal
+
+    rss_before = current_rss()
+    start = time.perf_counter()
+    if kind == "json":
+        cache = cache_utils.load_duration_cache(cache_file)
+    else:
+        cache = duration_journal.DurationJournal(cache_file)
+    load_seconds = time.perf_counter() - start
+    rss_after = current_rss()
+
+    start = time.perf_counter()
+    found = sum(1 for key in keys if cache.get(key) is not None)
+    lookup_seconds = time.perf_counter() - start
+    rss_lookup = current_rss()
+    print(json.dumps({
+        "load_seconds": load_seconds, "rss_bytes": rss_after - rss_before,
+        "rss_lookup_bytes": rss_lookup - rss_before,
+        "lookup_seconds": lookup_seconds, "found": found, "file_bytes": os.path.getsize(
+            cache_file if kind == "json" else duration_journal.snapshot_path(cache_file)
+        )
+    }))
+
+
+def run_child(kind, cache_file, keys_file):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', kind, cache_file, keys_file],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='时长缓存加载基准测试')
+    parser.add_argument('--entries', type=int, default=100000, help='缓存条目数')
+    parser.add_argument('--repeat', type=int, default=3, help='每种格式加载的次数（取中位数）')
+    parser.add_argument('--child', nargs=3, metavar=('KIND', 'CACHE_FILE', 'KEYS_FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='bench_duration_cache_') as directory:
+        json_file, binary_file = generate(directory, args.entries)
+        keys_file = os.path.join(directory, "keys.json")
+        print(f"条目数：{args.entries}，每种格式在新进程中加载 {args.repeat} 次，取中位数")
+        print(f"{'格式':<8}{'文件大小':>12}{'加载耗时':>12}{'RSS增加':>12}{'查询' + str(LOOKUPS) + '次':>14}"
+              f"{'查询后RSS增加':>14}")
+        for kind, cache_file in (("json", json_file), ("binary", binary_file)):
+            results = sorted((run_child(kind, cache_file, keys_file) for _ in range(args.repeat)),
+                             key=lambda result: result["load_seconds"])
+            result = results[len(results) // 2]
+            print(
+                f"{kind:<8}{result['file_bytes'] / 1024 / 1024:>10.1f}MB"
+                f"{result['load_seconds'] * 1000:>10.1f}ms"
+                f"{result['rss_bytes'] / 1024 / 1024:>10.1f}MB"
+                f"{result['lookup_seconds'] * 1000:>12.2f}ms"
+                f"{result['rss_lookup_bytes'] / 1024 / 1024:>12.1f}MB"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+时长探测基准测试
+
+对同一批音频文件分别用完整解码（旧实现）和文件头探测（新实现）获取时长，
+输出每秒处理的文件数，以及两种方式结果的最大偏差。
+
+用法：
+    python benchmarks/bench_probe.py 曲库 --limit 200
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# 确保项目根目录在Python路径中
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.utils import audio_probe
+from src.utils import library_scan
+
+
+def collect_files(directory, limit=None):
+    """递归收集目录下的音频文件"""
+    files = []
+    for root, dirs, names in os.walk(directory):
+        for name in sorted(names):
+            if library_scan.is_audio_file(name):
+                files.append(os.path.join(root, name))
+                if limit and len(files) >= limit:
+                    return files
+    return files
+
+
+def run(files, probe):
+    """依次探测所有文件，返回 (耗时秒数, {文件: 时长})"""
+    durations = {}
+    start = time.perf_counter()
+    for file_path in files:
+        try:
+            info = probe(file_path)
+            durations[file_path] = info["duration"] if info else None
+        except Exception:
+            durations[file_path] = None
+    return time.perf_counter() - start, durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='时长探测基准测试')
+    parser.add_argument('directory', help='音频文件目录')
+    parser.add_argument('--limit', type=int, default=None, help='最多测试的文件数')
+    parser.add_argument('--skip-decode', action='store_true', help='跳过完整解码（旧实现）的测试')
+    args = parser.parse_args()
+
+    files = collect_files(args.directory, args.limit)
+    if not files:
+        print(f"错误：{args.directory}目录下未找到音频文件")
+        return
+
+    print(f"测试文件数：{len(files)}")
+    header_time, header_durations = run(files, audio_probe.probe_audio)
+    print(f"文件头探测：{header_time:.3f}s，{len(files) / header_time:.1f} 文件/秒")
+
+    if args.skip_decode:
+        return
+
+    decode_time, decode_durations = run(files, audio_probe.probe_decode)
+    print(f"完整解码：  {decode_time:.3f}s，{len(files) / decode_time:.1f} 文件/秒")
+    print(f"加速比：{decode_time / header_time:.1f}x")
+
+    deviations = [
+        abs(header_durations[f] - decode_durations[f])
+        for f in files
+        if header_durations[f] is not None and decode_durations[f] is not None
+    ]
+    if deviations:
+        print(f"时长最大偏差：{max(deviations) * 1000:.1f}ms，平均偏差：{sum(deviations) / len(deviations) * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动耗时基准测试
+
+多次启动图形界面，测量从启动进程到窗口可交互（显示后事件循环第一次空闲）的耗时。
+程序通过环境变量AUDIO_SPLICER_STARTUP_BENCH得到一个文件路径，显示完成后把自身统计的
+耗时写入该文件并退出；本脚本以文件出现的时间作为外部耗时（包含解释器启动和打包程序解压）。
+默认测试开发环境（python src/main.py），--exe测试PyInstaller打包后的程序。
+--importtime额外用python -X importtime统计开发环境中累计耗时最多的导入。
+结果格式与run_benchmarks.py相同，可用--compare与基线比较。
+
+用法：
+    python benchmarks/bench_startup.py --repeat 5 --output startup.json
+    python benchmarks/bench_startup.py --exe dist/音乐剪辑器.exe --compare startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+
+# 确保项目根目录在Python路径中
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from run_benchmarks import RESULT_VERSION, summarize, compare, load_result, git_revision
+
+from src.constants import STARTUP_BENCH_ENV_VAR
+
+MAIN_SCRIPT = os.path.join(project_root, "src", "main.py")
+
+
+def measure_once(command, timeout, offscreen=False):
+    """启动一次，返回 (外部耗时秒数, 程序统计的耗时秒数)"""
+    fd, result_file = tempfile.mkstemp(prefix="startup_", suffix=".txt")
+    os.close(fd)
+    os.remove(result_file)
+    env = dict(os.environ)
+    env[STARTUP_BENCH_ENV_VAR] = result_file
+    if offscreen:
+        env["QT_QPA_PLATFORM"] = "offscreen"
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while not os.path.exists(result_file):
+            if process.poll() is not None:
+                error = process.stderr.read().decode('utf-8', errors='replace').strip()
+                raise RuntimeError(f"程序在显示窗口前退出（返回码 {process.returncode}）：{error}")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"{timeout}秒内窗口未显示")
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        # 文件可能刚创建还未写入
+        in_process = None
+        for _ in range(100):
+            with open(result_file, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            if content:
+                in_process = float(content) / 1000
+                break
+            time.sleep(0.01)
+        process.wait(timeout=timeout)
+        return elapsed, in_process
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if os.path.exists(result_file):
+            os.remove(result_file)
+
+
+def import_times(top=15):
+    """用-X importtime导入界面依赖的模块，返回 (顶层导入总毫秒数, 累计耗时最多的top个 (模块, 毫秒))"""
+    code = (
+        f"import sys; sys.path.insert(0, {project_root!r}); "
+        "import PyQt5.QtWidgets, src.threads.worker_threads, src.core.audio_processor, "
+        "src.core.decode_pool, src.ui.ui_components"
+    )
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        raise RuntimeError(lines[-1] if lines else "导入失败")
+    total = 0.0
+    entries = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        ms = int(cumulative) / 1000
+        entries.append((name.strip(), ms))
+        # 顶层导入的模块名前只有一个空格，子模块按嵌套层数缩进
+        if len(name) - len(name.lstrip()) == 1:
+            total += ms
+    return total, sorted(entries, key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动耗时基准测试')
+    parser.add_argument('--exe', help='打包后的程序路径（默认测试开发环境的src/main.py）')
+    parser.add_argument('--repeat', type=int, default=5, help='启动次数')
+    parser.add_argument('--timeout', type=float, default=60.0, help='每次启动的超时时间（秒）')
+    parser.add_argument('--offscreen', action='store_true', help='使用Qt offscreen平台（无显示器的环境）')
+    parser.add_argument('--importtime', action='store_true', help='统计导入耗时（仅开发环境）')
+    parser.add_argument('--output', help='把结果保存为JSON')
+    parser.add_argument('--compare', help='与保存的基线JSON比较')
+    parser.add_argument('--threshold', type=float, default=0.10, help='视为回退的变慢比例（默认0.10）')
+    parser.add_argument('--min-delta', type=float, default=0.02, help='视为回退的最小绝对差值（秒）')
+    args = parser.parse_args()
+
+    if args.exe:
+        name, command = "startup_frozen", [os.path.abspath(args.exe)]
+    else:
+        name, command = "startup_dev", [sys.executable, MAIN_SCRIPT]
+
+    results = {}
+    times, in_process = [], []
+    for i in range(args.repeat):
+        elapsed, own = measure_once(command, args.timeout, args.offscreen)
+        times.append(elapsed)
+        if own is not None:
+            in_process.append(own)
+        print(f"  第{i + 1}次：{elapsed * 1000:.0f}ms（程序内统计 {own * 1000 if own else 0:.0f}ms）")
+    extra = {"in_process_median": round(sorted(in_process)[len(in_process) // 2], 6)} if in_process else {}
+    results[name] = summarize(times, extra)
+    print(f"{name}：中位数 {results[name]['median'] * 1000:.0f}ms，最小 {results[name]['min'] * 1000:.0f}ms")
+
+    if args.importtime and not args.exe:
+        total, slowest = import_times()
+        results["import_time"] = summarize([total / 1000], {"slowest": [[n, round(ms, 1)] for n, ms in slowest]})
+        print(f"导入耗时：{total:.0f}ms，累计耗时最多的模块：")
+        for module, ms in slowest:
+            print(f"  {ms:>8.1f}ms  {module}")
+
+    current = {
+        "version": RESULT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "revision": git_revision(),
+        },
+        "corpus": None,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存到 {args.output}")
+
+    if args.compare:
+        regressions = compare(current, load_result(args.compare), args.threshold, args.min_delta)
+        if regressions:
+            print(f"发现 {len(regressions)} 项回退：{', '.join(regressions)}")
+            return 1
+        print("没有发现回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合成音频语料
+
+按给定的数量、时长和格式生成确定性的测试音频（正弦波和噪声交替），相同参数和种子
+每次生成相同的PCM。WAV由标准库直接写入，其他格式用ffmpeg从WAV转换。
+生成的目录结构与程序目录一致（曲库/、随舞/），可直接作为program_dir使用。
+
+用法：
+    python benchmarks/corpus.py 输出目录 --count 20 --seconds 30 --formats mp3 wav
+"""
+
+import os
+import sys
+import math
+import wave
+import random
+import argparse
+import subprocess
+from array import array
+
+# 确保项目根目录在Python路径中
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.constants import LIBRARY_DIR_NAME, DANCE_DIR_NAME
+from src.utils import cache_utils
+
+CORPUS_FORMATS = ('wav', 'mp3', 'flac', 'ogg', 'm4a')
+
+# 各格式的ffmpeg编码参数
+_FORMAT_ARGS = {
+    'mp3': ['-codec:a', 'libmp3lame', '-b:a', '128k'],
+    'flac': ['-codec:a', 'flac'],
+    'ogg': ['-codec:a', 'libvorbis', '-q:a', '4'],
+    'm4a': ['-codec:a', 'aac', '-b:a', '128k'],
+}
+
+
+def make_pcm(index, seconds, seed=0, frame_rate=44100, channels=2):
+    """生成第index首的16位PCM：偶数首为正弦波，奇数首为噪声
+
+    先生成一秒的数据再重复，整数赫兹的正弦波在一秒内是完整周期，重复后没有接缝。
+    """
+    rng = random.Random(f"{seed}:{index}")
+    block = array('h')
+    if index % 2 == 0:
+        frequency = rng.randint(110, 880)
+        amplitude = 12000
+        for n in range(frame_rate):
+            sample = int(amplitude * math.sin(2 * math.pi * frequency * n / frame_rate))
+            block.extend([sample] * channels)
+    else:
+        block.extend(rng.randint(-8000, 8000) for _ in range(frame_rate * channels))
+    data = block.tobytes() * int(seconds)
+    remainder = int((seconds - int(seconds)) * frame_rate) * channels * 2
+    return data + block.tobytes()[:remainder]
+
+
+def write_wav(path, pcm, frame_rate=44100, channels=2):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(frame_rate)
+        f.writeframes(pcm)
+
+
+def convert(wav_path, output_path, output_format):
+    """用ffmpeg把WAV转换为其他格式"""
+    command = [
+        cache_utils.get_ffmpeg_path(), '-hide_banner', '-loglevel', 'error', '-y',
+        '-i', wav_path, *_FORMAT_ARGS[output_format], output_path
+    ]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"生成{os.path.basename(output_path)}失败：{result.stderr.decode('utf-8', errors='replace').strip()}")
+
+
+def generate_corpus(directory, count=20, seconds=30.0, formats=('mp3',), seed=0, frame_rate=44100, channels=2,
+                    subdir=LIBRARY_DIR_NAME):
+    """在directory/subdir下生成count首测试音频（格式轮流使用formats），返回文件路径列表
+
+    文件已存在时跳过，重复运行只补齐缺少的文件。
+    """
+    for output_format in formats:
+        if output_format not in CORPUS_FORMATS:
+            raise ValueError(f"不支持的格式：{output_format}，可选：{'/'.join(CORPUS_FORMATS)}")
+    target_dir = os.path.join(directory, subdir)
+    os.makedirs(target_dir, exist_ok=True)
+
+    files = []
+    for index in range(count):
+        output_format = formats[index % len(formats)]
+        kind = 'sine' if index % 2 == 0 else 'noise'
+        path = os.path.join(target_dir, f"{index + 1:04d}-{kind}.{output_format}")
+        files.append(path)
+        if os.path.exists(path):
+            continue
+        pcm = make_pcm(index, seconds, seed, frame_rate, channels)
+        if output_format == 'wav':
+            write_wav(path, pcm, frame_rate, channels)
+            continue
+        wav_path = path + '.tmp.wav'
+        write_wav(wav_path, pcm, frame_rate, channels)
+        try:
+            convert(wav_path, path, output_format)
+        finally:
+            os.remove(wav_path)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成测试音频')
+    parser.add_argument('directory', help='输出目录（生成后可作为程序目录使用）')
+    parser.add_argument('--count', type=int, default=20, help='音频数量')
+    parser.add_argument('--seconds', type=float, default=30.0, help='每首时长（秒）')
+    parser.add_argument('--formats', nargs='+', default=['mp3'], choices=CORPUS_FORMATS, help='音频格式（轮流使用）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--dance', action='store_true', help=f'生成到{DANCE_DIR_NAME}目录而不是{LIBRARY_DIR_NAME}目录')
+    args = parser.parse_args()
+
+    files = generate_corpus(
+        args.directory, args.count, args.seconds, tuple(args.formats), args.seed,
+        subdir=DANCE_DIR_NAME if args.dance else LIBRARY_DIR_NAME
+    )
+    print(f"已生成 {len(files)} 个文件：{os.path.dirname(files[0])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试套件
+
+在合成语料（见corpus.py）上分别测试各热点路径的耗时：时长获取（冷/热缓存）、
+多线程竞争下的LRUCache、parallel_merge与merge_segments、曲库扫描、完整拼接渲染和响度分析。
+每项重复--repeat次，结果（中位数、最小值等）可保存为JSON，并与保存的基线比较，
+中位数变慢超过阈值的项标记为回退，存在回退时返回码为1。
+
+用法：
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --compare baseline.json --output current.json
+    python benchmarks/run_benchmarks.py --input current.json --compare baseline.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+# 确保项目根目录在Python路径中
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from corpus import CORPUS_FORMATS, generate_corpus
+
+from src.core import audio_processor
+from src.core import decode_pool
+from src.core import splice_job
+from src.utils import cache_utils
+from src.utils import concurrency
+from src.utils import fragment_cache
+from src.utils import track_index
+from src.utils import utils
+
+RESULT_VERSION = 1
+
+# 注册的基准测试：(名称, 说明, 函数)，函数返回耗时秒数，或 (耗时秒数, 附加指标字典)
+BENCHMARKS = []
+
+
+def benchmark(name, description):
+    def _register(func):
+        BENCHMARKS.append((name, description, func))
+        return func
+    return _register
+
+
+class Context:
+    """基准测试共用的语料和临时目录"""
+
+    def __init__(self, corpus_dir, work_dir, files, threads):
+        self.corpus_dir = corpus_dir
+        self.work_dir = work_dir
+        self.files = files
+        self.threads = threads
+        self._segments = None
+        self._decode_pool = None
+
+    @property
+    def segments(self):
+        """解码后的全部语料（第一次使用时解码，不计入耗时）"""
+        if self._segments is None:
+            from pydub import AudioSegment
+            self._segments = [AudioSegment.from_file(file) for file in self.files]
+        return self._segments
+
+    @property
+    def decode_pool(self):
+        """预先启动工作进程的解码池，进程启动时间不计入渲染耗时"""
+        if self._decode_pool is None:
+            self._decode_pool = decode_pool.DecodePool()
+            self._decode_pool.decode(self.files[0]).close()
+        return self._decode_pool
+
+    def close(self):
+        if self._decode_pool is not None:
+            self._decode_pool.shutdown()
+
+
+@benchmark("duration_cold", "get_audio_duration，空缓存")
+def bench_duration_cold(ctx):
+    duration_cache = {}
+    start = time.perf_counter()
+    for file in ctx.files:
+        cache_utils.get_audio_duration(file, duration_cache)
+    return time.perf_counter() - start
+
+
+@benchmark("duration_warm", "get_audio_duration，全部命中缓存")
+def bench_duration_warm(ctx):
+    duration_cache = {}
+    for file in ctx.files:
+        cache_utils.get_audio_duration(file, duration_cache)
+    start = time.perf_counter()
+    for _ in range(100):
+        for file in ctx.files:
+            cache_utils.get_audio_duration(file, duration_cache)
+    return time.perf_counter() - start
+
+
+@benchmark("lru_contention", "LRUCache多线程get/put（含淘汰）")
+def bench_lru_contention(ctx, keys=2000, ops=20000, value_size=64 * 1024):
+    values = [bytes(value_size) for _ in range(16)]
+    # 预算只够一半的键，持续触发淘汰
+    cache = cache_utils.LRUCache(max_bytes=keys * value_size // 2, size_func=len)
+    barrier = threading.Barrier(ctx.threads + 1)
+
+    def _worker(worker_id):
+        barrier.wait()
+        for i in range(ops):
+            key = (i * 7919 + worker_id * 104729) % keys
+            if cache.get(key) is None:
+                cache.put(key, values[key % len(values)])
+
+    threads = [threading.Thread(target=_worker, args=(i,)) for i in range(ctx.threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return elapsed, {"ops_per_sec": round(ctx.threads * ops / elapsed)}
+
+
+@benchmark("merge_parallel", "utils.parallel_merge合并全部语料")
+def bench_merge_parallel(ctx):
+    segments = ctx.segments
+    start = time.perf_counter()
+    result = utils.parallel_merge(segments)
+    elapsed = time.perf_counter() - start
+    del result
+    return elapsed
+
+
+@benchmark("merge_serial", "utils.merge_segments合并全部语料")
+def bench_merge_serial(ctx):
+    segments = ctx.segments
+    start = time.perf_counter()
+    result = utils.merge_segments(segments)
+    elapsed = time.perf_counter() - start
+    del result
+    return elapsed
+
+
+def _make_processor(ctx, index):
+    return audio_processor.AudioProcessor(
+        audio_cache=cache_utils.LRUCache(max_bytes=cache_utils.default_cache_budget()),
+        duration_cache={},
+        duration_cache_file=os.path.join(ctx.work_dir, "duration_cache.json"),
+        program_dir=ctx.corpus_dir,
+        track_index=index,
+        # 不保存调优结果，每次运行从相同的并发数开始
+        controller=concurrency.ConcurrencyController()
+    )
+
+
+@benchmark("library_scan_cold", "AudioProcessor.load_library_files，空索引")
+def bench_library_scan_cold(ctx):
+    db_path = os.path.join(ctx.work_dir, "library_cold.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    index = track_index.TrackIndex(db_path)
+    processor = _make_processor(ctx, index)
+    try:
+        start = time.perf_counter()
+        counts = processor.load_library_files()
+        elapsed = time.perf_counter() - start
+    finally:
+        processor.shutdown()
+        index.close()
+    return elapsed, {"added": counts["added"], "failed": counts["failed"]}
+
+
+@benchmark("library_scan_warm", "AudioProcessor.load_library_files，索引已是最新")
+def bench_library_scan_warm(ctx):
+    index = track_index.TrackIndex(os.path.join(ctx.work_dir, "library_warm.db"))
+    processor = _make_processor(ctx, index)
+    try:
+        processor.load_library_files()
+        start = time.perf_counter()
+        counts = processor.load_library_files()
+        elapsed = time.perf_counter() - start
+    finally:
+        processor.shutdown()
+        index.close()
+    return elapsed, {"unchanged": counts["unchanged"]}
+
+
+def _render(ctx, name, streaming, use_concurrency, mode="sequential", seed=None, fragments=None):
+    """与拼接线程相同的完整流程：解码、拼接、编码MP3、生成音乐顺序文件"""
+    output_dir = os.path.join(ctx.work_dir, name)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    job = splice_job.SpliceJob(
+        ctx.files, mode, None, os.path.join(output_dir, "render.mp3"),
+        cache_utils.LRUCache(max_bytes=cache_utils.default_cache_budget()),
+        use_concurrency=use_concurrency,
+        streaming=streaming,
+        decode_pool=ctx.decode_pool if use_concurrency else None,
+        seed=seed,
+        fragment_cache=fragments
+    )
+    start = time.perf_counter()
+    success, message = job.run()
+    elapsed = time.perf_counter() - start
+    if not success:
+        raise RuntimeError(message)
+    return elapsed, {"output_bytes": os.path.getsize(job.output_file)}
+
+
+@benchmark("render_streaming", "完整渲染：流式、解码池、分块并行编码")
+def bench_render_streaming(ctx):
+    return _render(ctx, "render_streaming", streaming=True, use_concurrency=True)
+
+
+@benchmark("render_streaming_serial", "完整渲染：流式、单线程解码、单进程编码")
+def bench_render_streaming_serial(ctx):
+    return _render(ctx, "render_streaming_serial", streaming=True, use_concurrency=False)
+
+
+@benchmark("render_in_memory", "完整渲染：整体拼接后编码")
+def bench_render_in_memory(ctx):
+    return _render(ctx, "render_in_memory", streaming=False, use_concurrency=True)
+
+
+@benchmark("render_fragments_warm", "完整渲染：片段缓存已预热，新的随机顺序只连接MP3帧")
+def bench_render_fragments_warm(ctx):
+    cache = fragment_cache.FragmentCache(os.path.join(ctx.work_dir, "fragments"), 10 * 1024 ** 3)
+    # 语料渲染不插入倒计时，每首只有一种片段；预热不计入耗时
+    _render(ctx, "render_fragments_warm", True, True, mode="random", seed=1, fragments=cache)
+    return _render(ctx, "render_fragments_warm", True, True, mode="random", seed=2, fragments=cache)
+
+
+@benchmark("loudness_analysis", "响度分析：解码池工作进程中分块计算整合响度和峰值")
+def bench_loudness_analysis(ctx):
+    pool = ctx.decode_pool
+    start = time.perf_counter()
+    results = [future.result() for future in [pool.analyze(file) for file in ctx.files]]
+    elapsed = time.perf_counter() - start
+    return elapsed, {"audio_seconds": round(sum(result["duration"] for result in results), 1)}
+
+
+def summarize(times, extra):
+    return {
+        "times": [round(t, 6) for t in times],
+        "min": round(min(times), 6),
+        "median": round(statistics.median(times), 6),
+        "mean": round(statistics.mean(times), 6),
+        "stdev": round(statistics.stdev(times), 6) if len(times) > 1 else 0.0,
+        "extra": extra,
+    }
+
+
+def git_revision():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=project_root, capture_output=True, text=True
+        )
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(args):
+    """生成语料并运行选中的基准测试，返回结果字典"""
+    selected = [b for b in BENCHMARKS if not args.only or b[0] in args.only]
+    temp_dir = tempfile.mkdtemp(prefix="splicer_bench_")
+    corpus_dir = args.corpus_dir or os.path.join(temp_dir, "corpus")
+    work_dir = os.path.join(temp_dir, "work")
+    os.makedirs(work_dir)
+    ctx = None
+    try:
+        print(f"生成语料：{args.count} 首 × {args.seconds:g} 秒（{'/'.join(args.formats)}）...")
+        files = generate_corpus(corpus_dir, args.count, args.seconds, tuple(args.formats), args.seed)
+        ctx = Context(corpus_dir, work_dir, files, args.threads)
+
+        results = {}
+        for name, description, func in selected:
+            times = []
+            extra = {}
+            for _ in range(args.warmup):
+                func(ctx)
+            for _ in range(args.repeat):
+                outcome = func(ctx)
+                elapsed, extra = outcome if isinstance(outcome, tuple) else (outcome, {})
+                times.append(elapsed)
+            results[name] = summarize(times, extra)
+            print(f"  {name:<26} 中位数 {results[name]['median']:>9.4f}s  最小 {results[name]['min']:>9.4f}s  {description}")
+    finally:
+        if ctx is not None:
+            ctx.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    return {
+        "version": RESULT_VERSION,
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "revision": git_revision(),
+        },
+        "corpus": {
+            "count": args.count,
+            "seconds": args.seconds,
+            "formats": list(args.formats),
+            "seed": args.seed,
+        },
+        "repeat": args.repeat,
+        "results": results,
+    }
+
+
+def compare(current, baseline, threshold, min_delta):
+    """比较两次结果的中位数，打印对比表，返回回退的项目列表
+
+    变慢超过threshold（比例）且绝对差值超过min_delta秒时视为回退，过滤计时抖动。
+    """
+    if current.get("corpus") != baseline.get("corpus"):
+        print(f"警告：两次测试的语料参数不同（基线 {baseline.get('corpus')}，当前 {current.get('corpus')}）")
+
+    regressions = []
+    print(f"{'项目':<26} {'基线(s)':>10} {'当前(s)':>10} {'变化':>8}")
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:<26} {'-':>10} {result['median']:>10.4f} {'新增':>8}")
+            continue
+        ratio = result["median"] / base["median"] if base["median"] > 0 else 1.0
+        regressed = ratio > 1 + threshold and result["median"] - base["median"] > min_delta
+        if regressed:
+            regressions.append(name)
+        mark = "  回退" if regressed else ("  提升" if ratio < 1 - threshold else "")
+        print(f"{name:<26} {base['median']:>10.4f} {result['median']:>10.4f} {(ratio - 1) * 100:>+7.1f}%{mark}")
+    return regressions
+
+
+def load_result(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        result = json.load(f)
+    if result.get("version") != RESULT_VERSION:
+        raise ValueError(f"{path}的结果格式版本不受支持：{result.get('version')}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='基准测试套件')
+    parser.add_argument('--count', type=int, default=20, help='语料音频数量')
+    parser.add_argument('--seconds', type=float, default=30.0, help='每首时长（秒）')
+    parser.add_argument('--formats', nargs='+', default=['mp3', 'wav'], choices=CORPUS_FORMATS, help='语料格式（轮流使用）')
+    parser.add_argument('--seed', type=int, default=0, help='语料随机种子')
+    parser.add_argument('--corpus-dir', default=None, help='语料目录（已存在的文件直接复用，默认使用临时目录）')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数')
+    parser.add_argument('--warmup', type=int, default=0, help='每项正式计时前的预热次数')
+    parser.add_argument('--threads', type=int, default=8, help='LRUCache竞争测试的线程数')
+    parser.add_argument('--only', nargs='+', choices=[b[0] for b in BENCHMARKS], help='只运行指定的项目')
+    parser.add_argument('--output', help='把结果保存为JSON')
+    parser.add_argument('--input', help='不运行测试，读取已保存的结果（与--compare一起使用）')
+    parser.add_argument('--compare', help='与保存的基线JSON比较')
+    parser.add_argument('--threshold', type=float, default=0.10, help='视为回退的变慢比例（默认0.10）')
+    parser.add_argument('--min-delta', type=float, default=0.005, help='视为回退的最小绝对差值（秒）')
+    args = parser.parse_args()
+
+    if args.input:
+        current = load_result(args.input)
+    else:
+        current = run_benchmarks(args)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(current, f, indent=2, ensure_ascii=False)
+            print(f"结果已保存到 {args.output}")
+
+    if args.compare:
+        regressions = compare(current, load_result(args.compare), args.threshold, args.min_delta)
+        if regressions:
+            print(f"发现 {len(regressions)} 项回退：{', '.join(regressions)}")
+            return 1
+        print("没有发现回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""无界面批量渲染
+
+用法：
+    python -m src 任务.json [任务2.yaml ...]
+    python -m src 任务目录 --jobs 2
+    python -m src 任务.json --preview        # 只渲染过渡试听
+
+任务文件格式见src/core/batch_render.py。不导入PyQt，可以在服务器上运行。
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+# 确保项目根目录在Python路径中
+if getattr(sys, 'frozen', False):
+    # 打包后的环境
+    program_dir = os.path.dirname(sys.executable)
+else:
+    program_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if program_dir not in sys.path:
+    sys.path.insert(0, program_dir)
+
+from src.utils import utils
+utils.suppress_subprocess_windows()
+
+from src.constants import PREVIEW_WINDOW_SECONDS
+from src.core import batch_render
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src', description='按任务文件批量拼接音频（无界面）')
+    parser.add_argument('jobs', nargs='+', help='任务文件（JSON/YAML）或包含任务文件的目录')
+    parser.add_argument('-j', '--jobs', dest='concurrency', type=int, default=1,
+                        help='同时执行的任务数（默认1）')
+    parser.add_argument('--no-concurrency', action='store_true',
+                        help='不使用多进程解码和分块并行编码')
+    parser.add_argument('--program-dir', default=program_dir,
+                        help='保存音轨索引和PCM缓存的目录（默认与界面相同）')
+    parser.add_argument('--trace', action='store_true', default=None,
+                        help='记录各阶段耗时，输出汇总并把trace文件导出到程序目录的traces目录')
+    parser.add_argument('--preview', nargs='?', type=float, const=PREVIEW_WINDOW_SECONDS, metavar='SECONDS',
+                        help=f'只渲染过渡试听：每首的最后/最前SECONDS秒（默认{PREVIEW_WINDOW_SECONDS}）和倒计时，'
+                             f'输出为"<output>_preview.mp3"')
+    args = parser.parse_args(argv)
+
+    # 读取全部任务文件，有错误时不开始渲染
+    jobs = []
+    for path in batch_render.collect_job_files(args.jobs):
+        try:
+            jobs.extend(batch_render.load_job_file(path, args.program_dir))
+        except batch_render.JobError as e:
+            print(f"错误：{e}")
+            return 2
+    if not jobs:
+        print("错误：没有找到任务文件")
+        return 2
+
+    print(f"共 {len(jobs)} 个任务，同时执行 {max(1, args.concurrency)} 个")
+    renderer = batch_render.BatchRenderer(
+        args.program_dir,
+        concurrency=args.concurrency,
+        use_concurrency=not args.no_concurrency,
+        trace=args.trace,
+        preview_seconds=args.preview
+    )
+    start = time.monotonic()
+    try:
+        results = renderer.run(jobs)
+    except KeyboardInterrupt:
+        print("\n已取消")
+        return 130
+    finally:
+        renderer.close()
+
+    failed = 0
+    print(f"\n全部任务完成，用时 {time.monotonic() - start:.1f} 秒：")
+    for job, (success, message) in zip(jobs, results):
+        failed += not success
+        summary = message.replace('\n', '；')
+        print(f"  {'成功' if success else '失败'} [{job['name']}] {summary}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    # 打包后的程序启动解码池工作进程时需要
+    multiprocessing.freeze_support()
+    sys.exit(main())
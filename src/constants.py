@@ -17,24 +17,132 @@ LIBRARY_DIR_NAME = "曲库"
 # 随舞目录名称
 DANCE_DIR_NAME = "随舞"
 
+# 支持的音频文件扩展名
+AUDIO_EXTENSIONS = ['.mp3', '.wav', '.flac', '.ogg', '.aac', '.m4a', '.wma']
+
 # 输出文件名前缀
 OUTPUT_FILE_PREFIX = "output"
 
 # 输出文件扩展名
 OUTPUT_FILE_EXTENSION = ".mp3"
 
+# 音轨索引数据库文件名
+TRACK_INDEX_FILENAME = "track_index.db"
+
+# 曲库扫描的探测调度：读取文件头的线程数、同时运行的ffprobe进程数、
+# 每个文件的ffprobe超时（秒）、结果批量写入时长存储的条数
+PROBE_HEADER_WORKERS = 8
+PROBE_MAX_PROCESSES = min(32, (os.cpu_count() or 4) * 2)
+PROBE_TIMEOUT = 30
+PROBE_STORE_BATCH = 64
+
+# 曲库目录监视：变化静默多少秒后处理、持续变化时最长多少秒处理一次、无法使用inotify时的扫描间隔（秒）
+WATCHER_DEBOUNCE_SECONDS = 1.0
+WATCHER_MAX_DELAY_SECONDS = 5.0
+WATCHER_POLL_INTERVAL_SECONDS = 10.0
+
+# 多进程解码池：工作进程数和同时存在的解码结果数上限
+DECODE_POOL_MAX_WORKERS = os.cpu_count() or 4
+DECODE_POOL_MAX_IN_FLIGHT = DECODE_POOL_MAX_WORKERS + 2
+
+# 磁盘PCM缓存目录和配额（字节）
+PCM_CACHE_DIR_NAME = os.path.join("cache", "pcm")
+PCM_CACHE_MAX_BYTES = 20 * 1024 * 1024 * 1024
+
+# 阶段计时：启用追踪的环境变量和trace文件目录
+TRACE_ENV_VAR = "AUDIO_SPLICER_TRACE"
+TRACE_DIR_NAME = "traces"
+
+# 设置为文件路径时，界面显示完成后把启动耗时（毫秒）写入该文件并退出（供benchmarks/bench_startup.py使用）
+STARTUP_BENCH_ENV_VAR = "AUDIO_SPLICER_STARTUP_BENCH"
+
 # 缓存过期时间（秒）- 30天
 CACHE_EXPIRATION = 30 * 24 * 60 * 60
 
+# 时长缓存的预写日志：日志文件后缀、每多少条记录追加一次、日志积累多少条后压缩为快照；
+# 二进制快照的扩展名（替换duration_cache.json的扩展名）
+DURATION_JOURNAL_SUFFIX = ".journal"
+DURATION_SNAPSHOT_EXTENSION = ".bin"
+DURATION_JOURNAL_BATCH = 64
+DURATION_JOURNAL_COMPACT_RECORDS = 2000
+
+# 音频内存缓存：字节预算为物理内存的比例，无法获取内存大小时使用固定预算
+AUDIO_CACHE_MEMORY_FRACTION = 0.25
+AUDIO_CACHE_FALLBACK_BYTES = 1024 * 1024 * 1024
+# 音频内存缓存的锁分片数
+AUDIO_CACHE_SHARDS = 16
+
 # 并行合并默认参数
 PARALLEL_MERGE_DEFAULT_WORKERS = 8
 PARALLEL_MERGE_DEFAULT_MIN_SEGMENTS = 50
 
-# 并发控制默认参数
-DEFAULT_MAX_WORKERS = min(os.cpu_count() + 1, 12) if os.cpu_count() else 8
-DEFAULT_LOW_LOAD_WORKERS = max(2, int(DEFAULT_MAX_WORKERS / 2))
-DEFAULT_HIGH_LOAD_WORKERS = DEFAULT_MAX_WORKERS
+# 自适应并发控制：调优结果文件名、统计窗口（秒）、吞吐量视为持平的相对差值、
+# 界面卡顿时并发数的缩减比例、界面事件循环延迟阈值（毫秒）、视为满载的CPU占用率
+CONCURRENCY_STATE_FILENAME = "concurrency.json"
+CONCURRENCY_WINDOW_SECONDS = 1.0
+CONCURRENCY_TOLERANCE = 0.05
+CONCURRENCY_BACKOFF_FACTOR = 0.5
+CONCURRENCY_UI_LAG_THRESHOLD_MS = 100
+CONCURRENCY_CPU_BUSY_THRESHOLD = 0.9
+# 获取随舞文件时长的线程数上限
+DANCE_DURATION_MAX_WORKERS = min((os.cpu_count() or 4) + 1, 12)
+# AudioProcessor的常驻线程池（曲库探测读取文件头和获取随舞文件时长共用）的线程数
+LIBRARY_POOL_WORKERS = max(PROBE_HEADER_WORKERS, DANCE_DURATION_MAX_WORKERS)
+# 界面事件循环延迟的采样间隔（毫秒）
+LAG_MONITOR_INTERVAL_MS = 100
 
 # 状态更新频率
 STATUS_UPDATE_FREQUENCY = 10  # 每10个文件更新一次状态
 PROGRESS_UPDATE_FREQUENCY = 5  # 每5%更新一次进度
+
+
+# 淡入淡出时长（毫秒）
+FADE_DURATION_MS = 2000
+
+# 输出音频PCM参数（流式渲染时统一转换到该格式后送入编码器）
+OUTPUT_FRAME_RATE = 44100
+OUTPUT_CHANNELS = 2
+OUTPUT_SAMPLE_WIDTH = 2
+
+# 流式渲染时最多提前解码的音轨数
+STREAM_RENDER_LOOKAHEAD = 2
+
+# 过渡试听：每首保留的结尾/开头秒数、两段过渡之间的静音（毫秒）、同时运行的ffmpeg解码进程数
+PREVIEW_WINDOW_SECONDS = 10
+PREVIEW_GAP_MS = 1500
+PREVIEW_DECODE_JOBS = os.cpu_count() or 4
+# 界面中试听文件的保存位置（相对于程序目录）
+PREVIEW_FILENAME = os.path.join("cache", "preview.mp3")
+
+# MP3编码预设：名称 -> (界面显示名称, libmp3lame参数)；"standard"与原先pydub导出的默认参数一致
+MP3_ENCODE_PRESETS = {
+    "fast": ("快速", ['-b:a', '128k', '-compression_level', '7']),
+    "standard": ("标准", ['-b:a', '128k']),
+    "high": ("高质量", ['-b:a', '320k', '-compression_level', '2']),
+}
+DEFAULT_MP3_PRESET = "standard"
+
+# 分块并行编码MP3：每块时长（秒）、同时运行的编码进程数
+MP3_CHUNK_SECONDS = 60
+MP3_CHUNK_JOBS = os.cpu_count() or 4
+# 每块前后多编码的MP3帧数（拼接时丢弃），使编码器状态与整体编码时一致
+MP3_CHUNK_PREROLL_FRAMES = 8
+MP3_CHUNK_TAIL_FRAMES = 4
+
+# 预编码片段缓存：每首（含其后的倒计时）单独编码一次，重新拼接时只按帧连接
+FRAGMENT_CACHE_DIR_NAME = os.path.join("cache", "fragments")
+FRAGMENT_CACHE_MAX_BYTES = 5 * 1024 * 1024 * 1024
+# 同时编码的片段数
+FRAGMENT_ENCODE_JOBS = os.cpu_count() or 4
+# 片段前后多编码的MP3帧数（丢弃）；片段末尾补至少一帧静音，吸收编码延迟并使片段为整帧
+FRAGMENT_PREROLL_FRAMES = 8
+FRAGMENT_TAIL_FRAMES = 4
+
+# 智能渲染：在淡入结束后的多少帧内寻找开始复制源文件帧的位置；可复制的帧少于该数时整首重新编码
+SMART_RENDER_SEARCH_FRAMES = 40
+SMART_RENDER_MIN_COPY_FRAMES = 40
+
+# 响度均衡：目标响度（LUFS）、增益后峰值上限（dBFS）、最大提升（dB）
+LOUDNESS_TARGET_LUFS = -16.0
+LOUDNESS_PEAK_CEILING_DB = -1.0
+LOUDNESS_MAX_GAIN_DB = 12.0
@@ -2,44 +2,59 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import threading
-import multiprocessing
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from loguru import logger
+from src.constants import (
+    PROBE_STORE_BATCH, CONCURRENCY_STATE_FILENAME, DANCE_DURATION_MAX_WORKERS, LIBRARY_POOL_WORKERS
+)
+from src.core import track_loader
+from src.utils import audio_probe
 from src.utils import cache_utils
+from src.utils import cancellation
+from src.utils import concurrency
+from src.utils import duration_journal
+from src.utils import library_scan
+from src.utils import probe_scheduler
+from src.utils import tracing
 
 class AudioProcessor:
-    def __init__(self, audio_cache, duration_cache, duration_cache_file, program_dir):
+    def __init__(self, audio_cache, duration_cache, duration_cache_file, program_dir, track_index=None,
+                 pcm_cache=None, tracer=None, controller=None):
         self.audio_cache = audio_cache
+        # 解码后PCM的磁盘缓存（第二级缓存）
+        self.pcm_cache = pcm_cache
         self.duration_cache = duration_cache
         self.duration_cache_file = duration_cache_file
+        # 持久化音轨索引（按绝对路径+大小+修改时间），为None时使用旧版JSON时长缓存
+        self.track_index = track_index
+        # 阶段计时（时长探测），曲库扫描结束时输出汇总
+        self.tracer = tracer or tracing.NULL_TRACER
+        # 自适应并发控制（曲库探测、随舞时长获取和解码池共用），每台机器的调优结果保存在程序目录
+        self.concurrency = controller or concurrency.ConcurrencyController(
+            os.path.join(program_dir, CONCURRENCY_STATE_FILENAME)
+        )
+        # 常驻线程池：曲库探测读取文件头和获取随舞文件时长的任务逐个提交，不分批等待，
+        # 线程按需创建，程序退出时调用shutdown()关闭一次
+        self.work_pool = ThreadPoolExecutor(max_workers=LIBRARY_POOL_WORKERS, thread_name_prefix="library")
+        # 曲库扫描时并发探测大量文件
+        self.probe_scheduler = probe_scheduler.ProbeScheduler(controller=self.concurrency, executor=self.work_pool)
         self.library_files = set()
         self.library_dir = os.path.join(program_dir, "曲库")
         self.program_dir = program_dir
-        
-        # 动态并发控制相关参数
-        self.max_workers = min(multiprocessing.cpu_count() + 1, 12)  # 最大线程数不超过12
-        self.low_load_workers = max(2, int(self.max_workers / 2))   # 低负载任务使用较少线程
-        self.high_load_workers = self.max_workers                  # 高负载任务使用较多线程
-        self.task_type = "low_load"  # 默认低负载任务
     
     def preload_audio(self, file_path):
         """预加载音频文件到缓存"""
         try:
             abs_file = os.path.abspath(file_path)
-            if abs_file not in self.audio_cache:
-                try:
-                    from pydub import AudioSegment
-                    # 支持多种音频格式
-                    audio = AudioSegment.from_file(abs_file)
-                    # 添加渐强渐弱效果
-                    audio = audio.fade_in(2000).fade_out(2000)
-                    # 添加到缓存
-                    self.audio_cache.put(abs_file, audio)
-                except Exception as e:
-                    # 预加载失败不影响主流程，仅记录日志
-                    logger.debug(f"预加载音频失败 {os.path.basename(abs_file)}: {e}")
+            try:
+                # 依次检查内存缓存和磁盘PCM缓存；同一文件正在被其他线程加载时等待其结果
+                track_loader.load_track(abs_file, self.audio_cache, self.pcm_cache)
+            except Exception as e:
+                # 预加载失败不影响主流程，仅记录日志
+                logger.debug(f"预加载音频失败 {os.path.basename(abs_file)}: {e}")
             
             # 确保音频文件已缓存时长信息
             self.get_audio_duration(abs_file)
@@ -48,136 +63,242 @@ class AudioProcessor:
             logger.error(f"预加载音频文件 {os.path.basename(file_path)} 失败：{e}")
             return False
     
-    def get_audio_duration(self, file_path):
-        """获取音频文件的时长，优先从缓存获取，没有时计算并更新缓存"""
-        return cache_utils.get_audio_duration(file_path, self.duration_cache)
-    
-    def get_worker_count(self, task_type=None):
-        """根据任务类型获取合适的线程数"""
-        current_task_type = task_type if task_type else self.task_type
-        if current_task_type == "high_load":
-            return self.high_load_workers
-        else:
-            return self.low_load_workers
+    def get_audio_duration(self, file_path, exact=False):
+        """获取音频文件的时长，优先从缓存获取，没有时读取文件头探测并更新缓存"""
+        with self.tracer.span("probe", "library", file=os.path.basename(file_path)) as span:
+            if self.track_index is not None:
+                return self.track_index.get_duration(file_path, exact=exact, span=span)
+            return cache_utils.get_audio_duration(file_path, self.duration_cache, exact=exact, span=span)
     
-    def set_task_type(self, task_type):
-        """设置当前任务类型"""
-        if task_type in ["low_load", "high_load"]:
-            self.task_type = task_type
+    def shutdown(self):
+        """关闭常驻线程池，写入时长缓存日志中缓冲的记录（程序退出时调用）"""
+        self.work_pool.shutdown(wait=True, cancel_futures=True)
+        if isinstance(self.duration_cache, duration_journal.DurationJournal):
+            self.duration_cache.close()
     
     def save_duration_cache(self):
-        """保存时长缓存到文件"""
+        """保存时长缓存：索引只提交变化的条目，JSON缓存的新条目追加到预写日志（普通字典时整体写入文件）"""
+        if self.track_index is not None:
+            self.track_index.flush()
+            return
+        if isinstance(self.duration_cache, duration_journal.DurationJournal):
+            self.duration_cache.flush()
+            return
         cache_utils.save_duration_cache(self.duration_cache_file, self.duration_cache)
     
-    def process_library_file(self, file_path, status_signal=None):
-        """处理单个曲库文件的加载"""
-        try:
-            # 检查是否已在缓存中
-            if file_path not in self.duration_cache:
-                # 计算时长并加入缓存
-                self.get_audio_duration(file_path)
-            return True
-        except Exception as e:
-            if status_signal:
-                status_signal.emit(f"加载曲库文件 {os.path.basename(file_path)} 失败：{e}")
-            return False
+    def store_durations(self, entries):
+        """把 (路径, info, 大小, 修改时间) 批量写入时长存储（音轨索引或旧版JSON缓存）"""
+        if self.track_index is not None:
+            self.track_index.put_many(entries)
+            return
+        now = time.time()
+        for file_path, info, _, _ in entries:
+            self.duration_cache[os.path.basename(file_path)] = {"duration": info["duration"], "cache_time": now}
     
-    def load_library_files(self, progress_signal=None, status_signal=None):
-        """加载根目录下固定名为"曲库"的目录中的所有音频文件"""
-        # 清空曲库文件集合
-        self.library_files.clear()
+    def probe_library_files(self, file_paths, signatures, changed, counts, progress_signal=None, status_signal=None,
+                            token=None):
+        """并发探测曲库文件并更新counts（concurrency.Counters）中的新增/变化/失败数量
+
+        结果每PROBE_STORE_BATCH条写入一次时长存储，取消时已探测的结果同样写入；
+        文件头和ffprobe都无法识别的文件最后逐个完整解码。
+        """
+        total = len(file_paths)
+        pending = []
+        failed = []
         
-        # 检查缓存文件是否存在且不为空
-        import os
-        if os.path.exists(self.duration_cache_file) and os.path.getsize(self.duration_cache_file) > 0 and len(self.duration_cache) > 0:
-            if status_signal:
-                status_signal.emit("缓存文件已存在，跳过曲库文件加载")
-            return
+        def _flush():
+            if pending:
+                self.store_durations(pending)
+                pending.clear()
+        
+        def _on_result(file_path, info):
+            done = counts.add("probed")
+            if info is None:
+                failed.append(file_path)
+            else:
+                pending.append((file_path, info, *signatures[file_path]))
+                counts.add("changed" if file_path in changed else "added")
+                if len(pending) >= PROBE_STORE_BATCH:
+                    _flush()
+            # 曲库加载占总进度的50%，进度变化时才更新
+            progress = int(done / total * 50)
+            if progress_signal and progress != int((done - 1) / total * 50):
+                progress_signal.emit(progress)
         
-        # 支持的音频文件扩展名
-        audio_extensions = ['.mp3', '.wav', '.flac', '.ogg', '.aac', '.m4a', '.wma']
+        with self.tracer.span("probe_many", "library", files=total) as span:
+            try:
+                self.probe_scheduler.probe_many(file_paths, _on_result, token)
+            finally:
+                _flush()
+            span.set(failed=len(failed))
+        
+        for file_path in failed:
+            if token is not None:
+                token.raise_if_cancelled()
+            try:
+                with self.tracer.span("probe_decode", "library", file=os.path.basename(file_path)):
+                    info = audio_probe.probe_decode(file_path)
+            except Exception as e:
+                info = None
+                if status_signal:
+                    status_signal.emit(f"加载曲库文件 {os.path.basename(file_path)} 失败：{e}")
+            if info is None:
+                counts.add("failed")
+                continue
+            self.store_durations([(file_path, info, *signatures[file_path])])
+            counts.add("changed" if file_path in changed else "added")
+    
+    def load_library_files(self, progress_signal=None, status_signal=None, token=None):
+        """增量扫描根目录下固定名为"曲库"的目录：只探测新增或变化的文件，删除已不存在文件的索引
+
+        token（CancellationToken）被取消时不再等待正在探测的文件，保存已探测的结果后返回。
+        返回 {"added": 数量, "changed": 数量, "removed": 数量, "unchanged": 数量, "failed": 数量,
+              "cancelled": 是否被取消}
+        """
+        # 清空曲库文件集合
+        self.library_files.clear()
+        counts = concurrency.Counters("added", "changed", "removed", "unchanged", "failed")
+        cancelled = False
         
         try:
             # 检查曲库目录是否存在
             if not os.path.exists(self.library_dir):
                 if status_signal:
                     status_signal.emit("曲库目录不存在")
-                return
+                return self._scan_result(counts, cancelled)
             
-            # 遍历曲库目录中的所有文件
-            all_files = []
-            for root, dirs, files in os.walk(self.library_dir):
-                for file in files:
-                    # 检查文件扩展名
-                    if any(file.lower().endswith(ext) for ext in audio_extensions):
-                        # 获取文件的绝对路径
-                        file_path = os.path.abspath(os.path.join(root, file))
-                        all_files.append(file_path)
+            # 遍历曲库目录，记录每个文件的大小和修改时间
+            with self.tracer.span("scan", "library") as span:
+                current = library_scan.scan_directory(self.library_dir, token)
+                span.set(files=len(current))
+            self.library_files = set(current)
             
-            # 更新曲库文件集合
-            self.library_files = set(all_files)
-            total_files = len(all_files)
+            # 与已保存的记录比较
+            if self.track_index is not None:
+                stored = self.track_index.signatures(self.library_dir)
+            else:
+                # 旧版JSON缓存只有文件名，已缓存的文件视为未变化
+                stored = {
+                    path: signature for path, signature in current.items()
+                    if os.path.basename(path) in self.duration_cache
+                }
+            delta = library_scan.diff_signatures(current, stored)
+            counts.add("unchanged", delta["unchanged"])
+            counts.add("removed", len(delta["removed"]))
             
-            # 将曲库中的所有歌曲加入缓存
-            success_count = 0
-            fail_count = 0
+            # 删除已不存在文件的索引
+            if delta["removed"] and self.track_index is not None:
+                self.track_index.remove(delta["removed"])
             
-            def _process_file(file_path):
-                nonlocal success_count, fail_count
-                if self.process_library_file(file_path, status_signal):
-                    success_count += 1
-                    return True
-                else:
-                    fail_count += 1
-                    return False
+            # 只探测新增或变化的文件
+            to_probe = delta["added"] + delta["changed"]
+            changed = set(delta["changed"])
+            total_files = len(to_probe)
             
-            # 使用线程池并发加载曲库文件
             if total_files > 0:
-                # 默认使用并发，后续可以根据需要添加参数控制
-                use_concurrency = True
+                if status_signal:
+                    status_signal.emit(f"开始并发探测曲库文件，共 {total_files} 个新增或变化的文件")
                 
-                if use_concurrency:
-                    if status_signal:
-                        status_signal.emit(f"开始并发加载曲库文件，共 {total_files} 个")
-                    
-                    # 并发处理所有文件，但会定期检查并发设置是否变化
-                    results = []
-                    # 分批处理
-                    batch_size = max(1, total_files // 10)
-                    batches = [all_files[i:i+batch_size] for i in range(0, total_files, batch_size)]
-                    
-                    current_index = 0
-                    for batch in batches:
-                        # 使用动态线程数处理当前批次
-                        with ThreadPoolExecutor(max_workers=self.get_worker_count()) as executor:
-                            batch_results = list(executor.map(_process_file, batch))
-                            results.extend(batch_results)
-                        
-                        # 更新进度
-                        current_index += len(batch)
-                        progress = int(current_index / total_files * 50)  # 曲库加载占总进度的50%
-                        if progress_signal:
-                            progress_signal.emit(progress)
+                # 文件头在常驻线程池中读取，无法识别的由异步调度的ffprobe进程探测，结果分批写入
+                self.probe_library_files(to_probe, current, changed, counts, progress_signal, status_signal, token)
             
             # 保存更新后的缓存
             self.save_duration_cache()
             
             # 更新状态
-            status_msg = f"已加载曲库，成功：{success_count} 个文件，失败：{fail_count} 个文件"
+            status_msg = (
+                f"曲库扫描完成：新增 {counts['added']} 个，变化 {counts['changed']} 个，"
+                f"删除 {counts['removed']} 个，未变化 {counts['unchanged']} 个，失败 {counts['failed']} 个"
+            )
+            logger.info(status_msg)
             if status_signal:
                 status_signal.emit(status_msg)
             
+        except cancellation.OperationCancelled:
+            # 保存已探测的结果，下次启动只需探测剩余的文件
+            cancelled = True
+            self.save_duration_cache()
+            status_msg = (
+                f"曲库扫描已取消：已保存 {counts['added'] + counts['changed']} 个文件的时长，"
+                f"删除 {counts['removed']} 个"
+            )
+            logger.info(status_msg)
+            if status_signal:
+                status_signal.emit(status_msg)
         except Exception as e:
             if status_signal:
                 status_signal.emit(f"加载曲库目录失败：{e}")
             self.library_files.clear()
+        self.tracer.finish("曲库扫描")
+        return self._scan_result(counts, cancelled)
+    
+    @staticmethod
+    def _scan_result(counts, cancelled):
+        result = counts.snapshot()
+        result.pop("probed", None)
+        result["cancelled"] = cancelled
+        return result
+    
+    def stored_signatures(self, directory):
+        """时长存储中目录下文件的 {路径: (大小, 修改时间)}；旧版JSON缓存没有记录，返回空字典"""
+        if self.track_index is None:
+            return {}
+        return self.track_index.signatures(directory)
+    
+    def apply_library_changes(self, file_paths, directories=(), token=None):
+        """按目录监视器报告的变化增量更新时长存储（在监视线程中调用）
+
+        file_paths为变化的文件，directories为需要整体重新扫描的目录；只探测新增或变化的文件，
+        删除已不存在文件的索引并更新曲库文件集合。
+        返回 {"added", "changed", "removed", "failed": 数量, "files": 受影响的文件列表}
+        """
+        counts = concurrency.Counters("added", "changed", "removed", "failed")
+        current = {}
+        stored = {}
+        for directory in directories:
+            current.update(library_scan.scan_directory(directory, token))
+            stored.update(self.stored_signatures(directory))
+        for file_path in file_paths:
+            abs_path = os.path.abspath(file_path)
+            try:
+                st = os.stat(abs_path)
+                current[abs_path] = (st.st_size, st.st_mtime)
+            except OSError:
+                current.pop(abs_path, None)
+            if self.track_index is not None:
+                entry = self.track_index.get(abs_path)
+                if entry:
+                    stored[abs_path] = (entry["size"], entry["mtime"])
+        
+        delta = library_scan.diff_signatures(current, stored)
+        if delta["removed"] and self.track_index is not None:
+            self.track_index.remove(delta["removed"])
+        counts.add("removed", len(delta["removed"]))
+        to_probe = delta["added"] + delta["changed"]
+        try:
+            if to_probe:
+                self.probe_library_files(to_probe, current, set(delta["changed"]), counts, token=token)
+        finally:
+            self.save_duration_cache()
+            library_prefix = os.path.join(os.path.abspath(self.library_dir), '')
+            self.library_files.difference_update(delta["removed"])
+            self.library_files.update(path for path in current if path.startswith(library_prefix))
+        
+        result = counts.snapshot()
+        result.pop("probed", None)
+        result["files"] = to_probe + delta["removed"]
+        if result["files"]:
+            logger.info(
+                f"曲库变化：新增 {result['added']} 个，变化 {result['changed']} 个，"
+                f"删除 {result['removed']} 个，失败 {result['failed']} 个"
+            )
+        return result
     
     def auto_load_dance_files(self, progress_signal=None, status_signal=None, use_concurrency=True):
         """自动读取随舞目录下的所有音频文件并随机排序"""
         import random
         
         dance_dir = os.path.join(self.program_dir, "随舞")
-        audio_extensions = ['.mp3', '.wav', '.flac', '.ogg', '.aac', '.m4a', '.wma']
         
         try:
             # 检查目录是否存在
@@ -191,7 +312,7 @@ class AudioProcessor:
             for file in os.listdir(dance_dir):
                 file_path = os.path.join(dance_dir, file)
                 if os.path.isfile(file_path):
-                    if any(file.lower().endswith(ext) for ext in audio_extensions):
+                    if library_scan.is_audio_file(file):
                         # 使用绝对路径
                         abs_path = os.path.abspath(file_path)
                         audio_files.append(abs_path)
@@ -218,28 +339,28 @@ class AudioProcessor:
                     return False
             
             # 获取随舞文件时长信息，无论是否使用并发
-            processed_count = 0
+            counts = concurrency.Counters("processed", "done")
+            
+            def _on_done(ok):
+                if ok:
+                    counts.add("processed")
+                done = counts.add("done")
+                if progress_signal and int(done / total_files * 100) != int((done - 1) / total_files * 100):
+                    progress_signal.emit(int(done / total_files * 100))
+            
             if audio_files:
                 if status_signal:
                     status_signal.emit(f"开始获取随舞文件时长，共 {len(audio_files)} 个")
                 
                 if use_concurrency:
-                    # 使用动态线程数并发获取时长，减少线程数避免卡顿
-                    with ThreadPoolExecutor(max_workers=self.get_worker_count()) as executor:
-                        results = list(executor.map(_get_file_duration, audio_files))
-                        processed_count = sum(results)
+                    self.submit_limited(self.dance_duration_limiter(), _get_file_duration, audio_files, _on_done)
                 else:
                     # 不使用并发，顺序获取时长
                     for file_path in audio_files:
-                        if _get_file_duration(file_path):
-                            processed_count += 1
-                
-                # 更新进度
-                if progress_signal:
-                    progress_signal.emit(100)  # 完成
+                        _on_done(_get_file_duration(file_path))
                 
                 if status_signal:
-                    status_signal.emit(f"成功获取 {processed_count}/{len(audio_files)} 个随舞文件时长")
+                    status_signal.emit(f"成功获取 {counts['processed']}/{len(audio_files)} 个随舞文件时长")
             
             # 保存时长缓存
             self.save_duration_cache()
@@ -251,6 +372,38 @@ class AudioProcessor:
                 status_signal.emit(f"加载音频文件失败：{e}")
             return []
     
+    def dance_duration_limiter(self):
+        """获取随舞文件时长的并发限制；界面线程在等待结果，不按界面卡顿减速"""
+        return self.concurrency.limiter(
+            "dance_duration", 1, DANCE_DURATION_MAX_WORKERS, max(2, DANCE_DURATION_MAX_WORKERS // 2), watch_lag=False
+        )
+    
+    def submit_limited(self, limiter, func, items, on_done=None):
+        """把func(item)逐个提交到常驻线程池并等待全部完成，同时运行的任务数由limiter控制
+
+        有空闲名额时立即提交下一个，不分批等待；on_done(结果)在完成任务的线程中调用（func抛出异常时结果为None）。
+        """
+        def _done(future):
+            ok = not future.cancelled() and future.exception() is None
+            limiter.release(completed=ok)
+            if on_done:
+                on_done(future.result() if ok else None)
+        
+        futures = []
+        try:
+            for item in items:
+                limiter.acquire()
+                try:
+                    future = self.work_pool.submit(func, item)
+                except BaseException:
+                    limiter.release(completed=False)
+                    raise
+                future.add_done_callback(_done)
+                futures.append(future)
+            wait(futures)
+        finally:
+            limiter.finish()
+    
     def calculate_total_duration(self, file_list, countdown_file=None):
         """计算预计的总音频时长"""
         logger.debug(f"calculate_total_duration被调用，文件列表：{file_list}")
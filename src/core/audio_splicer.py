@@ -9,7 +9,12 @@ from datetime import timedelta
 import sys
 
 # 导入常量配置
-from src.constants import COUNTDOWN_FILENAMES, DANCE_DIR_NAME, OUTPUT_FILE_PREFIX, OUTPUT_FILE_EXTENSION
+from src.constants import (
+    COUNTDOWN_FILENAMES, DANCE_DIR_NAME, OUTPUT_FILE_PREFIX, OUTPUT_FILE_EXTENSION,
+    MP3_ENCODE_PRESETS, DEFAULT_MP3_PRESET, MP3_CHUNK_JOBS
+)
+from src.core import mp3_encode
+from src.core import stream_render
 
 def get_audio_files(directory):
     """获取目录下所有音频文件"""
@@ -66,12 +71,30 @@ def format_time(seconds):
     """格式化时间为HH:MM:SS格式"""
     return str(timedelta(seconds=int(seconds)))
 
+def export_mp3(audio, output_file, preset=DEFAULT_MP3_PRESET, jobs=MP3_CHUNK_JOBS):
+    """按编码预设导出MP3，jobs大于1时分块并行编码"""
+    if jobs > 1:
+        encoder = mp3_encode.ChunkedMp3Encoder(output_file, preset=preset, jobs=jobs)
+    else:
+        encoder = stream_render.StreamingEncoder(output_file, codec_args=mp3_encode.preset_codec_args(preset))
+    encoder.start()
+    try:
+        encoder.write(audio)
+        encoder.close()
+    except Exception:
+        encoder.abort()
+        raise
+
 def main():
     # 创建参数解析器
     parser = argparse.ArgumentParser(description='音频拼接工具')
     parser.add_argument('--mode', choices=['random', 'sequential'], default='random',
                       help='拼接模式：random（随机）或 sequential（顺序）')
     parser.add_argument('--output', default=f'{OUTPUT_FILE_PREFIX}{OUTPUT_FILE_EXTENSION}', help='输出文件名')
+    parser.add_argument('--preset', choices=list(MP3_ENCODE_PRESETS), default=DEFAULT_MP3_PRESET,
+                      help='MP3编码预设：fast（快速）、standard（标准）或 high（高质量）')
+    parser.add_argument('--jobs', type=int, default=MP3_CHUNK_JOBS,
+                      help='并行编码的进程数，1表示不分块编码')
     
     args = parser.parse_args()
     
@@ -159,7 +182,7 @@ def main():
     
     # 保存结果
     try:
-        result.export(args.output, format='mp3')
+        export_mp3(result, args.output, args.preset, args.jobs)
         print(f"音频文件已保存到: {args.output}")
     except Exception as e:
         print(f"保存音频失败: {e}")
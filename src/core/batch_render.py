@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""命令行批量渲染
+
+每个任务文件（JSON或YAML）描述一次拼接，相对路径相对于任务文件所在目录：
+
+    {
+        "playlist": ["曲库/a.mp3", "曲库/b.mp3"],
+        "directory": "随舞",
+        "recursive": false,
+        "mode": "random",
+        "seed": 42,
+        "countdown": "倒计时.mp3",
+        "fade_ms": 2000,
+        "output": "输出/周一.mp3",
+        "preset": "standard",
+        "streaming": true,
+        "fragments": false,
+        "smart_render": true,
+        "normalize": true
+    }
+
+playlist和directory二选一；directory按文件名排序，recursive为true时包含子目录。
+mode为random或sequential（默认sequential），seed固定随机顺序。
+countdown省略时使用程序目录中的倒计时.mp3，为null时不插入倒计时。
+fragments为true时使用预编码片段缓存，同一批歌曲换顺序重新拼接时不再解码和编码（相邻两首之间多约26-52毫秒静音，
+与界面一致默认不使用）；
+smart_render为true（默认）时与输出参数一致的MP3只重新编码淡入淡出边缘。
+normalize为true（默认）时按音轨索引中的响度分析结果均衡各首的音量。
+一个文件中也可以是任务列表。任务通过SpliceJob渲染，与界面使用同一套流程，不依赖PyQt。
+试听模式（BatchRenderer的preview_seconds）只渲染各任务的过渡，输出到output同目录的"<文件名>_preview.mp3"。
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.constants import (
+    COUNTDOWN_FILENAMES, FADE_DURATION_MS, MP3_ENCODE_PRESETS, DEFAULT_MP3_PRESET,
+    TRACK_INDEX_FILENAME, PCM_CACHE_DIR_NAME, PCM_CACHE_MAX_BYTES,
+    FRAGMENT_CACHE_DIR_NAME, FRAGMENT_CACHE_MAX_BYTES
+)
+from src.core import audio_processor
+from src.core import decode_pool
+from src.core import splice_job
+from src.utils import cache_utils
+from src.utils import cancellation
+from src.utils import duration_journal
+from src.utils import fragment_cache
+from src.utils import library_scan
+from src.utils import pcm_cache
+from src.utils import tracing
+from src.utils import track_index
+
+JOB_FILE_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+
+class JobError(Exception):
+    """任务文件无效"""
+
+
+def collect_job_files(paths):
+    """展开命令行参数中的任务文件和目录（目录中的任务文件按文件名排序）"""
+    job_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if os.path.splitext(name)[1].lower() in JOB_FILE_EXTENSIONS:
+                    job_files.append(os.path.join(path, name))
+        else:
+            job_files.append(path)
+    return job_files
+
+
+def _parse_job_file(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise JobError("读取YAML任务文件需要安装PyYAML（pip install pyyaml）")
+            try:
+                return yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                # YAMLError不是ValueError的子类
+                raise JobError(f"读取任务文件{path}失败：{e}")
+        return json.load(f)
+
+
+def load_job_file(path, program_dir):
+    """读取任务文件，返回规范化后的任务列表"""
+    try:
+        data = _parse_job_file(path)
+    except (OSError, ValueError) as e:
+        raise JobError(f"读取任务文件{path}失败：{e}")
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list) or not data:
+        raise JobError(f"任务文件{path}中没有任务")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return [
+        normalize_job(raw, base_dir, program_dir, stem if len(data) == 1 else f"{stem}#{i + 1}")
+        for i, raw in enumerate(data)
+    ]
+
+
+def normalize_job(raw, base_dir, program_dir, name):
+    """检查任务字段并把相对路径转换为绝对路径"""
+    if not isinstance(raw, dict):
+        raise JobError(f"{name}：任务必须是对象")
+
+    def _path(value):
+        return os.path.normpath(os.path.join(base_dir, os.path.expanduser(str(value))))
+
+    if not raw.get("output"):
+        raise JobError(f"{name}：缺少output")
+    mode = raw.get("mode", "sequential")
+    if mode not in ("random", "sequential"):
+        raise JobError(f"{name}：mode必须是random或sequential")
+    preset = raw.get("preset", DEFAULT_MP3_PRESET)
+    if preset not in MP3_ENCODE_PRESETS:
+        raise JobError(f"{name}：未知的编码预设{preset}，可选：{'/'.join(MP3_ENCODE_PRESETS)}")
+
+    if "playlist" in raw:
+        if not isinstance(raw["playlist"], list):
+            raise JobError(f"{name}：playlist必须是文件列表")
+        files = [_path(file) for file in raw["playlist"]]
+    elif "directory" in raw:
+        files = list_directory(_path(raw["directory"]), bool(raw.get("recursive", False)))
+    else:
+        raise JobError(f"{name}：需要playlist或directory")
+    if not files:
+        raise JobError(f"{name}：歌单为空")
+
+    if "countdown" in raw:
+        countdown = _path(raw["countdown"]) if raw["countdown"] else None
+    else:
+        # 与界面一致，默认使用程序目录中的倒计时音频
+        countdown = next(
+            (os.path.join(program_dir, filename) for filename in COUNTDOWN_FILENAMES
+             if os.path.exists(os.path.join(program_dir, filename))),
+            None
+        )
+
+    return {
+        "name": raw.get("name", name),
+        "files": files,
+        "mode": mode,
+        "seed": raw.get("seed"),
+        "countdown": countdown,
+        "fade_ms": int(raw.get("fade_ms", FADE_DURATION_MS)),
+        "output": _path(raw["output"]),
+        "preset": preset,
+        "streaming": bool(raw.get("streaming", True)),
+        "fragments": bool(raw.get("fragments", False)),
+        "smart_render": bool(raw.get("smart_render", True)),
+        "normalize": bool(raw.get("normalize", True)),
+    }
+
+
+def preview_output_file(output_file):
+    """过渡试听的输出路径：与output同目录，文件名加_preview后缀"""
+    stem, extension = os.path.splitext(output_file)
+    return f"{stem}_preview{extension or '.mp3'}"
+
+
+def list_directory(directory, recursive=False):
+    """列出目录中的音频文件（按路径排序）"""
+    if not os.path.isdir(directory):
+        raise JobError(f"目录不存在：{directory}")
+    if recursive:
+        return sorted(library_scan.scan_directory(directory))
+    return sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and library_scan.is_audio_file(entry.name)
+    )
+
+
+class BatchRenderer:
+    """批量渲染：所有任务共享内存缓存、磁盘PCM缓存、片段缓存、音轨索引和解码池，最多同时执行concurrency个任务"""
+
+    def __init__(self, program_dir, concurrency=1, use_concurrency=True, trace=None, preview_seconds=None, log=print):
+        self.program_dir = program_dir
+        self.concurrency = max(1, concurrency)
+        self.use_concurrency = use_concurrency
+        # 不为None时只渲染过渡试听（每首保留的秒数）
+        self.preview_seconds = preview_seconds
+        # 是否记录阶段耗时并导出trace文件，None时按环境变量决定
+        self.trace = trace
+        self.log = log
+        self.cancel_token = cancellation.CancellationToken()
+        self._log_lock = threading.Lock()
+
+        self.audio_cache = cache_utils.LRUCache(max_bytes=cache_utils.default_cache_budget())
+        try:
+            self.pcm_cache = pcm_cache.PcmDiskCache(os.path.join(program_dir, PCM_CACHE_DIR_NAME), PCM_CACHE_MAX_BYTES)
+        except OSError as e:
+            self.log(f"打开PCM磁盘缓存失败：{e}")
+            self.pcm_cache = None
+        try:
+            self.fragment_cache = fragment_cache.FragmentCache(
+                os.path.join(program_dir, FRAGMENT_CACHE_DIR_NAME), FRAGMENT_CACHE_MAX_BYTES
+            )
+        except OSError as e:
+            self.log(f"打开片段缓存失败：{e}")
+            self.fragment_cache = None
+        duration_cache_file = os.path.join(program_dir, "duration_cache.json")
+        duration_cache = {}
+        try:
+            self.track_index = track_index.TrackIndex(os.path.join(program_dir, TRACK_INDEX_FILENAME))
+            self.track_index.import_duration_cache(duration_cache_file)
+        except sqlite3.Error as e:
+            self.log(f"打开音轨索引失败，将使用JSON时长缓存：{e}")
+            self.track_index = None
+            duration_cache = duration_journal.DurationJournal(duration_cache_file)
+        self.audio_processor = audio_processor.AudioProcessor(
+            audio_cache=self.audio_cache,
+            duration_cache=duration_cache,
+            duration_cache_file=duration_cache_file,
+            program_dir=program_dir,
+            track_index=self.track_index,
+            pcm_cache=self.pcm_cache
+        )
+        self.decode_pool = decode_pool.DecodePool(
+            duration_func=self.audio_processor.get_audio_duration, controller=self.audio_processor.concurrency
+        )
+        # 同时执行的任务平分解码池的在途名额（见SpliceJob.get_lookahead）：每个任务按歌单顺序等待下一首，
+        # 名额被各任务排在后面、已解码但未写入的音轨占满时会互相等待
+        self.pool_lookahead = max(1, (self.decode_pool.max_in_flight - 1) // self.concurrency)
+
+    def _log_job(self, job, message):
+        with self._log_lock:
+            self.log(f"[{job['name']}] {message}")
+
+    def render(self, job):
+        """渲染一个任务，返回 (是否成功, 消息)"""
+        if self.cancel_token.cancelled:
+            return False, splice_job.CANCELLED_MESSAGE
+        output_file = job["output"] if self.preview_seconds is None else preview_output_file(job["output"])
+        splice = splice_job.SpliceJob(
+            job["files"], job["mode"], job["countdown"], output_file, self.audio_cache,
+            use_concurrency=self.use_concurrency,
+            streaming=job["streaming"],
+            pcm_cache=self.pcm_cache,
+            decode_pool=self.decode_pool,
+            encode_preset=job["preset"],
+            duration_func=self.audio_processor.get_audio_duration,
+            fade_ms=job["fade_ms"],
+            seed=job["seed"],
+            tracer=tracing.make_tracer(self.program_dir, self.trace),
+            fragment_cache=self.fragment_cache if job["fragments"] else None,
+            smart_render=job["smart_render"],
+            track_index=self.track_index,
+            normalize=job["normalize"],
+            preview_seconds=self.preview_seconds,
+            pool_lookahead=self.pool_lookahead,
+            status_callback=lambda message: self._log_job(job, message)
+        )
+        unregister = self.cancel_token.register(splice.cancel_token.cancel)
+        try:
+            return splice.run()
+        finally:
+            unregister()
+
+    def run(self, jobs):
+        """按顺序提交任务，返回与jobs一一对应的 (是否成功, 消息) 列表"""
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = [executor.submit(self.render, job) for job in jobs]
+            results = []
+            for future in futures:
+                try:
+                    # 轮询等待，主线程可以及时响应Ctrl+C
+                    results.append(cancellation.wait_future(future, self.cancel_token))
+                except cancellation.OperationCancelled:
+                    # 取消后各任务很快返回
+                    results.append(future.result())
+            return results
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=True)
+
+    def cancel(self):
+        """取消所有任务：各任务终止自己的编码进程和解码池的工作进程"""
+        self.cancel_token.cancel()
+
+    def close(self):
+        self.decode_pool.shutdown()
+        self.audio_processor.shutdown()
+        self.audio_processor.save_duration_cache()
+        if self.track_index is not None:
+            self.track_index.close()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""多进程解码池
+
+每个工作进程执行ffmpeg解码、淡入淡出和采样格式转换，把PCM写入父进程预先分配的
+multiprocessing.shared_memory块，父进程直接在共享内存上使用结果而不复制。
+共享内存由父进程按索引中的时长估算大小后创建（Windows上共享内存在最后一个句柄
+关闭时即被释放，不能由子进程创建后交给父进程）；估算不足时结果通过管道返回。
+同时存在的解码结果数量受max_in_flight限制，结果调用close()后释放名额。
+解码时可同时分析响度（淡入淡出之前的PCM），结果随SharedPcm返回；不解码整首时的响度分析（analyze）
+也在同一批工作进程中执行，结果很小，直接通过管道返回。
+传入ConcurrencyController时，同时解码的音轨数在1到max_workers之间按解码吞吐量（MB/秒）自动调整。
+"""
+
+import os
+import math
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from loguru import logger
+
+from src.constants import (
+    FADE_DURATION_MS, OUTPUT_FRAME_RATE, OUTPUT_CHANNELS, OUTPUT_SAMPLE_WIDTH,
+    DECODE_POOL_MAX_WORKERS, DECODE_POOL_MAX_IN_FLIGHT
+)
+from src.utils import concurrency
+from src.utils import loudness
+
+# 按时长估算共享内存大小时额外预留的比例和最小余量（秒）
+_SIZE_SLACK_RATIO = 0.02
+_SIZE_SLACK_SECONDS = 1.0
+
+
+def _decode_worker(abs_file, fade_ms, frame_rate, channels, sample_width, shm_name, shm_size, measure_loudness=False):
+    """在工作进程中解码，返回 (PCM字节数, 共享内存不足时的PCM数据或None, 响度分析结果或None)"""
+    from src.core import track_loader
+    from src.utils import utils
+
+    measured = []
+    audio = track_loader.decode_track(abs_file, fade_ms, on_loudness=measured.append if measure_loudness else None)
+    result = measured[0] if measured else None
+    audio = utils.normalize_segment(audio, frame_rate, channels, sample_width)
+    data = audio.raw_data
+    if shm_name and len(data) <= shm_size:
+        # 工作进程与父进程共用同一个resource_tracker，附加时的重复登记不影响父进程unlink
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            shm.buf[:len(data)] = data
+        finally:
+            shm.close()
+        return len(data), None, result
+    return len(data), data, result
+
+
+class SharedPcm:
+    """解码池返回的PCM数据，接口与AudioSegment/CachedPcm一致
+
+    数据位于共享内存中（或在估算不足时位于普通bytes中），使用完毕后必须调用close()。
+    loudness为解码时的响度分析结果（见loudness.analyze_file），没有分析时为None。
+    """
+
+    def __init__(self, shm, data, length, frame_rate, channels, sample_width, release=None, loudness=None):
+        self._shm = shm
+        self._data = data
+        self.data_length = length
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_width = channels * sample_width
+        self._release = release
+        self.loudness = loudness
+
+    @property
+    def raw_data(self):
+        if self._shm is not None:
+            return self._shm.buf[:self.data_length]
+        return self._data
+
+    def frame_count(self):
+        return self.data_length // self.frame_width
+
+    def __len__(self):
+        """时长（毫秒），与AudioSegment的计算方式一致"""
+        return round(1000 * (self.frame_count() / self.frame_rate))
+
+    def to_segment(self):
+        """复制数据生成AudioSegment"""
+        from pydub import AudioSegment
+        return AudioSegment(
+            data=bytes(self.raw_data),
+            sample_width=self.sample_width,
+            frame_rate=self.frame_rate,
+            channels=self.channels
+        )
+
+    def close(self):
+        """释放共享内存和在途名额（可重复调用）"""
+        shm, self._shm = self._shm, None
+        self._data = None
+        if shm is not None:
+            try:
+                shm.close()
+            except BufferError:
+                # 仍有memoryview引用，映射由垃圾回收关闭，名称先行删除
+                pass
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
+        release, self._release = self._release, None
+        if release:
+            release()
+
+
+class DecodePool:
+    def __init__(self, max_workers=DECODE_POOL_MAX_WORKERS, max_in_flight=DECODE_POOL_MAX_IN_FLIGHT,
+                 duration_func=None, frame_rate=OUTPUT_FRAME_RATE, channels=OUTPUT_CHANNELS,
+                 sample_width=OUTPUT_SAMPLE_WIDTH, controller=None):
+        self.max_workers = max(1, max_workers)
+        self.max_in_flight = max(1, max_in_flight)
+        # 用于估算共享内存大小的时长查询函数（返回秒数）
+        self.duration_func = duration_func
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        # 同时在工作进程中解码的音轨数
+        if controller is not None:
+            self._limiter = controller.limiter("decode", 1, self.max_workers, self.max_workers)
+        else:
+            self._limiter = concurrency.fixed_limiter("decode", self.max_workers)
+
+    def _get_executor(self):
+        # 进程池在第一次解码时才启动
+        with self._executor_lock:
+            if self._executor is None:
+                # 统一使用spawn：fork出的工作进程会继承其他线程正在启动的ffprobe等子进程的管道，
+                # 导致这些线程一直阻塞（Windows本来就只支持spawn）
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def estimate_bytes(self, abs_file):
+        """按时长估算解码后的PCM字节数，无法估算时返回0"""
+        if self.duration_func is None:
+            return 0
+        try:
+            duration = float(self.duration_func(abs_file) or 0)
+        except Exception:
+            return 0
+        if duration <= 0:
+            return 0
+        seconds = duration * (1 + _SIZE_SLACK_RATIO) + _SIZE_SLACK_SECONDS
+        return math.ceil(seconds * self.frame_rate) * self.channels * self.sample_width
+
+    def decode(self, file_path, fade_ms=FADE_DURATION_MS, measure_loudness=False):
+        """在工作进程中解码一个音轨，返回SharedPcm（使用完毕后需调用close()）；
+        measure_loudness为True时同时分析响度，结果在SharedPcm.loudness中"""
+        abs_file = os.path.abspath(file_path)
+        self._in_flight.acquire()
+        shm = None
+        try:
+            size = self.estimate_bytes(abs_file)
+            if size:
+                shm = shared_memory.SharedMemory(create=True, size=size)
+            with self._limiter.slot() as slot:
+                future = self._get_executor().submit(
+                    _decode_worker, abs_file, fade_ms, self.frame_rate, self.channels, self.sample_width,
+                    shm.name if shm else None, size, measure_loudness
+                )
+                length, data, measured = future.result()
+                slot.bytes = length
+        except BaseException:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            self._in_flight.release()
+            raise
+
+        if data is not None and shm is not None:
+            logger.debug(f"共享内存估算不足，通过管道返回：{os.path.basename(abs_file)}")
+            shm.close()
+            shm.unlink()
+            shm = None
+        return SharedPcm(shm, data, length, self.frame_rate, self.channels, self.sample_width,
+                         release=self._in_flight.release, loudness=measured)
+
+    def analyze(self, file_path):
+        """在工作进程中分析音轨的响度和峰值，返回Future（结果见loudness.analyze_file）"""
+        return self._get_executor().submit(
+            loudness.analyze_file, os.path.abspath(file_path), self.frame_rate, self.channels
+        )
+
+    def terminate(self):
+        """终止所有工作进程（用于取消）：等待中的decode()抛出异常，下次解码时重新启动进程池"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        terminate_workers = getattr(executor, 'terminate_workers', None)
+        if terminate_workers is not None:
+            terminate_workers()
+            return
+        for process in list((executor._processes or {}).values()):
+            if process.is_alive():
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        """关闭进程池，保存解码并发数的调优结果"""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        self._limiter.finish()
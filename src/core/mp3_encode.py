@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""MP3编码预设和分块并行编码
+
+长时间输出按MP3帧边界切成固定时长的块，由多个ffmpeg进程同时编码：
+- 每块前面多编码几帧（预编码），拼接时丢弃，使保留的第一帧的编码器状态与整体编码时一致；
+  块的起点是整帧，编码延迟固定，丢弃整帧后各块的帧与整体编码时的帧一一对应，拼接处没有间隙
+- 关闭比特池（-reservoir 0），每帧的数据只在本帧内，不会引用到另一个编码进程输出的帧
+- 只有第一块保留ffmpeg写入的Xing/LAME头，拼接完成后按实际帧数、字节数、TOC和末尾填充重写
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from loguru import logger
+
+from src.constants import (
+    OUTPUT_FRAME_RATE, OUTPUT_CHANNELS, OUTPUT_SAMPLE_WIDTH,
+    MP3_ENCODE_PRESETS, DEFAULT_MP3_PRESET,
+    MP3_CHUNK_SECONDS, MP3_CHUNK_JOBS, MP3_CHUNK_PREROLL_FRAMES, MP3_CHUNK_TAIL_FRAMES
+)
+from src.core import stream_render
+from src.utils import audio_probe
+
+# LAME扩展头的编码器标识
+_LAME_TAGS = (b'LAME', b'Lavc', b'Lavf')
+
+
+def preset_codec_args(preset=DEFAULT_MP3_PRESET):
+    """返回编码预设对应的ffmpeg参数"""
+    if preset not in MP3_ENCODE_PRESETS:
+        raise ValueError(f"未知的编码预设：{preset}")
+    return ['-codec:a', 'libmp3lame', *MP3_ENCODE_PRESETS[preset][1]]
+
+
+def _make_crc16_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC16_TABLE = _make_crc16_table()
+
+
+def crc16(data, crc=0):
+    """LAME头使用的CRC-16（多项式0x8005，按位反转）"""
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC16_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def iter_frames(data):
+    """依次产出数据开头连续MP3帧的 (偏移, 长度)，遇到无效帧头或不完整的帧时停止"""
+    pos = 0
+    size = len(data)
+    while pos + 4 <= size:
+        info = audio_probe.parse_mp3_header(data[pos:pos + 4])
+        if info is None or info["frame_length"] <= 0 or pos + info["frame_length"] > size:
+            break
+        yield pos, info["frame_length"]
+        pos += info["frame_length"]
+
+
+def is_info_frame(frame):
+    """判断一帧是否是Xing/Info头帧"""
+    info = audio_probe.parse_mp3_header(frame[:4])
+    if info is None:
+        return False
+    offset = audio_probe.xing_tag_offset(info)
+    return bytes(frame[offset:offset + 4]) in (b'Xing', b'Info')
+
+
+def _lame_tag_offset(frame, info):
+    """返回LAME扩展头在头帧中的偏移，没有LAME扩展头时返回None"""
+    pos = audio_probe.xing_tag_offset(info) + 4
+    flags = struct.unpack_from('>I', frame, pos)[0]
+    pos += 4
+    # 帧数、字节数、TOC、质量指示各自存在时依次占4、4、100、4字节
+    for flag, size in ((0x1, 4), (0x2, 4), (0x4, 100), (0x8, 4)):
+        if flags & flag:
+            pos += size
+    if len(frame) >= pos + 36 and bytes(frame[pos:pos + 4]) in _LAME_TAGS:
+        return pos
+    return None
+
+
+def info_frame_delay(frame):
+    """读取Xing/LAME头中记录的编码器延迟（样本数），没有LAME扩展头时返回None"""
+    info = audio_probe.parse_mp3_header(frame[:4])
+    if info is None:
+        return None
+    lame = _lame_tag_offset(frame, info)
+    if lame is None:
+        return None
+    return (frame[lame + 21] << 4) | (frame[lame + 22] >> 4)
+
+
+def mark_vbr(frame):
+    """把CBR的Info头标记为VBR的Xing头（拼接了不同码率的帧时使用，LAME头的CRC在重写时更新）"""
+    info = audio_probe.parse_mp3_header(frame[:4])
+    offset = audio_probe.xing_tag_offset(info)
+    if bytes(frame[offset:offset + 4]) != b'Info':
+        return frame
+    return frame[:offset] + b'Xing' + frame[offset + 4:]
+
+
+def rewrite_info_frame(frame, frame_offsets, total_bytes, total_samples):
+    """按拼接后的实际内容重写Xing/LAME头
+
+    frame_offsets为每个音频帧在文件中的偏移，total_bytes为头帧和全部音频帧的总字节数，
+    total_samples为编码前的PCM样本数（用于计算末尾填充）。
+    """
+    info = audio_probe.parse_mp3_header(frame[:4])
+    frame = bytearray(frame)
+    frame_count = len(frame_offsets)
+    pos = audio_probe.xing_tag_offset(info) + 4
+    flags = struct.unpack_from('>I', frame, pos)[0]
+    pos += 4
+    if flags & 0x1:
+        struct.pack_into('>I', frame, pos, frame_count)
+        pos += 4
+    if flags & 0x2:
+        struct.pack_into('>I', frame, pos, total_bytes)
+        pos += 4
+    if flags & 0x4:
+        # TOC：按时长百分比定位的字节位置（以文件大小的1/256为单位）
+        for i in range(100):
+            offset = frame_offsets[min(frame_count - 1, i * frame_count // 100)] if frame_count else 0
+            frame[pos + i] = min(255, offset * 256 // total_bytes)
+        pos += 100
+
+    lame = _lame_tag_offset(frame, info)
+    if lame is not None:
+        delay = (frame[lame + 21] << 4) | (frame[lame + 22] >> 4)
+        padding = frame_count * info["samples_per_frame"] - delay - total_samples
+        padding = max(0, min(0xFFF, padding))
+        frame[lame + 21:lame + 24] = ((delay << 12) | padding).to_bytes(3, 'big')
+        struct.pack_into('>I', frame, lame + 28, total_bytes)
+        # 音频数据CRC需要逐字节计算整个文件，这里置0（解码器不校验该字段）
+        struct.pack_into('>H', frame, lame + 32, 0)
+        struct.pack_into('>H', frame, lame + 34, crc16(frame[:lame + 34]))
+    return bytes(frame)
+
+
+class ChunkedMp3Encoder(stream_render.StreamingEncoder):
+    """分块并行编码MP3，接口与StreamingEncoder相同
+
+    写入的PCM每凑满一块就交给一个ffmpeg进程编码，同时编码的块数为jobs，
+    排队等待的块数超过jobs时write()阻塞，内存中最多保留约2*jobs块PCM。
+    进度为各块已编码时长（不含预编码部分）之和。
+    """
+
+    def __init__(self, output_file, preset=DEFAULT_MP3_PRESET, jobs=MP3_CHUNK_JOBS,
+                 chunk_seconds=MP3_CHUNK_SECONDS, frame_rate=OUTPUT_FRAME_RATE,
+                 channels=OUTPUT_CHANNELS, sample_width=OUTPUT_SAMPLE_WIDTH, progress=None):
+        super().__init__(output_file, "mp3", frame_rate, channels, sample_width,
+                         preset_codec_args(preset) + ['-reservoir', '0'], progress=progress)
+        self.jobs = max(1, jobs)
+        self.samples_per_frame = 1152 if frame_rate >= 32000 else 576
+        # 一个MP3帧对应的PCM字节数
+        self.pcm_frame_bytes = self.samples_per_frame * channels * sample_width
+        self.chunk_frames = max(1, int(chunk_seconds * frame_rate) // self.samples_per_frame)
+        self.temp_dir = None
+        self._executor = None
+        self._buffer = bytearray()
+        self._buffer_start = 0  # _buffer[0]在整个PCM流中的字节偏移
+        self._next_frame = 0  # 下一块保留的第一帧的序号
+        self._chunks = []  # [(future, 临时文件, 丢弃的预编码帧数, 保留帧数或None)]
+        self._processes = set()
+        self._process_lock = threading.Lock()
+        self._chunk_seconds = {}  # 块序号 -> 已编码时长（秒）
+        self._aborted = False
+
+    def start(self):
+        # 临时文件放在输出目录中，只有一块时可以直接重命名
+        output_dir = os.path.dirname(os.path.abspath(self.output_file))
+        self.temp_dir = tempfile.mkdtemp(prefix='.mp3chunks_', dir=output_dir)
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._next_frame = 0
+        self._chunks = []
+        self._chunk_seconds = {}
+        self._aborted = False
+        self.bytes_written = 0
+
+    def write_pcm(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        tail_bytes = MP3_CHUNK_TAIL_FRAMES * self.pcm_frame_bytes
+        while True:
+            chunk_end = (self._next_frame + self.chunk_frames) * self.pcm_frame_bytes
+            if self._buffer_start + len(self._buffer) < chunk_end + tail_bytes:
+                break
+            self._submit(chunk_end + tail_bytes, self.chunk_frames)
+        return len(data)
+
+    def _submit(self, end, keep_frames):
+        """把 [当前块起点-预编码, end) 的PCM交给编码进程，end为None时表示剩余的全部数据"""
+        skip = min(self._next_frame, MP3_CHUNK_PREROLL_FRAMES)
+        start = (self._next_frame - skip) * self.pcm_frame_bytes - self._buffer_start
+        stop = None if end is None else end - self._buffer_start
+        data = bytes(self._buffer[start:stop])
+        index = len(self._chunks)
+        path = os.path.join(self.temp_dir, f"{index:05d}.mp3")
+        future = self._executor.submit(self._encode_chunk, index, data, path, skip)
+        self._chunks.append((future, path, skip, keep_frames))
+        del data
+
+        if keep_frames is not None:
+            self._next_frame += keep_frames
+            # 只保留下一块的预编码部分之后的数据
+            keep_from = (self._next_frame - min(self._next_frame, MP3_CHUNK_PREROLL_FRAMES)) * self.pcm_frame_bytes
+            del self._buffer[:keep_from - self._buffer_start]
+            self._buffer_start = keep_from
+        self._wait_for_slot()
+
+    def _wait_for_slot(self):
+        """排队的块过多时等待，并尽早报告编码失败"""
+        pending = [future for future, _, _, _ in self._chunks if not future.done()]
+        if len(pending) > 2 * self.jobs:
+            wait(pending, return_when=FIRST_COMPLETED)
+        for future, _, _, _ in self._chunks:
+            if future.done():
+                future.result()
+
+    def _encode_chunk(self, index, data, path, skip):
+        if self._aborted:
+            raise RuntimeError("编码已取消")
+        # 各块不写ID3标签；只有第一块写Xing/LAME头，拼接后重写
+        muxer_args = ['-id3v2_version', '0', '-write_xing', '1' if index == 0 else '0']
+        process = subprocess.Popen(
+            self.build_command(path, muxer_args),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        with self._process_lock:
+            self._processes.add(process)
+        preroll_seconds = skip * self.samples_per_frame / self.frame_rate
+        chunk_seconds = len(data) / (self.frame_rate * self.channels * self.sample_width) - preroll_seconds
+        feeder = threading.Thread(target=self._feed, args=(process, data), daemon=True)
+        try:
+            feeder.start()
+            del data
+            for seconds in stream_render.iter_progress(process.stdout):
+                self._update_chunk_progress(index, min(chunk_seconds, seconds - preroll_seconds))
+            feeder.join()
+            error = process.stderr.read().decode('utf-8', errors='replace').strip()
+            returncode = process.wait()
+        finally:
+            with self._process_lock:
+                self._processes.discard(process)
+        if returncode != 0:
+            raise RuntimeError(f"第{index + 1}块编码失败（返回码 {returncode}）：{error}")
+        self._update_chunk_progress(index, chunk_seconds)
+
+    @staticmethod
+    def _feed(process, data):
+        """向编码进程写入一块PCM（在单独的线程中进行，同时读取进度输出）"""
+        try:
+            process.stdin.write(data)
+        except (BrokenPipeError, OSError):
+            # 编码进程提前退出，错误信息从stderr读取
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    def _update_chunk_progress(self, index, seconds):
+        if self.progress is None:
+            return
+        with self._process_lock:
+            self._chunk_seconds[index] = max(0.0, seconds)
+            encoded = sum(self._chunk_seconds.values())
+        self.progress.update(encoded)
+
+    def close(self):
+        """编码剩余数据并拼接各块，失败时抛出RuntimeError"""
+        try:
+            self._submit(None, None)
+            self._buffer = bytearray()
+            for future, _, _, _ in self._chunks:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+
+        if len(self._chunks) == 1:
+            # 只有一块时ffmpeg写入的Xing/LAME头已经正确
+            os.replace(self._chunks[0][1], self.output_file)
+        else:
+            self._join()
+        logger.debug(f"分块编码完成：{len(self._chunks)}块，{self.jobs}个进程")
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+        if self.progress:
+            self.progress.finish()
+
+    def _join(self):
+        """按帧拼接各块，并重写第一块的Xing/LAME头"""
+        info_frame = b''
+        frame_offsets = []  # 每个音频帧在输出文件中的偏移
+        position = 0
+        with open(self.output_file, 'wb') as out:
+            for index, (_, path, skip, keep_frames) in enumerate(self._chunks):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                frames = list(iter_frames(data))
+                if index == 0 and frames and is_info_frame(data[:frames[0][1]]):
+                    info_frame = data[:frames[0][1]]
+                    frames = frames[1:]
+                    # 先占位，拼接完成后重写
+                    out.write(info_frame)
+                    position = len(info_frame)
+
+                if keep_frames is None:
+                    selected = frames[skip:]
+                else:
+                    selected = frames[skip:skip + keep_frames]
+                    if len(selected) < keep_frames:
+                        raise RuntimeError(f"第{index + 1}块编码输出的帧数不足")
+                if not selected:
+                    continue
+                begin = selected[0][0]
+                end = selected[-1][0] + selected[-1][1]
+                frame_offsets.extend(position + offset - begin for offset, _ in selected)
+                out.write(memoryview(data)[begin:end])
+                position += end - begin
+                del data
+
+            if info_frame:
+                total_samples = self.bytes_written // (self.channels * self.sample_width)
+                out.seek(0)
+                out.write(rewrite_info_frame(info_frame, frame_offsets, position, total_samples))
+            else:
+                logger.warning("第一块编码输出中没有Xing/LAME头，输出文件不含帧数信息")
+
+    def kill(self):
+        """立即终止所有编码进程，尚未开始的块不再编码（可从其他线程调用，用于取消）"""
+        self._aborted = True
+        with self._process_lock:
+            processes = list(self._processes)
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+    def abort(self):
+        """终止所有编码进程并删除临时文件和未完成的输出文件"""
+        self.kill()
+        self._buffer = bytearray()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+        if self.temp_dir:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+        super().abort()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""过渡试听
+
+完整渲染之前只渲染相邻两首之间的过渡：前一首的最后N秒（带淡出）、倒计时、后一首的开头N秒（带淡入），
+各段过渡之间插入一小段静音。每个窗口由一个ffmpeg进程解码，定位参数放在-i之前（输入端定位），
+只读取窗口附近的数据，渲染耗时与歌单首数有关，与歌曲总时长无关。
+前一首的时长已知（音轨索引）时用-ss从开头定位，否则用-sseof从文件末尾向前定位。
+"""
+
+import os
+import subprocess
+
+from src.constants import (
+    FADE_DURATION_MS, OUTPUT_FRAME_RATE, OUTPUT_CHANNELS, OUTPUT_SAMPLE_WIDTH,
+    PREVIEW_WINDOW_SECONDS, PREVIEW_GAP_MS, PREVIEW_DECODE_JOBS
+)
+from src.core import stream_render
+from src.utils import cache_utils
+
+# 窗口：歌曲的结尾和开头
+TAIL = "tail"
+HEAD = "head"
+
+# 解码结果比窗口短这么多（毫秒）时认为窗口覆盖了整首歌
+_SHORT_TRACK_TOLERANCE_MS = 50
+
+# Windows上不为ffmpeg弹出控制台窗口
+_SUBPROCESS_KWARGS = (
+    {'creationflags': subprocess.CREATE_NO_WINDOW} if hasattr(subprocess, 'CREATE_NO_WINDOW') else {}
+)
+
+
+def window_command(abs_file, seconds, start=None, frame_rate=OUTPUT_FRAME_RATE, channels=OUTPUT_CHANNELS):
+    """解码一个窗口的ffmpeg命令（输出s16le PCM到stdout）；start为None时从文件末尾向前定位seconds秒"""
+    seek = ['-sseof', f"-{seconds:.3f}"] if start is None else ['-ss', f"{start:.3f}"]
+    return [
+        cache_utils.get_ffmpeg_path(), '-hide_banner', '-loglevel', 'error', '-nostdin',
+        *seek, '-t', f"{seconds:.3f}", '-i', abs_file,
+        '-vn', '-f', 's16le', '-ac', str(channels), '-ar', str(frame_rate), 'pipe:1'
+    ]
+
+
+def decode_window(abs_file, seconds, start=None, frame_rate=OUTPUT_FRAME_RATE, channels=OUTPUT_CHANNELS):
+    """解码文件中的一个窗口，返回输出格式的AudioSegment；解码失败时抛出RuntimeError"""
+    from pydub import AudioSegment
+
+    result = subprocess.run(
+        window_command(abs_file, seconds, start, frame_rate, channels),
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **_SUBPROCESS_KWARGS
+    )
+    frame_width = channels * OUTPUT_SAMPLE_WIDTH
+    data = result.stdout[:len(result.stdout) // frame_width * frame_width]
+    if result.returncode != 0 or not data:
+        error = result.stderr.decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f"解码失败：{error or result.returncode}")
+    return AudioSegment(data=data, sample_width=OUTPUT_SAMPLE_WIDTH, frame_rate=frame_rate, channels=channels)
+
+
+def load_window(abs_file, part, seconds=PREVIEW_WINDOW_SECONDS, fade_ms=FADE_DURATION_MS, duration=None):
+    """解码歌曲的结尾（TAIL）或开头（HEAD）窗口并添加与完整渲染相同的淡出或淡入
+
+    duration为歌曲时长（秒，未知时为None）；歌曲不比窗口长时窗口就是整首，两端都添加淡入淡出。
+    """
+    start = 0.0
+    if part == TAIL:
+        start = max(0.0, duration - seconds) if duration else None
+    audio = decode_window(abs_file, seconds, start)
+    whole = (
+        (duration is not None and duration <= seconds)
+        or len(audio) < seconds * 1000 - _SHORT_TRACK_TOLERANCE_MS
+    )
+    if part == TAIL:
+        audio = audio.fade_out(fade_ms)
+        return audio.fade_in(fade_ms) if whole else audio
+    audio = audio.fade_in(fade_ms)
+    return audio.fade_out(fade_ms) if whole else audio
+
+
+def transition_windows(file_list):
+    """按歌单顺序列出每段过渡需要解码的窗口：(前一首, TAIL), (后一首, HEAD), ..."""
+    windows = []
+    for previous, following in zip(file_list, file_list[1:]):
+        windows.append((previous, TAIL))
+        windows.append((following, HEAD))
+    return windows
+
+
+def render_preview(file_list, load_window, encoder, countdown=None, gap_ms=PREVIEW_GAP_MS,
+                   lookahead=PREVIEW_DECODE_JOBS, status_callback=None, progress_callback=None, token=None):
+    """把歌单中每段过渡依次写入编码器
+
+    load_window((文件, TAIL/HEAD))返回添加了淡入淡出的窗口，最多同时解码lookahead个窗口；
+    任一窗口解码失败时跳过这段过渡。返回 ([(前一首, 后一首), ...], 总时长毫秒)；
+    token被取消时抛出OperationCancelled。
+    """
+    windows = transition_windows(file_list)
+    total = len(windows) // 2
+    gap = bytes(int(encoder.frame_rate * gap_ms / 1000) * encoder.channels * encoder.sample_width)
+    transitions = []
+    total_ms = 0
+    tail = tail_error = None
+
+    try:
+        for index, (file, part), audio, error in stream_render.iter_ordered(windows, load_window, lookahead, token):
+            if token is not None and token.cancelled:
+                stream_render.release_track(audio)
+                token.raise_if_cancelled()
+            if part == TAIL:
+                tail, tail_error = audio, error
+                continue
+
+            previous = windows[index - 1][0]
+            if tail is None or error is not None:
+                if status_callback:
+                    status_callback(
+                        f"无法试听{os.path.basename(previous)} → {os.path.basename(file)}：{tail_error or error}"
+                    )
+            else:
+                if transitions:
+                    encoder.write_pcm(gap)
+                    total_ms += gap_ms
+                for segment in (tail, countdown, audio):
+                    if segment is not None:
+                        encoder.write(segment)
+                        total_ms += len(segment)
+                transitions.append((previous, file))
+            tail = tail_error = audio = None
+
+            number = index // 2 + 1
+            if progress_callback:
+                progress_callback(number, total)
+            if status_callback and (number % 10 == 0 or number == total):
+                status_callback(f"已渲染过渡 {number}/{total}")
+    finally:
+        stream_render.release_track(tail)
+
+    return transitions, total_ms
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""智能渲染：只重新编码淡入淡出边缘，中间的MP3帧原样复制
+
+输入是与输出参数一致的MP3（MPEG-1 Layer III、采样率和声道数相同、带LAME头记录的编码延迟）时，
+片段不再整首编码：
+- 开头的淡入窗口和结尾的淡出窗口（连同其后的倒计时）用FragmentEncoder重新编码，
+  中间不受淡入淡出影响的帧从源文件逐字节复制，避免重复编码带来的音质损失
+- 按两边的编码延迟在片段开头补不到一帧的静音，使输出帧与源文件的帧对齐，
+  复制的帧解码后与整首重新编码时的样本位置一致
+- 源文件使用比特池，第一个复制的帧可能引用前面帧中的数据：把这部分数据写到重新编码的
+  最后一帧的空闲位置（不够时提高该帧的码率），或在附近选一个不引用前面数据的帧开始复制
+- 响度均衡的增益量化为global_gain的整数步（每步约1.5dB）：复制的帧修改边信息中的global_gain
+  （与mp3gain相同，不重新编码），重新编码的边缘按同样的倍数放大PCM
+参数不一致、没有LAME头或歌曲太短时抛出SmartRenderUnavailable，由调用方整首重新编码。
+"""
+
+import math
+import struct
+
+from loguru import logger
+
+from src.constants import SMART_RENDER_SEARCH_FRAMES, SMART_RENDER_MIN_COPY_FRAMES, FRAGMENT_PREROLL_FRAMES
+from src.core import fragment_render
+from src.core import mp3_encode
+from src.utils import audio_probe
+from src.utils import loudness
+
+# libmp3lame写入LAME头的编码器延迟（样本数），用于在编码前计算帧对齐
+LAME_ENCODER_DELAY = 576
+
+# MPEG-1 Layer III的码率表（kbps），下标为帧头中的码率索引
+_MPEG1_L3_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+
+# global_gain每加1，解码输出放大2^(1/4)倍
+GLOBAL_GAIN_STEP_DB = 20 * math.log10(2) / 4
+
+
+class SmartRenderUnavailable(Exception):
+    """源文件不能智能渲染（需要整首重新编码）"""
+
+
+def _side_info_range(frame):
+    """返回MPEG-1 Layer III帧边信息的 (起始偏移, 结束偏移)"""
+    # 保护位为0时帧头后有2字节CRC
+    start = 6 if not frame[1] & 0x1 else 4
+    mono = (frame[3] >> 6) == 3
+    return start, start + (17 if mono else 32)
+
+
+def main_data_begin(frame):
+    """帧的主数据从前面帧的主数据中倒数多少字节开始（0表示不引用前面的帧）"""
+    start, _ = _side_info_range(frame)
+    return (frame[start] << 1) | (frame[start + 1] >> 7)
+
+
+def main_data_length(frame):
+    """帧自己的主数据（各颗粒各声道part2_3_length之和）占用的字节数"""
+    start, end = _side_info_range(frame)
+    bits = int.from_bytes(frame[start:end], 'big')
+    total_bits = (end - start) * 8
+    mono = (frame[3] >> 6) == 3
+    channels = 1 if mono else 2
+    # main_data_begin(9) + 私有位(单声道5/双声道3) + scfsi(每声道4)，之后每颗粒每声道59位，以part2_3_length开头
+    position = 9 + (5 if mono else 3) + 4 * channels
+    used = 0
+    for _ in range(2 * channels):
+        used += (bits >> (total_bits - position - 12)) & 0xFFF
+        position += 59
+    return (used + 7) // 8
+
+
+def global_gain_steps(gain_db):
+    """把增益量化为global_gain的步数；提升时不超过请求的增益，保证峰值不超过上限"""
+    steps = round(gain_db / GLOBAL_GAIN_STEP_DB)
+    if steps > 0 and steps * GLOBAL_GAIN_STEP_DB > gain_db:
+        steps -= 1
+    return steps
+
+
+def adjust_global_gain(frame, steps):
+    """把帧中各颗粒各声道的global_gain加上steps，超出范围或帧带CRC时返回None"""
+    if not frame[1] & 0x1:
+        return None
+    start, end = _side_info_range(frame)
+    bits = int.from_bytes(frame[start:end], 'big')
+    total_bits = (end - start) * 8
+    mono = (frame[3] >> 6) == 3
+    channels = 1 if mono else 2
+    # 每颗粒每声道的59位中依次为part2_3_length(12)、big_values(9)、global_gain(8)
+    position = 9 + (5 if mono else 3) + 4 * channels
+    for _ in range(2 * channels):
+        length = (bits >> (total_bits - position - 12)) & 0xFFF
+        shift = total_bits - position - 29
+        value = ((bits >> shift) & 0xFF) + steps
+        position += 59
+        if not length:
+            # 没有数据的颗粒（静音）不受global_gain影响
+            continue
+        if not 0 <= value <= 0xFF:
+            return None
+        bits = (bits & ~(0xFF << shift)) | (value << shift)
+    return frame[:start] + bits.to_bytes(end - start, 'big') + frame[end:]
+
+
+def reservoir_bytes(frames, index, count):
+    """返回第index帧之前各帧主数据区的最后count字节（第index帧通过比特池引用的数据）"""
+    chunks = []
+    needed = count
+    position = index - 1
+    while needed > 0 and position >= 0:
+        frame = frames[position]
+        _, end = _side_info_range(frame)
+        area = frame[end:]
+        chunks.append(area[max(0, len(area) - needed):])
+        needed -= len(area)
+        position -= 1
+    if needed > 0:
+        return None
+    return b''.join(reversed(chunks))
+
+
+def stuff_reservoir(frame, data):
+    """把data写到一个不使用比特池的帧的主数据区末尾，供下一帧引用；
+    空闲位置不够时提高该帧的码率（帧变长）。无法容纳时返回None"""
+    if not data:
+        return frame
+    _, end = _side_info_range(frame)
+    used = main_data_length(frame)
+    if len(frame) - end - used >= len(data):
+        return frame[:len(frame) - len(data)] + data
+    if not frame[1] & 0x1:
+        # 带CRC的帧修改帧头后校验和失效
+        return None
+    header = struct.unpack('>I', frame[:4])[0]
+    sample_rate = audio_probe.parse_mp3_header(frame[:4])["sample_rate"]
+    for index in range(((header >> 12) & 0xF) + 1, len(_MPEG1_L3_BITRATES)):
+        length = 144 * _MPEG1_L3_BITRATES[index] * 1000 // sample_rate
+        if length - end - used >= len(data):
+            # 新码率、不使用填充位
+            new_header = (header & ~(0xF << 12) & ~(1 << 9)) | (index << 12)
+            body = frame[4:end + used]
+            filler = bytes(length - 4 - len(body) - len(data))
+            return struct.pack('>I', new_header) + body + filler + data
+    return None
+
+
+class Mp3Source:
+    """可以复制帧的源MP3文件"""
+
+    def __init__(self, file_path, frame_rate, channels):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        start = audio_probe.find_first_mp3_frame(data)
+        if start is None:
+            raise SmartRenderUnavailable("不是MP3文件")
+        frames = [data[start + offset:start + offset + length] for offset, length in mp3_encode.iter_frames(data[start:])]
+        if not frames or not mp3_encode.is_info_frame(frames[0]):
+            raise SmartRenderUnavailable("没有Xing/LAME头")
+        delay = mp3_encode.info_frame_delay(frames[0])
+        if delay is None:
+            raise SmartRenderUnavailable("没有LAME头，编码延迟未知")
+        self.frames = frames[1:]
+        # 解码输出相对源PCM的总延迟
+        self.delay = delay + fragment_render.MP3_DECODER_DELAY
+        info = audio_probe.parse_mp3_header(frames[0][:4])
+        if not info["mpeg1"] or info["layer"] != 3:
+            raise SmartRenderUnavailable("不是MPEG-1 Layer III")
+        if info["sample_rate"] != frame_rate or info["channels"] != channels:
+            raise SmartRenderUnavailable(f"采样参数不一致（{info['sample_rate']}Hz，{info['channels']}声道）")
+
+    def check_frames(self, start, stop):
+        """确认要复制的帧的采样参数一致（中途改变参数的文件不复制）"""
+        first = self.frames[start]
+        for frame in self.frames[start:stop]:
+            # 同步字、版本、层、采样率和声道模式相同；码率、填充位等可以不同
+            if frame[1] & 0xFE != first[1] & 0xFE or frame[2] & 0x0C != first[2] & 0x0C \
+                    or (frame[3] >> 6 == 3) != (first[3] >> 6 == 3):
+                raise SmartRenderUnavailable("源文件中途改变了采样参数")
+
+
+class SmartRenderer:
+    """用FragmentEncoder重新编码边缘，并与源文件中间的帧组合为片段"""
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.samples_per_frame = encoder.samples_per_frame
+        self.frame_width = encoder.frame_width
+
+    def render(self, source_file, audio, countdown, fade_ms, token=None, gain_db=0.0):
+        """audio为已淡入淡出的音轨（由source_file解码），countdown为None时不带倒计时，
+        gain_db为音轨（不含倒计时）的响度均衡增益；返回Fragment"""
+        encoder = self.encoder
+        spf = self.samples_per_frame
+        source = Mp3Source(source_file, encoder.frame_rate, encoder.channels)
+        steps = global_gain_steps(gain_db)
+        if steps:
+            audio = loudness.apply_gain(
+                audio, steps * GLOBAL_GAIN_STEP_DB, encoder.frame_rate, encoder.channels, encoder.sample_width
+            )
+
+        track = encoder.normalize(audio).raw_data
+        track_samples = len(track) // self.frame_width
+        tail_parts = [track]
+        if countdown is not None:
+            tail_parts.append(encoder.normalize(countdown).raw_data)
+        # 输出第i帧对应源文件第i-shift帧：片段开头补lead个样本的静音使两边的帧边界对齐
+        output_delay = LAME_ENCODER_DELAY + fragment_render.MP3_DECODER_DELAY
+        lead = (source.delay - output_delay) % spf
+        shift = (output_delay + lead - source.delay) // spf
+        samples = lead + sum(len(part) for part in tail_parts) // self.frame_width
+        frame_count = encoder.padded_frame_count(samples)
+
+        # 复制的帧（及其前后各一帧的重叠部分）必须完全在淡入结束之后、淡出开始之前
+        fade = fade_ms * encoder.frame_rate // 1000
+        first = max(1, -(-(fade + spf + source.delay) // spf), 1 - shift)
+        stop = min(len(source.frames), (track_samples - fade - spf + source.delay) // spf)
+        if stop - first - SMART_RENDER_SEARCH_FRAMES < SMART_RENDER_MIN_COPY_FRAMES:
+            raise SmartRenderUnavailable("歌曲太短")
+        source.check_frames(first, stop)
+        copied = source.frames[first:stop]
+        if steps:
+            copied = [adjust_global_gain(frame, steps) for frame in copied]
+            if None in copied:
+                raise SmartRenderUnavailable(f"增益{steps * GLOBAL_GAIN_STEP_DB:+.1f}dB超出global_gain的范围")
+
+        pcm = _PcmView([bytes(lead * self.frame_width), *tail_parts], self.frame_width)
+        preroll = bytes(FRAGMENT_PREROLL_FRAMES * spf * self.frame_width)
+
+        # 开头：多编码SMART_RENDER_SEARCH_FRAMES帧，在其中选择开始复制的位置
+        head_count = first + shift + SMART_RENDER_SEARCH_FRAMES
+        info_frame, delay, head = encoder.encode_frames(
+            [preroll, *pcm.slice(0, head_count * spf)], FRAGMENT_PREROLL_FRAMES, head_count, token
+        )
+        if delay is not None and delay != LAME_ENCODER_DELAY:
+            raise SmartRenderUnavailable(f"编码器延迟为{delay}，与预期不一致")
+        copy_start, joint = self._find_copy_start(source, head, first, shift)
+
+        # 结尾：从复制结束处开始编码，前面用真实音频预编码，末尾补静音到整帧
+        tail_start = stop + shift
+        padding = frame_count * spf - samples
+        _, _, tail = encoder.encode_frames(
+            [*pcm.slice((tail_start - FRAGMENT_PREROLL_FRAMES) * spf, samples), bytes(padding * self.frame_width)],
+            FRAGMENT_PREROLL_FRAMES, frame_count - tail_start, token
+        )
+
+        frames = head[:copy_start + shift - 1] + [joint] + copied[copy_start - first:] + tail
+        logger.debug(
+            f"智能渲染：复制 {stop - copy_start}/{frame_count} 帧，重新编码 {len(frames) - (stop - copy_start)} 帧，"
+            f"增益 {steps * GLOBAL_GAIN_STEP_DB:+.1f}dB"
+        )
+        return encoder.pack(info_frame, delay, frames, samples)
+
+    @staticmethod
+    def _find_copy_start(source, head, first, shift):
+        """在搜索范围内找第一个可以开始复制的源帧，返回 (源帧序号, 替换后的前一帧)"""
+        for index in range(first, first + SMART_RENDER_SEARCH_FRAMES):
+            previous = head[index + shift - 1]
+            needed = main_data_begin(source.frames[index])
+            data = reservoir_bytes(source.frames, index, needed)
+            if data is None:
+                continue
+            joint = stuff_reservoir(previous, data)
+            if joint is not None:
+                return index, joint
+        raise SmartRenderUnavailable("找不到可以开始复制的帧")
+
+
+class _PcmView:
+    """把若干段PCM视为一个连续的缓冲区，按样本位置取出片段（不复制数据）"""
+
+    def __init__(self, parts, frame_width):
+        self.parts = [memoryview(part) for part in parts]
+        self.frame_width = frame_width
+
+    def slice(self, start, stop):
+        """返回样本 [start, stop) 对应的memoryview列表"""
+        start *= self.frame_width
+        stop *= self.frame_width
+        views = []
+        position = 0
+        for part in self.parts:
+            end = position + len(part)
+            if end > start and position < stop:
+                views.append(part[max(0, start - position):min(len(part), stop - position)])
+            position = end
+        return views
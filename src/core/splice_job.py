@@ -0,0 +1,722 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""拼接任务
+
+加载倒计时和歌单中的音轨、渲染（流式或整体）、编码并生成音乐顺序文件；
+试听模式只渲染相邻两首之间的过渡（见preview_render）。
+不依赖PyQt，界面中的SplicingThread和命令行批量渲染共用同一套流程，
+进度和状态通过回调报告。
+"""
+
+import os
+import random
+import threading
+from datetime import timedelta
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from loguru import logger
+
+from src.constants import (
+    STREAM_RENDER_LOOKAHEAD, DEFAULT_MP3_PRESET, FADE_DURATION_MS, FRAGMENT_ENCODE_JOBS, PREVIEW_GAP_MS,
+    PREVIEW_DECODE_JOBS
+)
+from src.core import fragment_render
+from src.core import mp3_encode
+from src.core import preview_render
+from src.core import smart_render
+from src.core import stream_render
+from src.core import track_loader
+from src.utils import cancellation
+from src.utils import loudness
+from src.utils import tracing
+from src.utils import track_index
+from src.utils import utils
+
+# 拼接被取消时返回的消息
+CANCELLED_MESSAGE = "拼接已取消"
+
+
+class SpliceJob:
+    """一次拼接任务
+
+    回调：status_callback(状态文字)、progress_callback(主进度0-100)、
+    save_progress_callback(保存进度百分比, 实时倍率, 预计剩余秒数)。
+    传入tracer（tracing.Tracer）时记录各阶段耗时，结束后输出汇总并导出trace文件。
+    传入fragment_cache（fragment_cache.FragmentCache）时按预编码片段拼接（见render_fragments），
+    smart_render为True时与输出参数一致的MP3只重新编码淡入淡出边缘。
+    传入track_index（track_index.TrackIndex）且normalize为True时按索引中的响度分析结果均衡各首的音量，
+    尚未分析的文件在第一次解码时分析（见load_unscaled）。
+    preview_seconds不为None时只渲染过渡试听（每首保留结尾和开头各preview_seconds秒，见render_preview），
+    不生成音乐顺序文件。
+    多个任务共用一个解码池时，pool_lookahead为每个任务分到的在途名额（见get_lookahead）。
+    """
+
+    def __init__(self, file_list, mode, countdown_file, output_file, cache, use_concurrency=True, streaming=True,
+                 pcm_cache=None, decode_pool=None, encode_preset=DEFAULT_MP3_PRESET, duration_func=None,
+                 fade_ms=FADE_DURATION_MS, seed=None, cancel_token=None, tracer=None, fragment_cache=None,
+                 smart_render=True, track_index=None, normalize=True, preview_seconds=None, pool_lookahead=None,
+                 status_callback=None, progress_callback=None, save_progress_callback=None):
+        self.file_list = list(file_list)
+        self.mode = mode
+        self.countdown_file = countdown_file
+        self.output_file = output_file
+        self.cache = cache  # 接收外部缓存
+        self.use_concurrency = use_concurrency
+        self.streaming = streaming  # 流式渲染：边解码边编码，内存占用不随歌单长度增长
+        self.pcm_cache = pcm_cache  # 磁盘PCM缓存，命中时不再调用ffmpeg解码
+        self.decode_pool = decode_pool if use_concurrency else None  # 多进程解码池
+        self.pool_lookahead = pool_lookahead  # 使用解码池时同时加载的音轨数，None时按解码池的在途上限计算
+        self.encode_preset = encode_preset  # MP3编码预设
+        self.duration_func = duration_func  # 查询音轨时长（秒），用于估算流式渲染的总时长
+        self.fade_ms = fade_ms  # 每首的淡入淡出时长（毫秒）
+        self.seed = seed  # 随机拼接的随机种子，None时每次不同
+        self.cancel_token = cancel_token or cancellation.CancellationToken()
+        self.tracer = tracer or tracing.NULL_TRACER  # 阶段计时
+        self.fragment_cache = fragment_cache  # 预编码片段缓存，命中时不再解码和编码
+        self.smart_render = smart_render  # 智能渲染：复制源文件中不受淡入淡出影响的帧
+        self.track_index = track_index  # 音轨索引，保存响度分析结果
+        self.normalize = normalize  # 响度均衡
+        self.gains = {}  # 绝对路径 -> 响度均衡增益（dB），没有记录的文件不调整
+        # 尚未分析响度的文件：绝对路径 -> (文件, 大小, 修改时间)，第一次加载时分析；
+        # 正在或已经分析的文件：绝对路径 -> Future（分析结束后完成）
+        self._loudness_pending = {}
+        self._loudness_futures = {}
+        self._loudness_lock = threading.Lock()
+        self.preview_seconds = preview_seconds  # 过渡试听时每首保留的秒数，None时完整渲染
+        self.status_callback = status_callback
+        self.progress_callback = progress_callback
+        self.save_progress_callback = save_progress_callback
+    
+    def load_countdown(self):
+        """加载倒计时音频，失败时返回None"""
+        if not (self.countdown_file and os.path.exists(self.countdown_file)):
+            return None
+        try:
+            with self.tracer.span("countdown") as span:
+                countdown = self._load_countdown(span)
+            return countdown
+        except Exception as e:
+            self.emit_status(f"加载倒计时音频失败：{e}")
+            return None
+    
+    def _load_countdown(self, span):
+        # 检查缓存中是否有倒计时音频
+        countdown = self.cache.get(self.countdown_file)
+        if countdown:
+            span.set(cache="memory", bytes=len(countdown.raw_data))
+            self.emit_status(f"从缓存加载倒计时音频：{os.path.basename(self.countdown_file)}")
+            return countdown
+        from pydub import AudioSegment
+        # 支持多种音频格式
+        countdown = AudioSegment.from_file(self.countdown_file)
+        span.set(cache="miss", bytes=len(countdown.raw_data))
+        # 添加到缓存并固定，每次拼接都会用到，不参与淘汰
+        self.cache.put(self.countdown_file, countdown, pinned=True)
+        self.emit_status(f"已加载倒计时音频：{os.path.basename(self.countdown_file)}")
+        return countdown
+    
+    def load_track(self, file):
+        """加载单个音轨并添加渐强渐弱效果，依次检查内存缓存和磁盘PCM缓存，最后应用响度均衡增益"""
+        # 内存缓存按字节预算淘汰，流式渲染时回填缓存也不会让内存随歌单长度增长；
+        # 流式渲染直接编码内存映射的磁盘缓存数据和解码池的共享内存数据
+        audio = self.load_unscaled(file, allow_mapped=self.streaming)
+        return self.apply_gain(file, audio)
+
+    def load_unscaled(self, file, allow_mapped):
+        """加载已添加淡入淡出的音轨（不应用增益），返回时该文件的增益已确定
+
+        尚未分析响度的文件由第一个加载它的线程在解码的同时分析（不为分析单独解码），
+        音轨来自缓存、没有解码时单独分析；同时加载同一文件的其他线程等待分析结果。
+        """
+        abs_file = os.path.abspath(file)
+        item, future = self.claim_loudness(abs_file)
+        measured = []
+        try:
+            audio = track_loader.load_track(
+                file, self.cache, self.pcm_cache,
+                allow_mapped=allow_mapped,
+                fade_ms=self.fade_ms,
+                decode_pool=self.decode_pool,
+                tracer=self.tracer,
+                on_loudness=measured.append if item is not None else None
+            )
+            if item is not None:
+                try:
+                    result = measured[0] if measured else self.analyze_file(file)
+                except BaseException:
+                    stream_render.release_track(audio)
+                    raise
+                self.store_loudness(item, result)
+        finally:
+            if item is not None:
+                future.set_result(None)
+        if item is None and future is not None:
+            try:
+                cancellation.wait_future(future, self.cancel_token)
+            except BaseException:
+                stream_render.release_track(audio)
+                raise
+        return audio
+
+    def track_gain(self, file):
+        """音轨的响度均衡增益（dB）"""
+        return self.gains.get(os.path.abspath(file), 0.0)
+
+    def apply_gain(self, file, audio):
+        """应用响度均衡增益，返回新的AudioSegment（原音频的共享内存或映射随即释放）；不需要调整时原样返回"""
+        gain = self.track_gain(file)
+        if not gain:
+            return audio
+        try:
+            with self.tracer.span("gain", file=os.path.basename(file), db=gain):
+                return loudness.apply_gain(audio, gain)
+        finally:
+            stream_render.release_track(audio)
+
+    def analyze_loudness(self, analyze_missing=True):
+        """读取索引中各首的响度分析结果并计算增益；没有结果的文件（新文件或文件已变化）
+        在加载时分析后写入索引（见load_unscaled），同一版本的文件以后不再分析；
+        analyze_missing为False时不分析（过渡试听不解码整首），这些文件不调整音量"""
+        if not (self.normalize and self.track_index is not None):
+            return
+        pending = []
+        with self.tracer.span("loudness", tracks=len(self.file_list)) as span:
+            for file in dict.fromkeys(self.file_list):
+                try:
+                    size, mtime = track_index.file_signature(file)
+                except OSError:
+                    # 加载时再报告
+                    continue
+                result = self.track_index.get_loudness(file, size, mtime)
+                if result is None:
+                    pending.append((file, size, mtime))
+                else:
+                    self.gains[os.path.abspath(file)] = round(loudness.track_gain(*result), 1)
+            span.set(pending=len(pending))
+        if not pending:
+            return
+        if analyze_missing:
+            with self._loudness_lock:
+                self._loudness_pending = {os.path.abspath(item[0]): item for item in pending}
+            self.emit_status(f"{len(pending)} 首歌曲尚未分析响度，将在解码时分析")
+        else:
+            self.emit_status(f"{len(pending)} 首歌曲尚未分析响度，试听时不调整音量")
+
+    def claim_loudness(self, abs_file):
+        """返回 (待分析的条目, Future)：条目不为None时由调用方分析并在结束后设置Future；
+        条目为None而Future不为None时其他线程正在分析；都为None时不需要分析"""
+        with self._loudness_lock:
+            item = self._loudness_pending.pop(abs_file, None)
+            if item is not None:
+                future = self._loudness_futures[abs_file] = Future()
+            else:
+                future = self._loudness_futures.get(abs_file)
+        return item, future
+
+    def loudness_pending(self, file):
+        """文件的增益是否尚未确定（需要在加载时分析）"""
+        abs_file = os.path.abspath(file)
+        with self._loudness_lock:
+            future = self._loudness_futures.get(abs_file)
+            return abs_file in self._loudness_pending or (future is not None and not future.done())
+
+    def analyze_file(self, file):
+        """单独解码分析一个文件的响度（在解码池的工作进程中），失败时返回None"""
+        try:
+            if self.decode_pool is None:
+                self.cancel_token.raise_if_cancelled()
+                return loudness.analyze_file(os.path.abspath(file))
+            return cancellation.wait_future(self.decode_pool.analyze(file), self.cancel_token)
+        except Exception as e:
+            self.cancel_token.raise_if_cancelled()
+            logger.warning(f"分析{os.path.basename(file)}的响度失败：{e}")
+            return None
+
+    def store_loudness(self, item, result):
+        """把 (文件, 大小, 修改时间) 的分析结果写入索引和self.gains"""
+        if result is None:
+            return
+        file, size, mtime = item
+        if not self.track_index.set_loudness(file, size, mtime, result["loudness"], result["peak"]):
+            # 索引中还没有该文件时先探测时长建立条目
+            self.track_index.get_duration(file)
+            self.track_index.set_loudness(file, size, mtime, result["loudness"], result["peak"])
+        self.gains[os.path.abspath(file)] = round(loudness.track_gain(result["loudness"], result["peak"]), 1)
+    
+    def get_lookahead(self):
+        """同时加载的音轨数：使用解码池时比其在途上限少一（或pool_lookahead）；试听时为同时解码的窗口数
+
+        按歌单顺序等待时，最多有lookahead首排在后面的音轨占用解码池名额；共用解码池的所有任务的
+        lookahead之和小于在途上限时，排在最前面的音轨总能拿到名额，否则可能互相等待。
+        """
+        if not self.use_concurrency:
+            return 1
+        if self.preview_seconds is not None:
+            return PREVIEW_DECODE_JOBS
+        if self.decode_pool is not None:
+            if self.pool_lookahead is not None:
+                return max(1, min(self.pool_lookahead, self.decode_pool.max_in_flight - 1))
+            return max(1, self.decode_pool.max_in_flight - 1)
+        return STREAM_RENDER_LOOKAHEAD
+    
+    def update_track_progress(self, done, total):
+        """更新解码进度（占主进度的0-80%），减少更新频率（每5%进度更新一次）"""
+        progress = int(done / total * 80)
+        if done == 1 or progress % 5 == 0 or done == total:
+            self.emit_progress(progress)
+    
+    def prepare_output_dir(self):
+        """确保输出目录存在"""
+        output_dir = os.path.dirname(self.output_file)
+        if output_dir and not os.path.exists(output_dir):
+            try:
+                os.makedirs(output_dir)
+                self.emit_status(f"已创建输出目录：{output_dir}")
+            except Exception as e:
+                self.emit_status(f"创建输出目录失败：{e}")
+    
+    def emit_status(self, message):
+        if self.status_callback:
+            self.status_callback(message)
+    
+    def emit_progress(self, progress):
+        if self.progress_callback:
+            self.progress_callback(progress)
+    
+    def emit_save_progress(self, percent, speed=0.0, eta=-1.0):
+        if self.save_progress_callback:
+            self.save_progress_callback(percent, speed, eta)
+    
+    def estimate_total_seconds(self, countdown):
+        """按索引中的时长估算输出总时长，无法估算时返回None"""
+        if self.duration_func is None:
+            return None
+        total = 0.0
+        for file in self.file_list:
+            try:
+                total += self.duration_func(file) or 0
+            except Exception:
+                continue
+        if countdown is not None and len(self.file_list) > 1:
+            total += len(countdown) / 1000 * (len(self.file_list) - 1)
+        return total or None
+    
+    def make_encoder(self, total_seconds=None):
+        """启用并发时分块并行编码MP3，否则使用单个编码进程；进度由编码器报告"""
+        progress = stream_render.EncodeProgress(total_seconds, callback=self.emit_save_progress)
+        if self.use_concurrency:
+            return mp3_encode.ChunkedMp3Encoder(self.output_file, preset=self.encode_preset, progress=progress)
+        return stream_render.StreamingEncoder(
+            self.output_file, codec_args=mp3_encode.preset_codec_args(self.encode_preset), progress=progress
+        )
+    
+    def log_encode_speed(self, encoder):
+        """记录编码速度，便于比较不同机器的性能"""
+        progress = encoder.progress
+        logger.info(
+            f"编码完成：{progress.encoded_seconds:.0f}秒音频，{progress.speed():.1f}x实时，"
+            f"预设 {self.encode_preset}，{'分块并行' if self.use_concurrency else '单进程'}"
+        )
+    
+    def render_streaming(self, countdown):
+        """流式渲染：逐首解码并直接送入编码进程，返回 (播放列表, 总时长毫秒)"""
+        self.emit_status(f"正在流式编码到 {self.output_file}...")
+        self.emit_save_progress(0)
+        
+        encoder = self.make_encoder(self.estimate_total_seconds(countdown))
+        # 流式渲染时解码与编码重叠，export覆盖从启动编码进程到编码完成的整个过程
+        with self.tracer.span("export", streaming=True) as span:
+            encoder.start()
+            unregister = self.cancel_token.register(encoder.kill)
+            try:
+                rendered, total_ms = stream_render.stream_render(
+                    self.file_list,
+                    self.load_track,
+                    encoder,
+                    countdown=countdown,
+                    lookahead=self.get_lookahead(),
+                    status_callback=self.emit_status,
+                    progress_callback=self.update_track_progress,
+                    token=self.cancel_token
+                )
+                if not rendered:
+                    encoder.abort()
+                    return [], 0
+                self.emit_progress(80)
+                self.emit_status("等待编码完成...")
+                with self.tracer.span("encode_flush"):
+                    encoder.close()
+            except Exception:
+                encoder.abort()
+                raise
+            finally:
+                unregister()
+                span.set(bytes=encoder.bytes_written)
+        self.log_encode_speed(encoder)
+        return [os.path.basename(file) for file in rendered], total_ms
+    
+    def load_preview_window(self, window):
+        """解码试听窗口 (文件, TAIL/HEAD)，添加淡入淡出并应用响度均衡增益"""
+        file, part = window
+        duration = None
+        if self.duration_func is not None:
+            try:
+                duration = self.duration_func(file) or None
+            except Exception:
+                duration = None
+        with self.tracer.span("preview_window", file=os.path.basename(file), part=part) as span:
+            audio = preview_render.load_window(os.path.abspath(file), part, self.preview_seconds, self.fade_ms, duration)
+            span.set(bytes=len(audio.raw_data))
+        return self.apply_gain(file, audio)
+
+    def estimate_preview_seconds(self, countdown):
+        """试听输出的最长时长（秒）：每段过渡两个窗口加倒计时，过渡之间有静音"""
+        transitions = len(self.file_list) - 1
+        if transitions < 1:
+            return None
+        countdown_seconds = len(countdown) / 1000 if countdown is not None else 0
+        return (transitions * (2 * self.preview_seconds + countdown_seconds)
+                + (transitions - 1) * PREVIEW_GAP_MS / 1000)
+
+    def render_preview(self, countdown):
+        """过渡试听：只解码每段过渡前后的窗口并流式编码，返回 ([(前一首, 后一首), ...], 总时长毫秒)"""
+        self.emit_status(f"正在渲染过渡试听到 {self.output_file}...")
+        self.emit_save_progress(0)
+
+        encoder = self.make_encoder(self.estimate_preview_seconds(countdown))
+        with self.tracer.span("export", preview=True) as span:
+            encoder.start()
+            unregister = self.cancel_token.register(encoder.kill)
+            try:
+                transitions, total_ms = preview_render.render_preview(
+                    self.file_list,
+                    self.load_preview_window,
+                    encoder,
+                    countdown=countdown,
+                    lookahead=self.get_lookahead(),
+                    status_callback=self.emit_status,
+                    progress_callback=self.update_track_progress,
+                    token=self.cancel_token
+                )
+                if not transitions:
+                    encoder.abort()
+                    return [], 0
+                self.emit_progress(80)
+                self.emit_status("等待编码完成...")
+                with self.tracer.span("encode_flush"):
+                    encoder.close()
+            except Exception:
+                encoder.abort()
+                raise
+            finally:
+                unregister()
+                span.set(bytes=encoder.bytes_written)
+        self.log_encode_speed(encoder)
+        return transitions, total_ms
+
+    def render_in_memory(self, countdown):
+        """整体渲染：先解码全部音轨并合并，再一次性导出，返回 (播放列表, 总时长毫秒)"""
+        segments = []  # 收集所有要拼接的音频片段
+        total_files = len(self.file_list)
+        playlist = []
+        
+        for i, file, audio, load_e in stream_render.iter_ordered(
+            self.file_list, self.load_track, self.get_lookahead(), self.cancel_token
+        ):
+            if load_e is not None:
+                self.emit_status(f"加载{os.path.basename(file)}失败：{load_e}")
+                continue
+            
+            # 如果有倒计时音频且不是第一个片段，在两首之间添加倒计时
+            if countdown and playlist:
+                segments.append(countdown)
+            
+            # 添加到播放列表和片段列表
+            playlist.append(os.path.basename(file))
+            segments.append(audio)
+            
+            self.update_track_progress(i + 1, total_files)
+            if i % 10 == 0 or i == total_files - 1:  # 每10个文件或最后一个文件更新一次状态
+                self.emit_status(f"已添加 {i+1}/{total_files}：{os.path.basename(file)}")
+        
+        if not segments:
+            return [], 0
+        
+        # 批量拼接所有音频片段：一次分配输出缓冲区，每个片段只复制一次
+        self.emit_status("开始拼接所有音频片段...")
+        with self.tracer.span("merge", segments=len(segments)) as span:
+            result = utils.concat_segments(segments, status_callback=self.emit_status, token=self.cancel_token)
+            span.set(bytes=len(result.raw_data))
+        # 拼接结果已包含所有数据，释放片段列表
+        del segments
+        self.emit_status("音频片段拼接完成")
+        
+        # 保存结果
+        self.emit_status(f"正在保存到 {self.output_file}...")
+        self.emit_progress(80)  # 设置保存开始时的主进度值
+        
+        # 导出音频文件，保存进度条按编码器实际编码的时长更新
+        self.cancel_token.raise_if_cancelled()
+        encoder = self.make_encoder(len(result) / 1000)
+        encoder.start()
+        unregister = self.cancel_token.register(encoder.kill)
+        try:
+            with self.tracer.span("export", streaming=False) as span:
+                encoder.write(result)
+                encoder.close()
+                span.set(bytes=encoder.bytes_written)
+        except Exception:
+            encoder.abort()
+            raise
+        finally:
+            unregister()
+        self.log_encode_speed(encoder)
+        return playlist, len(result)
+    
+    def render_fragments(self, countdown):
+        """片段拼接：每首（不是最后一首时带上其后的倒计时）从片段缓存读取，未命中时解码、编码后写入缓存，
+        再按帧连接所有片段，返回 (播放列表, 总时长毫秒)"""
+        self.emit_status("正在准备预编码片段...")
+        settings = fragment_render.fragment_settings(self.encode_preset, self.smart_render)
+        fragments = {}  # (文件, 是否带倒计时) -> Fragment
+        failed = set()
+        try:
+            while True:
+                # 加载失败的歌曲被跳过后，新的最后一首需要不带倒计时的片段
+                files = [file for file in self.file_list if file not in failed]
+                plan = [(file, countdown is not None and i < len(files) - 1) for i, file in enumerate(files)]
+                missing = [key for key in dict.fromkeys(plan) if key not in fragments]
+                if not missing:
+                    break
+                self.prepare_fragments(missing, fragments, failed, settings, countdown)
+            if not plan:
+                return [], 0
+
+            self.emit_progress(80)
+            self.emit_status(f"正在连接{len(plan)}个片段到 {self.output_file}...")
+            self.emit_save_progress(0)
+            with self.tracer.span("concat", fragments=len(plan)) as span:
+                total_samples = fragment_render.concat_fragments(
+                    [fragments[key] for key in plan], self.output_file,
+                    progress_callback=lambda done, total: self.emit_save_progress(int(done / total * 100)),
+                    token=self.cancel_token
+                )
+                span.set(bytes=os.path.getsize(self.output_file))
+            total_ms = round(total_samples * 1000 / fragments[plan[0]].frame_rate)
+        finally:
+            for fragment in fragments.values():
+                fragment.close()
+        logger.info(f"片段拼接完成：{len(plan)}个片段，输出 {total_ms / 1000:.0f}秒音频")
+        return [os.path.basename(file) for file in files], total_ms
+
+    def prepare_fragments(self, keys, fragments, failed, settings, countdown):
+        """读取或编码keys中的片段，放入fragments；无法加载的文件加入failed"""
+        encoder = fragment_render.FragmentEncoder(self.fragment_cache.cache_dir, self.encode_preset)
+        pending = []
+        for file, with_countdown in keys:
+            if self.loudness_pending(file):
+                # 增益在解码时才确定，缓存键在加载后计算（见encode_fragment）
+                pending.append(((file, with_countdown), None))
+                continue
+            try:
+                cache_key = self.fragment_key(file, with_countdown, settings)
+            except OSError as e:
+                self.emit_status(f"加载{os.path.basename(file)}失败：{e}")
+                failed.add(file)
+                continue
+            fragment = self.fragment_cache.get(cache_key)
+            if fragment is None:
+                pending.append(((file, with_countdown), cache_key))
+                continue
+            with self.tracer.span("fragment", file=os.path.basename(file)) as span:
+                span.set(cache="disk", bytes=len(fragment.raw))
+            fragments[(file, with_countdown)] = fragment
+        if not pending:
+            return
+
+        self.emit_status(f"片段缓存命中 {len(keys) - len(pending)}/{len(keys)}，正在编码 {len(pending)} 个片段...")
+        jobs = FRAGMENT_ENCODE_JOBS if self.use_concurrency else 1
+        executor = ThreadPoolExecutor(max_workers=min(jobs, len(pending)))
+        try:
+            futures = [
+                (key, executor.submit(self.encode_fragment, encoder, key, cache_key, countdown, settings))
+                for key, cache_key in pending
+            ]
+            for done, ((file, with_countdown), future) in enumerate(futures, 1):
+                try:
+                    fragments[(file, with_countdown)] = cancellation.wait_future(future, self.cancel_token)
+                except Exception as e:
+                    # 取消时被终止的编码进程不算加载失败
+                    self.cancel_token.raise_if_cancelled()
+                    self.emit_status(f"加载{os.path.basename(file)}失败：{e}")
+                    failed.add(file)
+                self.update_track_progress(done, len(futures))
+        finally:
+            executor.shutdown(wait=not self.cancel_token.cancelled, cancel_futures=True)
+
+    def fragment_key(self, file, with_countdown, settings):
+        """片段的缓存键（包含当前的响度均衡增益），源文件不存在时抛出OSError"""
+        return self.fragment_cache.make_key(
+            file, self.fade_ms, self.countdown_file if with_countdown else None, settings,
+            gain_db=self.track_gain(file)
+        )
+
+    def encode_fragment(self, encoder, key, cache_key, countdown, settings):
+        """解码一首歌并与其后的倒计时一起编码为片段，写入片段缓存；
+        cache_key为None时（增益在解码时才确定）加载后计算缓存键，已缓存时直接使用"""
+        self.cancel_token.raise_if_cancelled()
+        file, with_countdown = key
+        with self.tracer.span("fragment", file=os.path.basename(file), cache="miss") as span:
+            audio = self.load_unscaled(file, allow_mapped=True)
+            try:
+                if cache_key is None:
+                    cache_key = self.fragment_key(file, with_countdown, settings)
+                    fragment = self.fragment_cache.get(cache_key)
+                    if fragment is not None:
+                        span.set(cache="disk", bytes=len(fragment.raw))
+                        return fragment
+
+                with self.tracer.span("encode", file=os.path.basename(file)) as encode_span:
+                    fragment = self.encode_smart(encoder, file, audio, countdown if with_countdown else None)
+                    encode_span.set(smart=fragment is not None)
+                    if fragment is None:
+                        audio = self.apply_gain(file, audio)
+                        fragment = encoder.encode([audio, countdown] if with_countdown else [audio], self.cancel_token)
+            finally:
+                stream_render.release_track(audio)
+                del audio
+            span.set(bytes=len(fragment.raw))
+        if not self.fragment_cache.put(cache_key, fragment):
+            logger.debug(f"未写入片段缓存：{os.path.basename(file)}")
+            return fragment
+        # 改用映射的缓存文件，连接前不在内存中保留所有新编码的片段
+        return self.fragment_cache.get(cache_key) or fragment
+
+    def encode_smart(self, encoder, file, audio, countdown):
+        """智能渲染一个片段，源文件参数与输出不一致等情况下返回None（整首重新编码）"""
+        if not (self.smart_render and file.lower().endswith('.mp3')):
+            return None
+        try:
+            return smart_render.SmartRenderer(encoder).render(
+                file, audio, countdown, self.fade_ms, self.cancel_token, gain_db=self.track_gain(file)
+            )
+        except smart_render.SmartRenderUnavailable as e:
+            logger.debug(f"{os.path.basename(file)}不能智能渲染，整首重新编码：{e}")
+            return None
+
+    def write_playlist_file(self, playlist):
+        """生成与输出文件同名的音乐顺序文件，返回文件路径"""
+        # 获取音频输出文件的目录和文件名（不含扩展名）
+        output_dir = os.path.dirname(self.output_file)
+        output_filename = os.path.basename(self.output_file)
+        # 移除扩展名
+        if '.' in output_filename:
+            output_name_without_ext = output_filename.rsplit('.', 1)[0]
+        else:
+            output_name_without_ext = output_filename
+        # 构造音乐顺序文件路径（与输出文件同名，扩展名为.txt）
+        base_name = os.path.join(output_dir, output_name_without_ext)
+        extension = ".txt"
+        playlist_file = utils.get_unique_filename(base_name, extension)
+        try:
+            with self.tracer.span("playlist", tracks=len(playlist)):
+                self._write_playlist(playlist_file, playlist)
+            self.emit_status(f"已生成音乐顺序文件：{os.path.basename(playlist_file)}")
+        except Exception as e:
+            self.emit_status(f"生成音乐顺序文件失败：{e}")
+        return playlist_file
+    
+    @staticmethod
+    def _write_playlist(playlist_file, playlist):
+        # 确保输出目录存在
+        playlist_dir = os.path.dirname(playlist_file)
+        if playlist_dir and not os.path.exists(playlist_dir):
+            os.makedirs(playlist_dir)
+        with open(playlist_file, "w", encoding="utf-8") as f:
+            f.write("拼接音乐顺序：\n\n")
+            for song in playlist:
+                # 提取纯净的歌曲名
+                pure_song_name = utils.extract_song_name(song)
+                f.write(f"{pure_song_name}\n")
+    
+    def run(self):
+        """执行拼接，返回 (是否成功, 消息)；启用阶段计时时结束后输出汇总"""
+        with self.tracer.span("job", tracks=len(self.file_list)) as span:
+            success, message = self._run()
+            span.set(success=success)
+        self.tracer.finish(os.path.splitext(os.path.basename(self.output_file))[0])
+        return success, message
+    
+    def _run(self):
+        try:
+            self.emit_status("开始拼接音频...")
+            
+            # 加载倒计时音频
+            countdown = self.load_countdown()
+            
+            # 根据模式排序文件
+            if self.mode == "random":
+                # 指定种子时每次得到相同的顺序
+                random.Random(self.seed).shuffle(self.file_list)
+                self.emit_status("已随机排序音频文件")
+            # 否则保持歌单中的顺序（界面中拖动后的顺序）
+            else:
+                self.emit_status("使用歌单中设置的音频顺序")
+            
+            if self.preview_seconds is not None and len(self.file_list) < 2:
+                return False, "歌单中至少需要两首歌才能试听过渡"
+            
+            self.prepare_output_dir()
+            
+            # 取消时终止解码池的工作进程，正在解码的音轨不再等待
+            unregister = None
+            if self.decode_pool is not None:
+                unregister = self.cancel_token.register(self.decode_pool.terminate)
+            try:
+                # 试听时不为尚未分析的文件解码整首
+                self.analyze_loudness(analyze_missing=self.preview_seconds is None)
+                if self.preview_seconds is not None:
+                    playlist, total_ms = self.render_preview(countdown)
+                elif self.fragment_cache is not None:
+                    playlist, total_ms = self.render_fragments(countdown)
+                elif self.streaming:
+                    playlist, total_ms = self.render_streaming(countdown)
+                else:
+                    playlist, total_ms = self.render_in_memory(countdown)
+            except Exception as e:
+                # 编码进程被终止导致的写入失败也按取消处理
+                if self.cancel_token.cancelled:
+                    self.emit_status(CANCELLED_MESSAGE)
+                    return False, CANCELLED_MESSAGE
+                return False, f"拼接音频失败: {e}"
+            finally:
+                if unregister:
+                    unregister()
+            
+            if not playlist:
+                return False, "没有成功拼接任何音频文件"
+            
+            if self.preview_seconds is not None:
+                self.emit_progress(100)
+                duration_str = str(timedelta(seconds=int(total_ms / 1000)))
+                return True, f"试听渲染完成！共 {len(playlist)} 段过渡，时长：{duration_str}\n输出文件：{self.output_file}"
+            
+            self.emit_progress(90)  # 保存完成后更新主进度条
+            
+            # 生成音乐顺序文件
+            playlist_file = self.write_playlist_file(playlist)
+            
+            self.emit_progress(95)  # 生成音乐顺序文件完成后更新进度值
+            
+            # 计算总时长
+            total_duration = total_ms / 1000
+            duration_str = str(timedelta(seconds=int(total_duration)))
+            
+            logger.info(f"音频缓存统计：{self.cache.stats()}")
+            
+            self.emit_progress(100)  # 所有任务完成，设置进度条为100%
+            return True, f"拼接完成！总时长：{duration_str}\n输出文件：{self.output_file}\n音乐顺序已保存到：{os.path.basename(playlist_file)}"
+            
+        except Exception as e:
+            return False, f"拼接过程中发生错误：{e}"
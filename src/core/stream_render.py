@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from src.constants import (
+    OUTPUT_FRAME_RATE, OUTPUT_CHANNELS, OUTPUT_SAMPLE_WIDTH, STREAM_RENDER_LOOKAHEAD
+)
+from src.utils import cache_utils
+from src.utils import cancellation
+from src.utils import utils
+
+# 采样位宽（字节）对应的ffmpeg原始PCM格式
+PCM_FORMATS = {
+    1: 'u8',
+    2: 's16le',
+    4: 's32le',
+}
+
+
+def iter_progress(stream):
+    """解析ffmpeg -progress输出，依次产出已编码的时长（秒）"""
+    for line in stream:
+        key, _, value = line.decode('ascii', errors='ignore').strip().partition('=')
+        # out_time_ms实际上也是微秒，新版本ffmpeg另外输出out_time_us
+        if key in ('out_time_us', 'out_time_ms'):
+            try:
+                yield int(value) / 1000000
+            except ValueError:
+                # 开始编码前为N/A
+                continue
+
+
+class EncodeProgress:
+    """编码进度：按已编码时长计算百分比、实时倍率和预计剩余时间
+
+    callback(百分比, 实时倍率, 剩余秒数)，总时长未知时百分比为0、剩余秒数为-1。
+    编码线程和进度解析线程都可能调用update()，回调最多每interval秒一次。
+    """
+
+    def __init__(self, total_seconds=None, callback=None, interval=0.5):
+        self.total_seconds = total_seconds
+        self.callback = callback
+        self.interval = interval
+        self.started = time.monotonic()
+        self.encoded_seconds = 0.0
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def speed(self):
+        """实时倍率：每秒实际时间编码的音频秒数"""
+        elapsed = time.monotonic() - self.started
+        return self.encoded_seconds / elapsed if elapsed > 0 else 0.0
+
+    def update(self, encoded_seconds, force=False):
+        with self._lock:
+            self.encoded_seconds = max(self.encoded_seconds, encoded_seconds)
+            now = time.monotonic()
+            if not force and now - self._last_report < self.interval:
+                return
+            self._last_report = now
+            encoded = self.encoded_seconds
+            speed = self.speed()
+        if self.total_seconds:
+            percent = min(100, int(encoded * 100 / self.total_seconds))
+            eta = max(0.0, self.total_seconds - encoded) / speed if speed > 0 else -1.0
+        else:
+            percent, eta = 0, -1.0
+        if self.callback:
+            self.callback(percent, speed, eta)
+
+    def finish(self):
+        """编码完成，报告100%"""
+        with self._lock:
+            speed = self.speed()
+        if self.callback:
+            self.callback(100, speed, 0.0)
+
+
+class StreamingEncoder:
+    """单个ffmpeg编码进程，通过stdin接收PCM数据并直接编码输出
+
+    传入progress（EncodeProgress）时按ffmpeg -progress报告的已编码时长更新进度。
+    """
+
+    def __init__(self, output_file, output_format="mp3", frame_rate=OUTPUT_FRAME_RATE,
+                 channels=OUTPUT_CHANNELS, sample_width=OUTPUT_SAMPLE_WIDTH, codec_args=None,
+                 progress=None, muxer_args=None):
+        self.output_file = output_file
+        self.output_format = output_format
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.codec_args = list(codec_args) if codec_args else []
+        self.muxer_args = list(muxer_args) if muxer_args else []
+        self.progress = progress
+        self.process = None
+        self.bytes_written = 0
+        self._progress_thread = None
+
+    def build_command(self, output_file=None, muxer_args=()):
+        """构造ffmpeg编码命令"""
+        return [
+            cache_utils.get_ffmpeg_path(),
+            '-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1', '-y',
+            '-f', PCM_FORMATS[self.sample_width],
+            '-ar', str(self.frame_rate),
+            '-ac', str(self.channels),
+            '-i', 'pipe:0',
+            *self.codec_args,
+            *muxer_args,
+            '-f', self.output_format,
+            output_file or self.output_file
+        ]
+
+    def start(self):
+        """启动编码进程"""
+        self.process = subprocess.Popen(
+            self.build_command(muxer_args=self.muxer_args),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        self.bytes_written = 0
+        # 进度输出必须持续读取，否则管道写满后编码进程会阻塞
+        self._progress_thread = threading.Thread(target=self._read_progress, daemon=True)
+        self._progress_thread.start()
+
+    def _read_progress(self):
+        for seconds in iter_progress(self.process.stdout):
+            if self.progress:
+                self.progress.update(seconds)
+
+    def normalize(self, segment):
+        """把音频段转换为编码器的采样率、声道数和位宽"""
+        return utils.normalize_segment(segment, self.frame_rate, self.channels, self.sample_width)
+
+    def write(self, segment):
+        """把一个音频段的PCM数据写入编码器，返回写入的字节数"""
+        return self.write_pcm(self.normalize(segment).raw_data)
+
+    def write_pcm(self, data):
+        """直接写入已经是编码器格式的PCM数据"""
+        try:
+            self.process.stdin.write(data)
+        except (BrokenPipeError, OSError) as e:
+            raise RuntimeError(f"编码进程已退出：{self._read_error() or e}")
+        self.bytes_written += len(data)
+        return len(data)
+
+    def close(self):
+        """结束输入并等待编码完成，失败时抛出RuntimeError"""
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        error = self._read_error()
+        returncode = self.process.wait()
+        self._progress_thread.join()
+        if returncode != 0:
+            raise RuntimeError(f"编码失败（返回码 {returncode}）：{error}")
+        if self.progress:
+            self.progress.finish()
+
+    def kill(self):
+        """立即终止编码进程（可从其他线程调用，用于取消）"""
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+
+    def abort(self):
+        """终止编码进程并删除未完成的输出文件"""
+        self.kill()
+        if self.process:
+            self.process.wait()
+        if os.path.exists(self.output_file):
+            try:
+                os.remove(self.output_file)
+            except OSError as e:
+                logger.debug(f"删除未完成的输出文件失败：{e}")
+
+    def _read_error(self):
+        try:
+            return self.process.stderr.read().decode('utf-8', errors='replace').strip()
+        except Exception:
+            return ""
+
+
+def iter_ordered(file_list, load_track, lookahead=STREAM_RENDER_LOOKAHEAD, token=None):
+    """按歌单顺序产出 (序号, 文件, 结果, 异常)，同时最多有lookahead个文件在加载
+
+    token被取消时抛出OperationCancelled，不等待正在加载的文件，其结果在加载完成后释放。
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, lookahead))
+    pending = deque()
+    files = iter(enumerate(file_list))
+    
+    def _schedule_next():
+        for index, file in files:
+            pending.append((index, file, executor.submit(load_track, file)))
+            return
+    
+    for _ in range(max(1, lookahead)):
+        _schedule_next()
+    
+    try:
+        while pending:
+            index, file, future = pending.popleft()
+            _schedule_next()
+            try:
+                result = cancellation.wait_future(future, token)
+            except cancellation.OperationCancelled:
+                pending.appendleft((index, file, future))
+                raise
+            except Exception as e:
+                yield index, file, None, e
+                continue
+            yield index, file, result, None
+            del result
+    finally:
+        # 提前结束时释放已加载但未使用的结果（仍在加载的在完成后释放）
+        for _, _, future in pending:
+            if not future.cancel():
+                future.add_done_callback(_release_future)
+        executor.shutdown(wait=token is None or not token.cancelled)
+
+
+def _release_future(future):
+    if not future.cancelled() and future.exception() is None:
+        release_track(future.result())
+
+
+def release_track(audio):
+    """释放共享内存或内存映射等外部资源（AudioSegment无需释放）"""
+    close = getattr(audio, 'close', None)
+    if close is not None:
+        close()
+
+
+def stream_render(file_list, load_track, encoder, countdown=None, lookahead=STREAM_RENDER_LOOKAHEAD,
+                  status_callback=None, progress_callback=None, token=None):
+    """流式渲染歌单
+
+    按歌单顺序解码（最多提前解码lookahead首），每首解码完成后立即写入编码器，
+    内存中同时存在的音轨数量与歌单长度无关。倒计时插入在相邻两首之间。
+    返回 (成功写入的文件列表, 总时长毫秒)；token被取消时抛出OperationCancelled。
+    """
+    total_files = len(file_list)
+    rendered = []
+    total_ms = 0
+
+    for index, file, audio, error in iter_ordered(file_list, load_track, lookahead, token):
+        if token is not None and token.cancelled:
+            release_track(audio)
+            token.raise_if_cancelled()
+        if error is not None:
+            if status_callback:
+                status_callback(f"加载{os.path.basename(file)}失败：{error}")
+            continue
+
+        try:
+            if countdown is not None and rendered:
+                encoder.write(countdown)
+                total_ms += len(countdown)
+            encoder.write(audio)
+            total_ms += len(audio)
+        finally:
+            # 已编码的音轨立即释放
+            release_track(audio)
+            del audio
+        rendered.append(file)
+
+        if progress_callback:
+            progress_callback(index + 1, total_files)
+        if status_callback and (index % 10 == 0 or index == total_files - 1):
+            status_callback(f"已编码 {index + 1}/{total_files}：{os.path.basename(file)}")
+
+    return rendered, total_ms
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""音轨加载
+
+按 内存缓存 → 磁盘PCM缓存 → ffmpeg解码 的顺序获取已添加淡入淡出效果的音轨，
+拼接线程和预加载共用同一套逻辑。
+"""
+
+import os
+
+from loguru import logger
+
+from src.constants import FADE_DURATION_MS, OUTPUT_FRAME_RATE, OUTPUT_CHANNELS, OUTPUT_SAMPLE_WIDTH
+from src.utils import tracing
+from src.utils import utils
+
+
+def decode_track(abs_file, fade_ms=FADE_DURATION_MS, tracer=tracing.NULL_TRACER, on_loudness=None):
+    """解码音频文件并添加渐强渐弱效果；传入on_loudness时在淡入淡出之前分析响度，回调on_loudness(结果)"""
+    from pydub import AudioSegment
+    with tracer.span("decode", file=os.path.basename(abs_file)) as span:
+        # 支持多种音频格式
+        audio = AudioSegment.from_file(abs_file)
+        span.set(bytes=len(audio.raw_data))
+    if on_loudness is not None:
+        from src.utils import loudness
+        with tracer.span("loudness", file=os.path.basename(abs_file)):
+            on_loudness(loudness.analyze_segment(audio))
+    with tracer.span("fade", file=os.path.basename(abs_file), bytes=len(audio.raw_data)):
+        return audio.fade_in(fade_ms).fade_out(fade_ms)
+
+
+def load_track(file_path, memory_cache, pcm_cache=None, allow_mapped=False, fade_ms=FADE_DURATION_MS,
+               decode_pool=None, tracer=tracing.NULL_TRACER, on_loudness=None):
+    """加载一个已添加淡入淡出效果的音轨
+
+    allow_mapped为True时，磁盘缓存命中直接返回内存映射的CachedPcm，使用解码池时
+    直接返回共享内存中的SharedPcm（供流式编码使用，不复制数据、不占用内存缓存预算，
+    用完后需调用close()）；否则返回AudioSegment。
+    内存缓存和磁盘缓存都按 (绝对路径, fade_ms) 区分，不同淡入淡出时长的结果互不复用。
+    tracer记录一个"track"阶段，cache参数为memory/disk/miss。
+    传入on_loudness时，需要解码的音轨在解码的同时分析响度（淡入淡出之前），回调on_loudness(结果)；
+    缓存命中时不解码，也不回调。
+    """
+    abs_file = os.path.abspath(file_path)
+    with tracer.span("track", file=os.path.basename(abs_file)) as span:
+        audio = _load_track(
+            abs_file, memory_cache, pcm_cache, allow_mapped, fade_ms, decode_pool, tracer, span, on_loudness
+        )
+        if tracer.enabled:
+            span.set(bytes=len(audio.raw_data))
+        return audio
+
+
+def _load_track(abs_file, memory_cache, pcm_cache, allow_mapped, fade_ms, decode_pool, tracer, span, on_loudness):
+    # 缓存的音轨已添加淡入淡出，与磁盘缓存一样按淡入淡出时长区分（批量渲染的任务可以设置不同的fade_ms）
+    key = (abs_file, fade_ms)
+    audio = memory_cache.get(key)
+    if audio is not None:
+        span.set(cache="memory")
+        return audio
+
+    if pcm_cache is not None:
+        cached = pcm_cache.get(abs_file, fade_ms, fade_ms)
+        if cached is not None:
+            span.set(cache="disk")
+            if allow_mapped:
+                return cached
+            return memory_cache.get_or_load(key, cached.to_segment)
+
+    span.set(cache="miss")
+    if decode_pool is not None:
+        # 解码和淡入淡出都在工作进程中完成，CPU时间不计入当前线程
+        with tracer.span("decode", file=os.path.basename(abs_file), pool=True):
+            shared = decode_pool.decode(abs_file, fade_ms, measure_loudness=on_loudness is not None)
+        try:
+            if shared.loudness is not None:
+                on_loudness(shared.loudness)
+            if pcm_cache is not None:
+                # 解码池的结果已经是输出格式
+                pcm_cache.put(abs_file, fade_ms, fade_ms, shared)
+            if allow_mapped:
+                return shared
+            segment = shared.to_segment()
+        except BaseException:
+            shared.close()
+            raise
+        shared.close()
+        memory_cache.put(key, segment)
+        return segment
+
+    def _decode():
+        audio = decode_track(abs_file, fade_ms, tracer, on_loudness)
+        if pcm_cache is not None:
+            # 以输出格式写入磁盘缓存，流式编码读取时无需再转换
+            normalized = utils.normalize_segment(audio, OUTPUT_FRAME_RATE, OUTPUT_CHANNELS, OUTPUT_SAMPLE_WIDTH)
+            if not pcm_cache.put(abs_file, fade_ms, fade_ms, normalized):
+                logger.debug(f"未写入PCM缓存：{os.path.basename(abs_file)}")
+        return audio
+
+    return memory_cache.get_or_load(key, _decode)
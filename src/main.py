@@ -3,8 +3,12 @@
 
 import sys
 import os
+import time
 import pathlib
 
+# 启动计时起点（尽量早，用于统计窗口可交互前的耗时）
+startup_started = time.perf_counter()
+
 # 将项目根目录添加到Python路径中，解决模块导入问题
 if getattr(sys, 'frozen', False):
     # 打包后的环境
@@ -26,20 +30,29 @@ import random
 from datetime import timedelta
 
 # 导入常量配置
-from src.constants import COUNTDOWN_FILENAMES, LIBRARY_DIR_NAME
+from src.constants import (
+    COUNTDOWN_FILENAMES, LIBRARY_DIR_NAME, TRACK_INDEX_FILENAME, PCM_CACHE_DIR_NAME, PCM_CACHE_MAX_BYTES,
+    STARTUP_BENCH_ENV_VAR, FRAGMENT_CACHE_DIR_NAME, FRAGMENT_CACHE_MAX_BYTES, DANCE_DIR_NAME,
+    PREVIEW_WINDOW_SECONDS, PREVIEW_FILENAME
+)
 
 # 导入模块化组件
 from PyQt5.QtWidgets import QApplication, QMainWindow, QFileDialog, QMessageBox
-from PyQt5.QtCore import Qt, QThread
+from PyQt5.QtCore import Qt, QThread, QTimer, QUrl
+from PyQt5.QtGui import QDesktopServices
 
 # 导入自定义模块
 from src.utils import cache_utils
-from src.threads import worker_threads
+from src.utils import duration_journal
+from src.utils import pcm_cache
+from src.utils import fragment_cache
+from src.utils import tracing
 from src.core import audio_processor
 from src.ui import ui_components
+from src.ui import lag_monitor
 
-# 在抑制子进程窗口后再导入pydub
-from pydub import AudioSegment
+# pydub在第一次解码时才导入（见track_loader）；音轨索引（sqlite3）、曲库监视、解码池（multiprocessing）和
+# 拼接线程（拼接、编码、响度分析等模块）在第一次使用时才导入，不拖慢窗口显示
 
 # 获取程序运行的目录（处理打包后的情况）
 if getattr(sys, 'frozen', False):
@@ -67,18 +80,27 @@ class MusicCutterApp(QMainWindow):
         self.file_list = []
         self.countdown_file = None
         self.splicing_thread = None
+        self.background_loading = False  # 曲库是否正在后台加载
+        self.library_load_cancelled = False  # 曲库加载是否被用户取消
+        self.closing = False  # 窗口正在关闭（之后不再启动后台任务）
         
         # 并发功能控制 - 默认为启用
         self.use_concurrency = True  # 控制是否使用并发功能的实例变量
         
-        # 音频缓存 - 存储已加载和处理的音频段，使用LRU缓存限制最大100个文件
-        self.audio_cache = cache_utils.LRUCache(capacity=100)
+        # 音频缓存 - 存储已加载和处理的音频段，按PCM字节数限制为物理内存的一定比例
+        self.audio_cache = cache_utils.LRUCache(max_bytes=cache_utils.default_cache_budget())
         
+        # 磁盘PCM缓存 - 解码后的音轨写入磁盘，重启或被内存缓存淘汰后无需再次解码
         # 时长缓存 - 存储音频文件的时长信息
+        # 音轨索引 - 按绝对路径保存时长等信息，首次使用时导入旧版JSON缓存
+        # 片段缓存 - 每首歌与其后的倒计时编码一次，换顺序重新拼接时只连接MP3帧
+        # 以上都在后台线程中打开（见open_storage），打开前按未缓存处理
+        self.pcm_cache = None
+        self.fragment_cache = None
         self.duration_cache_file = os.path.join(program_dir, "duration_cache.json")
-        
-        # 先加载时长缓存
-        self.duration_cache = cache_utils.load_duration_cache(self.duration_cache_file)
+        self.duration_cache = {}
+        self.track_index = None
+        self.storage_opened = False
         
         # 曲库目录相关属性
         self.library_dir = os.path.join(program_dir, "曲库")  # 根目录下固定名为"曲库"的目录
@@ -89,14 +111,29 @@ class MusicCutterApp(QMainWindow):
             audio_cache=self.audio_cache,
             duration_cache=self.duration_cache,
             duration_cache_file=self.duration_cache_file,
-            program_dir=program_dir
+            program_dir=program_dir,
+            track_index=self.track_index,
+            pcm_cache=self.pcm_cache,
+            tracer=tracing.make_tracer(program_dir)
         )
         
+        # 界面事件循环延迟 - 界面卡顿时并发控制器减少后台扫描和解码的并发数
+        self.lag_monitor = lag_monitor.EventLoopLagMonitor(self)
+        self.audio_processor.concurrency.lag_func = self.lag_monitor.lag
+        self.lag_monitor.start()
+        
+        # 曲库和随舞目录监视 - 首次加载完成后启动，新增或变化的文件在后台探测并更新索引和预计时长
+        self.library_watcher = None
+        self.library_watch_signals = None
+        
+        # 多进程解码池 - 拼接时并行解码，第一次拼接时才创建（见open_decode_pool）
+        self.decode_pool = None
+        
         # 自动加载根目录下的倒计时音频
         self.auto_load_countdown()
         
-        # 启动后台线程加载曲库和随舞文件，避免阻塞UI
-        self.start_background_loading()
+        # 窗口显示后再启动后台线程加载曲库，避免阻塞UI
+        QTimer.singleShot(0, self.start_background_loading)
         
     def auto_load_countdown(self):
         """自动加载当前目录下的倒计时音频文件"""
@@ -115,13 +152,96 @@ class MusicCutterApp(QMainWindow):
                 self.ui.status_label.setText("已自动加载当前目录下的倒计时音频")
                 break
                 
+    def open_storage(self, status_signal=None):
+        """打开磁盘PCM缓存、片段缓存和音轨索引（索引不可用时读取JSON时长缓存），在后台加载线程中调用"""
+        if self.storage_opened:
+            return
+        self.storage_opened = True
+        if status_signal:
+            status_signal.emit("正在打开缓存...")
+        pcm = self.open_pcm_cache()
+        self.fragment_cache = self.open_fragment_cache()
+        index = self.open_track_index()
+        if index is None:
+            # 索引不可用（如程序目录位于不支持WAL的网络驱动器）时使用旧版JSON缓存，新条目追加到预写日志；
+            # 打开前已探测的结果也写入日志
+            journal = duration_journal.DurationJournal(self.duration_cache_file)
+            journal.update(self.duration_cache)
+            self.duration_cache = self.audio_processor.duration_cache = journal
+        self.pcm_cache = self.audio_processor.pcm_cache = pcm
+        self.track_index = self.audio_processor.track_index = index
+    
+    def open_track_index(self):
+        """打开音轨索引，失败时返回None"""
+        import sqlite3
+        from src.utils import track_index
+        
+        try:
+            index = track_index.TrackIndex(os.path.join(program_dir, TRACK_INDEX_FILENAME))
+            index.import_duration_cache(self.duration_cache_file)
+            return index
+        except sqlite3.Error as e:
+            print(f"打开音轨索引失败，将使用JSON时长缓存：{e}")
+            return None
+    
+    def open_pcm_cache(self):
+        """打开磁盘PCM缓存，失败时返回None"""
+        try:
+            return pcm_cache.PcmDiskCache(os.path.join(program_dir, PCM_CACHE_DIR_NAME), PCM_CACHE_MAX_BYTES)
+        except OSError as e:
+            print(f"打开PCM磁盘缓存失败：{e}")
+            return None
+    
+    def open_fragment_cache(self):
+        """打开片段缓存，失败时返回None（拼接时改用流式渲染）"""
+        try:
+            return fragment_cache.FragmentCache(
+                os.path.join(program_dir, FRAGMENT_CACHE_DIR_NAME), FRAGMENT_CACHE_MAX_BYTES
+            )
+        except OSError as e:
+            print(f"打开片段缓存失败：{e}")
+            return None
+    
+    def open_decode_pool(self):
+        """创建解码池（只创建一次），工作进程在第一次解码时才启动；按索引中的时长预分配共享内存，
+        同时解码的音轨数由并发控制器调整"""
+        if self.decode_pool is None:
+            from src.core import decode_pool
+            
+            self.decode_pool = decode_pool.DecodePool(
+                duration_func=self.audio_processor.get_audio_duration, controller=self.audio_processor.concurrency
+            )
+        return self.decode_pool
+    
+    def closeEvent(self, event):
+        """退出前取消正在进行的任务、关闭解码池和曲库线程池并提交索引中尚未保存的条目"""
+        # 取消的加载线程结束时仍会调用hide_progress_bar，关闭后不能再启动曲库监视
+        self.closing = True
+        if self.background_loading or self.is_splicing():
+            self.cancel_operation()
+            if self.splicing_thread is not None:
+                self.splicing_thread.wait(2000)
+            if self.background_loading:
+                self.background_thread.wait(2000)
+        self.lag_monitor.stop()
+        if self.library_watcher is not None:
+            self.library_watcher.stop()
+        if self.decode_pool is not None:
+            self.decode_pool.shutdown()
+        self.audio_processor.shutdown()
+        if self.track_index is not None:
+            self.track_index.close()
+        super().closeEvent(event)
+    
     def load_duration_cache(self):
         """从JSON文件加载时长缓存"""
-        self.duration_cache = cache_utils.load_duration_cache(self.duration_cache_file)
+        self.duration_cache = duration_journal.load(self.duration_cache_file)
         self.ui.status_label.setText(f"已加载时长缓存，共 {len(self.duration_cache)} 个文件")
         
     def start_background_loading(self):
         """启动后台线程加载曲库文件，避免阻塞UI（移除随舞目录自动加载）"""
+        from src.threads import worker_threads
+        
         # 创建后台加载线程
         self.background_thread = QThread()
         self.background_worker = worker_threads.BackgroundLoader(
@@ -145,19 +265,74 @@ class MusicCutterApp(QMainWindow):
         # 加载完成后隐藏进度条
         self.background_worker.finished.connect(self.hide_progress_bar)
         
-        # 显示进度条
+        # 显示进度条，加载期间可以取消
         self.ui.progress_bar.setVisible(True)
+        self.background_loading = True
+        self.update_cancel_button()
         
         # 启动线程
         self.background_thread.start()
     
     def hide_progress_bar(self):
-        """加载完成后隐藏进度条"""
+        """加载完成后隐藏进度条，开始监视曲库和随舞目录；取消加载时不监视（曲库不完整，下次启动时重新扫描）"""
         self.ui.progress_bar.setVisible(False)
+        self.background_loading = False
+        self.update_cancel_button()
+        if not self.library_load_cancelled:
+            self.start_library_watcher()
+    
+    def start_library_watcher(self):
+        """监视曲库和随舞目录（只启动一次，窗口关闭后不再启动），变化在监视线程中增量探测"""
+        if self.closing or self.library_watcher is not None:
+            return
+        from src.threads import worker_threads
+        from src.utils import library_watcher
+        
+        self.library_watch_signals = worker_threads.LibraryWatchSignals(self)
+        self.library_watch_signals.changes_applied.connect(self.on_library_changes_applied)
+        self.library_watcher = library_watcher.LibraryWatcher(
+            [self.library_dir, os.path.join(program_dir, DANCE_DIR_NAME)], self.apply_library_changes
+        )
+        self.library_watcher.start()
+    
+    def apply_library_changes(self, file_paths, directories, token):
+        """在监视线程中更新索引，处理完一批后通知界面线程"""
+        counts = self.audio_processor.apply_library_changes(file_paths, directories, token)
+        if counts["files"]:
+            self.library_watch_signals.changes_applied.emit(counts)
+    
+    def on_library_changes_applied(self, counts):
+        """曲库变化已写入索引：更新状态栏，列表中的文件受影响时重新计算预计时长"""
+        self.ui.status_label.setText(
+            f"曲库已更新：新增 {counts['added']} 个，变化 {counts['changed']} 个，"
+            f"删除 {counts['removed']} 个，失败 {counts['failed']} 个"
+        )
+        affected = set(counts["files"])
+        if affected & {os.path.abspath(file_path) for file_path in self.file_list}:
+            self.update_duration_label()
 
-    def load_library_files(self, progress_signal=None, status_signal=None):
+    def load_library_files(self, progress_signal=None, status_signal=None, token=None):
         """加载根目录下固定名为"曲库"的目录中的所有音频文件"""
-        self.audio_processor.load_library_files(progress_signal, status_signal)
+        self.open_storage(status_signal)
+        return self.audio_processor.load_library_files(progress_signal, status_signal, token)
+    
+    def is_splicing(self):
+        return self.splicing_thread is not None and self.splicing_thread.isRunning()
+    
+    def update_cancel_button(self):
+        """有正在进行的拼接或曲库加载时启用取消按钮"""
+        self.ui.cancel_button.setEnabled(self.background_loading or self.is_splicing())
+    
+    def cancel_operation(self):
+        """取消正在进行的拼接和曲库加载"""
+        if self.is_splicing():
+            self.ui.status_label.setText("正在取消拼接...")
+            self.splicing_thread.cancel()
+        if self.background_loading:
+            self.ui.status_label.setText("正在取消加载曲库...")
+            self.library_load_cancelled = True
+            self.background_worker.cancel()
+        self.ui.cancel_button.setEnabled(False)
         
     def auto_load_dance_files(self, show_dialogs=True, progress_signal=None, status_signal=None):
         """自动读取随舞目录下的所有音频文件并随机排序"""
@@ -299,6 +474,9 @@ class MusicCutterApp(QMainWindow):
         )
         
         if file:
+            # 旧的倒计时音频不再固定在缓存中
+            if self.countdown_file:
+                self.audio_cache.unpin(self.countdown_file)
             self.countdown_file = file
             self.ui.countdown_label.setText(os.path.basename(file))
             self.ui.countdown_label.setStyleSheet("color: #000;")
@@ -322,68 +500,132 @@ class MusicCutterApp(QMainWindow):
             # 确保输出文件是MP3格式
             if not file.lower().endswith('.mp3'):
                 file += '.mp3'
-            
-            # 禁用按钮避免重复点击
-            self.ui.merge_button.setEnabled(False)
-            self.ui.status_label.setText("开始拼接音频...")
-            
-            # 获取拼接模式
-            mode = "sequential"
-            if self.mode_combo.currentText() == "随机拼接":
-                mode = "random"
-            
-            # 创建并启动拼接线程
-            self.splicing_thread = worker_threads.SplicingThread(
-                file_list=self.file_list,
-                mode=mode,
-                countdown_file=self.countdown_file,
-                output_file=file,
-                cache=self.audio_cache,
-                use_concurrency=self.use_concurrency
-            )
-            
-            # 连接信号
-            self.splicing_thread.progress_updated.connect(self.ui.progress_bar.setValue)
-            self.splicing_thread.progress_updated.connect(self.handle_progress_for_save_bar)
-            self.splicing_thread.save_progress_updated.connect(self.ui.save_progress_bar.setValue)
-            self.splicing_thread.status_updated.connect(self.ui.status_label.setText)
-            self.splicing_thread.finished.connect(self.on_merge_finished)
-            
-            # 显示进度条
-            self.ui.progress_bar.setVisible(True)
-            
-            # 启动线程
-            self.splicing_thread.start()
+            self.start_splicing(file)
+    
+    def preview_transitions(self):
+        """只渲染相邻两首之间的过渡（每首的结尾和开头），完成后用系统播放器打开"""
+        if len(self.file_list) < 2:
+            QMessageBox.warning(self, "试听失败", "请先添加至少两首音频文件")
+            return
+        self.start_splicing(os.path.join(program_dir, PREVIEW_FILENAME), preview_seconds=PREVIEW_WINDOW_SECONDS)
+    
+    def start_splicing(self, output_file, preview_seconds=None):
+        """创建并启动拼接线程；preview_seconds不为None时只渲染过渡试听"""
+        from src.threads import worker_threads
+        
+        # 禁用按钮避免重复点击
+        self.ui.merge_button.setEnabled(False)
+        self.ui.preview_button.setEnabled(False)
+        self.ui.status_label.setText("开始拼接音频..." if preview_seconds is None else "开始渲染过渡试听...")
+        
+        # 获取拼接模式
+        mode = "sequential"
+        if self.ui.mode_combo.currentText() == "随机拼接":
+            mode = "random"
+        
+        # 创建并启动拼接线程
+        self.splicing_thread = worker_threads.SplicingThread(
+            file_list=self.file_list,
+            mode=mode,
+            countdown_file=self.countdown_file,
+            output_file=output_file,
+            cache=self.audio_cache,
+            use_concurrency=self.use_concurrency,
+            pcm_cache=self.pcm_cache,
+            decode_pool=self.open_decode_pool(),
+            encode_preset=self.ui.preset_combo.currentData(),
+            duration_func=self.audio_processor.get_audio_duration,
+            # 设置环境变量AUDIO_SPLICER_TRACE=1时记录各阶段耗时并导出trace文件
+            tracer=tracing.make_tracer(program_dir),
+            # 片段缓存需要在界面中勾选，默认流式渲染
+            fragment_cache=self.fragment_cache if self.ui.fragments_checkbox.isChecked() else None,
+            smart_render=self.ui.smart_render_checkbox.isChecked(),
+            track_index=self.track_index,
+            normalize=self.ui.normalize_checkbox.isChecked(),
+            preview_seconds=preview_seconds
+        )
+        
+        # 连接信号
+        self.splicing_thread.progress_updated.connect(self.ui.progress_bar.setValue)
+        self.splicing_thread.progress_updated.connect(self.handle_progress_for_save_bar)
+        self.splicing_thread.save_progress_updated.connect(self.handle_save_progress)
+        self.splicing_thread.status_updated.connect(self.ui.status_label.setText)
+        self.splicing_thread.finished.connect(self.on_merge_finished)
+        
+        # 显示进度条
+        self.ui.progress_bar.setVisible(True)
+        
+        # 启动线程
+        self.splicing_thread.start()
+        self.update_cancel_button()
     
     def handle_progress_for_save_bar(self, progress):
         """根据主进度条的值控制保存进度条的显示和隐藏"""
         if progress == 80:
-            # 开始保存，显示保存进度条
-            self.ui.save_progress_bar.setValue(0)
-            self.ui.save_progress_bar.setVisible(True)
+            # 开始保存，显示保存进度条（流式渲染时已在编码过程中显示）
+            if not self.ui.save_progress_bar.isVisible():
+                self.ui.save_progress_bar.setValue(0)
+                self.ui.save_progress_bar.setVisible(True)
         elif progress == 90:
             # 保存完成，隐藏保存进度条
             self.ui.save_progress_bar.setVisible(False)
     
+    def handle_save_progress(self, progress, speed, eta):
+        """更新保存进度条，显示编码的实时倍率和预计剩余时间；流式渲染时编码与解码同时进行，收到进度即显示"""
+        if not self.ui.save_progress_bar.isVisible() and self.ui.progress_bar.value() < 90:
+            self.ui.save_progress_bar.setVisible(True)
+        self.ui.save_progress_bar.setValue(progress)
+        if speed > 0:
+            remaining = str(timedelta(seconds=int(eta))) if eta >= 0 else "未知"
+            self.ui.save_progress_bar.setFormat(f"%p%  编码速度 {speed:.1f}x  剩余 {remaining}")
+        else:
+            self.ui.save_progress_bar.setFormat("%p%")
+    
     def on_merge_finished(self, success, message):
         """拼接完成后的处理"""
+        from src.core.splice_job import CANCELLED_MESSAGE
+        
         # 启用按钮
         self.ui.merge_button.setEnabled(True)
+        self.ui.preview_button.setEnabled(True)
         
         # 隐藏所有进度条
         self.ui.progress_bar.setVisible(False)
         self.ui.save_progress_bar.setVisible(False)
+        self.ui.cancel_button.setEnabled(self.background_loading)
         
         # 更新状态并显示消息
-        if success:
+        if message == CANCELLED_MESSAGE:
+            self.ui.status_label.setText(message)
+        elif success and self.splicing_thread.job.preview_seconds is not None:
+            # 过渡试听直接用系统默认播放器打开
+            self.ui.status_label.setText(message.split('\n')[0])
+            QDesktopServices.openUrl(QUrl.fromLocalFile(self.splicing_thread.job.output_file))
+        elif success:
             self.ui.status_label.setText("拼接完成")
             QMessageBox.information(self, "拼接完成", message)
         else:
             self.ui.status_label.setText("拼接失败")
             QMessageBox.critical(self, "拼接失败", message)
+    
+    def report_startup_time(self):
+        """窗口显示后事件循环第一次空闲时调用，输出启动耗时；启动基准测试时输出后直接退出"""
+        elapsed_ms = (time.perf_counter() - startup_started) * 1000
+        print(f"启动耗时：{elapsed_ms:.0f}ms")
+        # 打包后的程序没有控制台，耗时写入环境变量指定的文件
+        result_file = os.environ.get(STARTUP_BENCH_ENV_VAR)
+        if result_file:
+            with open(result_file, 'w', encoding='utf-8') as f:
+                f.write(f"{elapsed_ms:.1f}")
+            # 关闭窗口时取消并等待后台加载，最后一个窗口关闭后程序退出
+            self.close()
 
 if __name__ == '__main__':
+    # 打包后的程序启动解码池工作进程时需要
+    import multiprocessing
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     main_window = MusicCutterApp()
     main_window.show()
+    QTimer.singleShot(0, main_window.report_startup_time)
     sys.exit(app.exec_())
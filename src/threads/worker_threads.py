@@ -1,16 +1,14 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
-import random
-import threading
-from concurrent.futures import ThreadPoolExecutor
-from datetime import timedelta
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
 
-from PyQt5.QtCore import QThread, pyqtSignal
+from src.constants import DEFAULT_MP3_PRESET
+from src.utils import cancellation
 
-from src.utils import utils
-from src.utils import cache_utils
+class LibraryWatchSignals(QObject):
+    """把监视线程处理完的曲库变化（AudioProcessor.apply_library_changes的结果）转发到界面线程"""
+    changes_applied = pyqtSignal(dict)
 
 class BackgroundLoader(QThread):
     finished = pyqtSignal()
@@ -21,232 +19,72 @@ class BackgroundLoader(QThread):
         super().__init__()
         self.load_library_func = load_library_func
         self.load_dance_func = load_dance_func
+        self.cancel_token = cancellation.CancellationToken()
+    
+    def cancel(self):
+        """请求取消加载（可从界面线程调用）"""
+        self.cancel_token.cancel()
     
     def run(self):
-        import time
-        time.sleep(1)  # 等待1秒，让用户有机会在加载开始前修改并发设置
+        # 窗口显示后才启动加载，无需等待；启动前已取消则直接结束
+        if self.cancel_token.cancelled:
+            self.status_updated.emit("已取消加载曲库")
+            self.finished.emit()
+            return
         
-        # 执行耗时的加载操作
+        # 执行耗时的加载操作（取消时保存已探测的结果后返回）
         self.status_updated.emit("正在加载曲库文件...")
-        self.load_library_func(self.progress_updated, self.status_updated)
+        counts = self.load_library_func(self.progress_updated, self.status_updated, self.cancel_token)
         
         # 只有当load_dance_func不为None时，才尝试加载随舞目录文件
-        if self.load_dance_func is not None:
+        if self.load_dance_func is not None and not self.cancel_token.cancelled:
             self.status_updated.emit("正在加载随舞目录文件...")
             self.load_dance_func(self.progress_updated, self.status_updated)
         
-        # 发送完成信号
-        self.status_updated.emit("缓存构建完成")
+        # 发送完成信号（取消时保留曲库扫描报告的状态）
+        if not (counts and counts.get("cancelled")):
+            self.status_updated.emit("缓存构建完成")
         self.finished.emit()
 
 class SplicingThread(QThread):
     progress_updated = pyqtSignal(int)
-    save_progress_updated = pyqtSignal(int)
+    save_progress_updated = pyqtSignal(int, float, float)  # 百分比、实时倍率、预计剩余秒数（未知时为-1）
     status_updated = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
     
-    def __init__(self, file_list, mode, countdown_file, output_file, cache, use_concurrency=True):
+    def __init__(self, file_list, mode, countdown_file, output_file, cache, use_concurrency=True, streaming=True,
+                 pcm_cache=None, decode_pool=None, encode_preset=DEFAULT_MP3_PRESET, duration_func=None,
+                 tracer=None, fragment_cache=None, smart_render=True, track_index=None, normalize=True,
+                 preview_seconds=None):
         super().__init__()
-        self.file_list = file_list
-        self.mode = mode
-        self.countdown_file = countdown_file
-        self.output_file = output_file
-        self.cache = cache  # 接收外部缓存
-        self.use_concurrency = use_concurrency
+        # 拼接流程在SpliceJob中实现（与命令行批量渲染共用），这里只把回调转换为Qt信号；
+        # 拼接相关模块在第一次拼接时才导入，加载曲库的线程不需要它们
+        from src.core import splice_job
+        
+        self.job = splice_job.SpliceJob(
+            file_list, mode, countdown_file, output_file, cache,
+            use_concurrency=use_concurrency,
+            streaming=streaming,
+            pcm_cache=pcm_cache,
+            decode_pool=decode_pool,
+            encode_preset=encode_preset,
+            duration_func=duration_func,
+            tracer=tracer,
+            fragment_cache=fragment_cache,
+            smart_render=smart_render,
+            track_index=track_index,
+            normalize=normalize,
+            preview_seconds=preview_seconds,
+            status_callback=self.status_updated.emit,
+            progress_callback=self.progress_updated.emit,
+            save_progress_callback=self.save_progress_updated.emit
+        )
+        self.cancel_token = self.job.cancel_token
+    
+    def cancel(self):
+        """请求取消拼接（可从界面线程调用）：终止编码和解码进程，正在进行的等待尽快返回"""
+        self.cancel_token.cancel()
     
     def run(self):
-        try:
-            self.status_updated.emit("开始拼接音频...")
-            
-            # 加载倒计时音频
-            countdown = None
-            if self.countdown_file and os.path.exists(self.countdown_file):
-                try:
-                    # 检查缓存中是否有倒计时音频
-                    countdown = self.cache.get(self.countdown_file)
-                    if countdown:
-                        self.status_updated.emit(f"从缓存加载倒计时音频：{os.path.basename(self.countdown_file)}")
-                    else:
-                        try:
-                            from pydub import AudioSegment
-                            # 支持多种音频格式
-                            countdown = AudioSegment.from_file(self.countdown_file)
-                            # 添加到缓存
-                            self.cache.put(self.countdown_file, countdown)
-                            self.status_updated.emit(f"已加载倒计时音频：{os.path.basename(self.countdown_file)}")
-                        except Exception as load_e:
-                            self.status_updated.emit(f"加载倒计时音频失败：{load_e}")
-                            countdown = None
-                except Exception as e:
-                    self.status_updated.emit(f"加载倒计时音频失败：{e}")
-                    countdown = None
-            
-            # 根据模式排序文件
-            if self.mode == "random":
-                random.shuffle(self.file_list)
-                self.status_updated.emit("已随机排序音频文件")
-            # 否则保持UI中拖动后的顺序
-            else:
-                self.status_updated.emit("使用UI中设置的音频顺序")
-            
-            # 开始拼接
-            segments = []  # 收集所有要拼接的音频片段
-            total_files = len(self.file_list)
-            playlist = []
-            
-            for i, file in enumerate(self.file_list):
-                try:
-                    abs_file = os.path.abspath(file)
-                    # 检查缓存中是否已有该音频
-                    audio = self.cache.get(abs_file)
-                    if audio:
-                        if i % 10 == 0:  # 每10个文件更新一次状态，减少更新频率
-                            self.status_updated.emit(f"从缓存加载：{os.path.basename(file)}")
-                    else:
-                        try:
-                            from pydub import AudioSegment
-                            # 支持多种音频格式
-                            audio = AudioSegment.from_file(abs_file)
-                            # 添加渐强渐弱效果（2000ms）
-                            audio = audio.fade_in(2000).fade_out(2000)
-                            # 添加到缓存
-                            self.cache.put(abs_file, audio)
-                            if i % 10 == 0:  # 每10个文件更新一次状态，减少更新频率
-                                self.status_updated.emit(f"已加载：{os.path.basename(file)}")
-                        except Exception as load_e:
-                            self.status_updated.emit(f"加载{os.path.basename(file)}失败：{load_e}")
-                            continue
-                    
-                    # 添加到播放列表
-                    playlist.append(os.path.basename(file))
-                    
-                    # 添加音频片段到列表
-                    segments.append(audio)
-                    
-                    # 如果有倒计时音频且不是第一个片段，添加倒计时
-                    if countdown and i > 0:
-                        segments.append(countdown)
-                    
-                    # 更新进度，减少更新频率（每5%进度更新一次）
-                    progress = int((i + 1) / total_files * 100)
-                    if i == 0 or progress % 5 == 0 or i == total_files - 1:
-                        self.progress_updated.emit(progress)
-                        if i % 10 == 0 or i == total_files - 1:  # 每10个文件或最后一个文件更新一次状态
-                            self.status_updated.emit(f"已添加 {i+1}/{total_files}：{os.path.basename(file)}")
-                    
-                except Exception as e:
-                    self.status_updated.emit(f"处理{os.path.basename(file)}失败：{e}")
-                    continue
-            
-            # 批量拼接所有音频片段
-            if segments:
-                self.status_updated.emit("开始拼接所有音频片段...")
-                
-                # 使用utils模块中的并行合并函数
-                try:
-                    result = utils.parallel_merge(
-                        segments, 
-                        use_concurrency=self.use_concurrency,
-                        status_callback=self.status_updated.emit
-                    )
-                    self.status_updated.emit("音频片段拼接完成")
-                except Exception as e:
-                    self.status_updated.emit(f"并行合并失败，将使用串行合并: {e}")
-                    try:
-                        # 降级到串行合并
-                        if len(segments) > 1:
-                            result = segments[0]
-                            for seg in segments[1:]:
-                                result += seg
-                        else:
-                            result = segments[0]
-                        self.status_updated.emit("串行合并完成")
-                    except Exception as serial_e:
-                        self.status_updated.emit(f"串行合并也失败: {serial_e}")
-                        self.finished.emit(False, f"拼接音频失败: {serial_e}")
-                        return
-            else:
-                result = None
-            
-            if result is None:
-                self.finished.emit(False, "没有成功拼接任何音频文件")
-                return
-            
-            # 保存结果
-            self.status_updated.emit(f"正在保存到 {self.output_file}...")
-            self.progress_updated.emit(80)  # 设置保存开始时的主进度值
-            # 确保输出目录存在
-            output_dir = os.path.dirname(self.output_file)
-            if output_dir and not os.path.exists(output_dir):
-                try:
-                    os.makedirs(output_dir)
-                    self.status_updated.emit(f"已创建输出目录：{output_dir}")
-                except Exception as e:
-                    self.status_updated.emit(f"创建输出目录失败：{e}")
-            # 创建一个线程来模拟保存进度更新
-            def update_save_progress():
-                # 模拟保存过程中的进度更新（0%-100%）
-                import time
-                # 估算保存时间（假设平均每分钟音频需要2秒保存时间）
-                audio_length_sec = len(result) / 1000
-                estimated_save_time = max(1.0, (audio_length_sec / 60) * 2)
-                
-                # 每0.5秒更新一次进度
-                update_interval = 0.5
-                total_updates = int(estimated_save_time / update_interval)
-                
-                for i in range(total_updates + 1):
-                    # 计算当前进度（0-100%）
-                    progress = min(100, int((i / total_updates) * 100))
-                    self.save_progress_updated.emit(progress)
-                    time.sleep(update_interval)
-            
-            # 启动保存进度更新线程
-            save_progress_thread = threading.Thread(target=update_save_progress)
-            save_progress_thread.daemon = True
-            save_progress_thread.start()
-            
-            # 导出音频文件
-            result.export(self.output_file, format="mp3")
-            self.save_progress_updated.emit(100)  # 保存完成后更新保存进度条
-            self.progress_updated.emit(90)  # 保存完成后更新主进度条
-            
-            # 生成音乐顺序文件
-            # 获取音频输出文件的目录和文件名（不含扩展名）
-            output_dir = os.path.dirname(self.output_file)
-            output_filename = os.path.basename(self.output_file)
-            # 移除扩展名
-            if '.' in output_filename:
-                output_name_without_ext = output_filename.rsplit('.', 1)[0]
-            else:
-                output_name_without_ext = output_filename
-            # 构造音乐顺序文件路径（与输出文件同名，扩展名为.txt）
-            base_name = os.path.join(output_dir, output_name_without_ext)
-            extension = ".txt"
-            playlist_file = utils.get_unique_filename(base_name, extension)
-            try:
-                # 确保输出目录存在
-                playlist_dir = os.path.dirname(playlist_file)
-                if playlist_dir and not os.path.exists(playlist_dir):
-                    os.makedirs(playlist_dir)
-                with open(playlist_file, "w", encoding="utf-8") as f:
-                    f.write("拼接音乐顺序：\n\n")
-                    for song in playlist:
-                        # 提取纯净的歌曲名
-                        pure_song_name = utils.extract_song_name(song)
-                        f.write(f"{pure_song_name}\n")
-                    self.status_updated.emit(f"已生成音乐顺序文件：{os.path.basename(playlist_file)}")
-            except Exception as e:
-                self.status_updated.emit(f"生成音乐顺序文件失败：{e}")
-            
-            self.progress_updated.emit(95)  # 生成音乐顺序文件完成后更新进度值
-            
-            # 计算总时长
-            total_duration = len(result) / 1000
-            duration_str = str(timedelta(seconds=int(total_duration)))
-            
-            self.progress_updated.emit(100)  # 所有任务完成，设置进度条为100%
-            self.finished.emit(True, f"拼接完成！总时长：{duration_str}\n输出文件：{self.output_file}\n音乐顺序已保存到：{os.path.basename(playlist_file)}")
-            
-        except Exception as e:
-            self.finished.emit(False, f"拼接过程中发生错误：{e}")
+        success, message = self.job.run()
+        self.finished.emit(success, message)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+
+from PyQt5.QtCore import QObject, QTimer
+
+from src.constants import LAG_MONITOR_INTERVAL_MS
+
+
+class EventLoopLagMonitor(QObject):
+    """测量界面事件循环的延迟，供并发控制器在界面卡顿时减少后台任务的并发数
+
+    定时器每interval_ms毫秒触发一次，实际间隔超出的部分即为事件循环的延迟；
+    lag()可在任意线程中调用，返回最近的延迟（按半衰衰减）与当前已阻塞的时长中较大的一个（毫秒）。
+    """
+
+    # 每次定时器触发时旧延迟保留的比例
+    DECAY = 0.5
+
+    def __init__(self, parent=None, interval_ms=LAG_MONITOR_INTERVAL_MS):
+        super().__init__(parent)
+        self.interval_ms = interval_ms
+        self._last_tick = time.monotonic()
+        self._lag_ms = 0.0
+        self._timer = QTimer(self)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self._tick)
+
+    def start(self):
+        self._last_tick = time.monotonic()
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = max(0.0, (now - self._last_tick) * 1000 - self.interval_ms)
+        self._last_tick = now
+        self._lag_ms = max(lag, self._lag_ms * self.DECAY)
+
+    def lag(self):
+        if not self._timer.isActive():
+            return 0.0
+        # 事件循环正被阻塞时定时器不会触发，按距上次触发的时长计算
+        stalled = (time.monotonic() - self._last_tick) * 1000 - self.interval_ms
+        return max(self._lag_ms, stalled)
@@ -11,6 +11,8 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import Qt, pyqtSignal
 
+from src.constants import MP3_ENCODE_PRESETS, DEFAULT_MP3_PRESET, PREVIEW_WINDOW_SECONDS
+
 class UiComponents:
     # 定义组件访问接口
     @property
@@ -21,10 +23,26 @@ class UiComponents:
     def mode_combo(self):
         return self._mode_combo
 
+    @property
+    def preset_combo(self):
+        return self._preset_combo
+
     @property
     def concurrency_checkbox(self):
         return self._concurrency_checkbox
 
+    @property
+    def fragments_checkbox(self):
+        return self._fragments_checkbox
+
+    @property
+    def smart_render_checkbox(self):
+        return self._smart_render_checkbox
+
+    @property
+    def normalize_checkbox(self):
+        return self._normalize_checkbox
+
     @property
     def countdown_label(self):
         return self._countdown_label
@@ -57,6 +75,14 @@ class UiComponents:
     def merge_button(self):
         return self._merge_button
 
+    @property
+    def preview_button(self):
+        return self._preview_button
+
+    @property
+    def cancel_button(self):
+        return self._cancel_button
+
     @property
     def duration_label(self):
         return self._duration_label
@@ -129,6 +155,14 @@ class UiComponents:
         self._mode_combo = QComboBox()
         self._mode_combo.addItems(["顺序拼接", "随机拼接"])
         mode_layout.addWidget(self._mode_combo)
+        
+        # MP3编码预设
+        mode_layout.addWidget(QLabel("编码预设："))
+        self._preset_combo = QComboBox()
+        for preset, (label, _) in MP3_ENCODE_PRESETS.items():
+            self._preset_combo.addItem(label, preset)
+        self._preset_combo.setCurrentIndex(self._preset_combo.findData(DEFAULT_MP3_PRESET))
+        mode_layout.addWidget(self._preset_combo)
         mode_layout.addStretch()
         control_layout.addLayout(mode_layout)
         
@@ -138,6 +172,24 @@ class UiComponents:
         self._concurrency_checkbox.setChecked(True)  # 默认启用并发优化
         self._concurrency_checkbox.stateChanged.connect(self.main_window.toggle_concurrency)
         concurrency_layout.addWidget(self._concurrency_checkbox)
+        # 预编码片段缓存：默认关闭，使用流式渲染和分块并行编码（相邻两首之间没有额外的静音）
+        self._fragments_checkbox = QCheckBox("片段缓存")
+        self._fragments_checkbox.setChecked(False)
+        self._fragments_checkbox.setToolTip(
+            "每首歌单独编码并缓存，同一批歌曲重新拼接时直接连接缓存的片段；相邻两首之间多约26-52毫秒静音"
+        )
+        concurrency_layout.addWidget(self._fragments_checkbox)
+        # 智能渲染：与输出参数一致的MP3只重新编码淡入淡出边缘（只在使用片段缓存时生效）
+        self._smart_render_checkbox = QCheckBox("智能渲染")
+        self._smart_render_checkbox.setChecked(True)
+        self._smart_render_checkbox.setEnabled(False)
+        self._smart_render_checkbox.setToolTip("与输出参数一致的MP3只重新编码淡入淡出部分，中间的音频原样复制（需要片段缓存）")
+        self._fragments_checkbox.toggled.connect(self._smart_render_checkbox.setEnabled)
+        concurrency_layout.addWidget(self._smart_render_checkbox)
+        self._normalize_checkbox = QCheckBox("音量均衡")
+        self._normalize_checkbox.setChecked(True)
+        self._normalize_checkbox.setToolTip("按响度分析结果调整每首歌的音量（每首歌只分析一次，结果保存在音轨索引中）")
+        concurrency_layout.addWidget(self._normalize_checkbox)
         concurrency_layout.addStretch()
         control_layout.addLayout(concurrency_layout)
         
@@ -268,6 +320,51 @@ class UiComponents:
             }
         """)
         button_layout.addWidget(self._merge_button)
+
+        # 过渡试听：只渲染每首的结尾、倒计时和下一首的开头
+        self._preview_button = QPushButton('试听过渡')
+        self._preview_button.clicked.connect(self.main_window.preview_transitions)
+        self._preview_button.setToolTip(
+            f"只渲染每首歌的最后{PREVIEW_WINDOW_SECONDS}秒、倒计时和下一首的前{PREVIEW_WINDOW_SECONDS}秒，几秒内完成"
+        )
+        self._preview_button.setStyleSheet("""
+            QPushButton {
+                background-color: #00BCD4;
+                color: white;
+                border: none;
+                padding: 10px;
+                margin: 5px;
+                border-radius: 5px;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #0097A7;
+            }
+        """)
+        button_layout.addWidget(self._preview_button)
+
+        # 取消按钮（拼接或加载曲库时可用）
+        self._cancel_button = QPushButton('取消')
+        self._cancel_button.clicked.connect(self.main_window.cancel_operation)
+        self._cancel_button.setEnabled(False)
+        self._cancel_button.setStyleSheet("""
+            QPushButton {
+                background-color: #f44336;
+                color: white;
+                border: none;
+                padding: 12px;
+                margin: 5px;
+                border-radius: 5px;
+                font-size: 16px;
+            }
+            QPushButton:hover {
+                background-color: #d32f2f;
+            }
+            QPushButton:disabled {
+                background-color: #bdbdbd;
+            }
+        """)
+        button_layout.addWidget(self._cancel_button)
         
         control_layout.addLayout(button_layout)
         
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""音频时长探测
+
+只读取容器/帧头获取时长，不解码音频数据：
+- MP3：Xing/Info、VBRI、LAME头（含编码延迟和填充），没有VBR头时按CBR估算
+- WAV：fmt/data块
+- FLAC：STREAMINFO
+- OGG：Vorbis/Opus识别头 + 最后一页的granule position
+- M4A/MP4：moov中音轨的mdhd/stsd
+其他格式或解析失败时回退到ffprobe的format.duration，exact模式下完整解码。
+"""
+
+import os
+import json
+import struct
+import subprocess
+
+from src.utils import cache_utils
+
+# 探测MP3首帧时最多读取的字节数（不含ID3v2标签）
+MP3_SCAN_BYTES = 64 * 1024
+# 探测OGG最后一页时从文件末尾读取的字节数
+OGG_TAIL_BYTES = 64 * 1024
+# MP4的moov超过该大小时不在内存中解析，交给ffprobe
+MP4_MAX_MOOV_BYTES = 16 * 1024 * 1024
+
+_MP3_BITRATES = {
+    # (MPEG1, layer) -> kbps
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    # MPEG2/2.5
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+_MP3_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],   # MPEG1
+    2: [22050, 24000, 16000],   # MPEG2
+    0: [11025, 12000, 8000],    # MPEG2.5
+}
+
+
+def make_info(duration, codec=None, sample_rate=None, channels=None):
+    """构造探测结果"""
+    return {
+        "duration": float(duration),
+        "codec": codec,
+        "sample_rate": sample_rate,
+        "channels": channels,
+    }
+
+
+def parse_mp3_header(header):
+    """解析4字节MP3帧头，无效时返回None"""
+    if len(header) < 4:
+        return None
+    b = struct.unpack('>I', header[:4])[0]
+    if (b >> 21) & 0x7FF != 0x7FF:
+        return None
+    version_bits = (b >> 19) & 0x3
+    layer_bits = (b >> 17) & 0x3
+    bitrate_index = (b >> 12) & 0xF
+    sample_rate_index = (b >> 10) & 0x3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    layer = 4 - layer_bits
+    mpeg1 = version_bits == 3
+    bitrate = _MP3_BITRATES[(1 if mpeg1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version_bits][sample_rate_index]
+    padding = (b >> 9) & 0x1
+    channels = 1 if ((b >> 6) & 0x3) == 3 else 2
+
+    if layer == 1:
+        samples_per_frame = 384
+        frame_length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or mpeg1:
+        samples_per_frame = 1152
+        frame_length = 144 * bitrate // sample_rate + padding
+    else:
+        samples_per_frame = 576
+        frame_length = 72 * bitrate // sample_rate + padding
+
+    return {
+        "mpeg1": mpeg1,
+        "layer": layer,
+        "bitrate": bitrate,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "samples_per_frame": samples_per_frame,
+        "frame_length": frame_length,
+    }
+
+
+def xing_tag_offset(info):
+    """Xing/Info头在帧内的偏移（帧头4字节加边信息长度）"""
+    if info["mpeg1"]:
+        return 4 + (17 if info["channels"] == 1 else 32)
+    return 4 + (9 if info["channels"] == 1 else 17)
+
+
+def _id3v2_size(head):
+    """返回文件开头ID3v2标签的总长度（无标签时为0）"""
+    if len(head) < 10 or head[:3] != b'ID3':
+        return 0
+    size = 0
+    for byte in head[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if head[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _find_mp3_frame(data):
+    """在数据中查找第一个有效帧（要求紧随其后的帧头同样有效），返回(偏移, 帧头信息)"""
+    pos = data.find(b'\xff')
+    while 0 <= pos <= len(data) - 4:
+        info = parse_mp3_header(data[pos:pos + 4])
+        if info and info["frame_length"] > 0:
+            next_pos = pos + info["frame_length"]
+            if next_pos + 4 > len(data) or parse_mp3_header(data[next_pos:next_pos + 4]):
+                return pos, info
+        pos = data.find(b'\xff', pos + 1)
+    return None, None
+
+
+def find_first_mp3_frame(data):
+    """返回数据中第一个有效MP3帧的偏移（跳过开头的ID3v2标签），找不到时返回None"""
+    tag_size = _id3v2_size(data[:10])
+    offset, _ = _find_mp3_frame(data[tag_size:tag_size + MP3_SCAN_BYTES])
+    return None if offset is None else tag_size + offset
+
+
+def _probe_mp3(f, file_size):
+    head = f.read(10)
+    tag_size = _id3v2_size(head)
+    f.seek(tag_size)
+    data = f.read(MP3_SCAN_BYTES)
+    offset, info = _find_mp3_frame(data)
+    if info is None:
+        return None
+
+    sample_rate = info["sample_rate"]
+    samples_per_frame = info["samples_per_frame"]
+    frame = data[offset:offset + max(info["frame_length"], 4 + 36 + 18)]
+
+    # Xing/Info头
+    xing_offset = xing_tag_offset(info)
+    tag = frame[xing_offset:xing_offset + 4]
+    if tag in (b'Xing', b'Info'):
+        pos = xing_offset + 4
+        flags = struct.unpack('>I', frame[pos:pos + 4])[0]
+        pos += 4
+        frames = None
+        if flags & 0x1:
+            frames = struct.unpack('>I', frame[pos:pos + 4])[0]
+            pos += 4
+        if flags & 0x2:
+            pos += 4
+        if flags & 0x4:
+            pos += 100
+        if flags & 0x8:
+            pos += 4
+        if frames:
+            total_samples = frames * samples_per_frame
+            # LAME扩展头中的编码延迟和末尾填充（解码器会去掉这部分样本）
+            lame = frame[pos:pos + 24]
+            if len(lame) == 24 and lame[:4] in (b'LAME', b'Lavf', b'Lavc'):
+                delay = (lame[21] << 4) | (lame[22] >> 4)
+                padding = ((lame[22] & 0x0F) << 8) | lame[23]
+                if delay + padding < total_samples:
+                    total_samples -= delay + padding
+            return make_info(total_samples / sample_rate, "mp3", sample_rate, info["channels"])
+
+    # VBRI头（固定在帧头后32字节）
+    if frame[36:40] == b'VBRI':
+        frames = struct.unpack('>I', frame[50:54])[0]
+        if frames:
+            return make_info(frames * samples_per_frame / sample_rate, "mp3", sample_rate, info["channels"])
+
+    # 没有VBR头，按CBR估算
+    audio_bytes = file_size - tag_size - offset
+    f.seek(max(0, file_size - 128))
+    if f.read(3) == b'TAG':
+        audio_bytes -= 128
+    if audio_bytes <= 0:
+        return None
+    return make_info(audio_bytes * 8 / info["bitrate"], "mp3", sample_rate, info["channels"])
+
+
+def _probe_wav(f, file_size):
+    header = f.read(12)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt_data = f.read(chunk_size)
+            if len(fmt_data) < 16:
+                return None
+            _, channels, sample_rate, byte_rate = struct.unpack('<HHII', fmt_data[:12])
+            fmt = (channels, sample_rate, byte_rate)
+            if chunk_size % 2:
+                f.seek(1, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None or not fmt[2]:
+                return None
+            # 流式写入的WAV可能没有回填data大小
+            data_size = min(chunk_size, file_size - f.tell())
+            channels, sample_rate, byte_rate = fmt
+            return make_info(data_size / byte_rate, "pcm", sample_rate, channels)
+        else:
+            f.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
+
+
+def _probe_flac(f, file_size):
+    head = f.read(10)
+    f.seek(_id3v2_size(head))
+    if f.read(4) != b'fLaC':
+        return None
+    block_header = f.read(4)
+    if len(block_header) < 4 or (block_header[0] & 0x7F) != 0:
+        return None
+    streaminfo = f.read(34)
+    if len(streaminfo) < 34:
+        return None
+    packed = struct.unpack('>Q', streaminfo[10:18])[0]
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    if not sample_rate or not total_samples:
+        return None
+    return make_info(total_samples / sample_rate, "flac", sample_rate, channels)
+
+
+def _probe_ogg(f, file_size):
+    page = f.read(27)
+    if len(page) < 27 or page[:4] != b'OggS':
+        return None
+    segments = page[26]
+    f.seek(27 + segments)
+    packet = f.read(64)
+
+    pre_skip = 0
+    if packet[:7] == b'\x01vorbis':
+        channels = packet[11]
+        sample_rate = struct.unpack('<I', packet[12:16])[0]
+        granule_rate = sample_rate
+        codec = "vorbis"
+    elif packet[:8] == b'OpusHead':
+        channels = packet[9]
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+        sample_rate = struct.unpack('<I', packet[12:16])[0] or 48000
+        # Opus的granule position固定以48kHz计
+        granule_rate = 48000
+        codec = "opus"
+    else:
+        return None
+    if not granule_rate:
+        return None
+
+    f.seek(max(0, file_size - OGG_TAIL_BYTES))
+    tail = f.read()
+    pos = tail.rfind(b'OggS')
+    while pos >= 0:
+        if len(tail) >= pos + 14:
+            granule = struct.unpack('<q', tail[pos + 6:pos + 14])[0]
+            if granule > 0:
+                return make_info(max(0, granule - pre_skip) / granule_rate, codec, sample_rate, channels)
+        pos = tail.rfind(b'OggS', 0, pos)
+    return None
+
+
+def _iter_atoms(data, start=0, end=None):
+    """遍历内存中的MP4 atom，产出(类型, 内容起点, 内容终点)"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _find_atom(data, path, start=0, end=None):
+    """按路径查找嵌套atom，返回(内容起点, 内容终点)"""
+    for kind, body_start, body_end in _iter_atoms(data, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return body_start, body_end
+            return _find_atom(data, path[1:], body_start, body_end)
+    return None
+
+
+def _read_moov(f, file_size):
+    """按顶层atom跳转读取moov，不读取mdat"""
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack('>I4s', header[:8])
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size:
+            return None
+        if kind == b'moov':
+            if size > MP4_MAX_MOOV_BYTES:
+                return None
+            f.seek(pos + header_size)
+            return f.read(size - header_size)
+        pos += size
+    return None
+
+
+def _probe_mp4(f, file_size):
+    head = f.read(8)
+    if len(head) < 8 or head[4:8] not in (b'ftyp', b'moov', b'free', b'wide', b'mdat'):
+        return None
+    moov = _read_moov(f, file_size)
+    if moov is None:
+        return None
+
+    # 优先使用音轨的mdhd，时长与解码结果一致
+    for kind, trak_start, trak_end in _iter_atoms(moov):
+        if kind != b'trak':
+            continue
+        mdia = _find_atom(moov, [b'mdia'], trak_start, trak_end)
+        if not mdia:
+            continue
+        hdlr = _find_atom(moov, [b'hdlr'], *mdia)
+        if not hdlr or moov[hdlr[0] + 8:hdlr[0] + 12] != b'soun':
+            continue
+        mdhd = _find_atom(moov, [b'mdhd'], *mdia)
+        if not mdhd:
+            continue
+        body = moov[mdhd[0]:mdhd[1]]
+        if body[0] == 1:
+            timescale, duration = struct.unpack('>IQ', body[20:32])
+        else:
+            timescale, duration = struct.unpack('>II', body[12:20])
+        if not timescale:
+            continue
+
+        codec, sample_rate, channels = None, None, None
+        stsd = _find_atom(moov, [b'minf', b'stbl', b'stsd'], *mdia)
+        if stsd and stsd[1] - stsd[0] >= 8 + 36:
+            entry = moov[stsd[0] + 8:stsd[1]]
+            fourcc = entry[4:8]
+            codec = {b'mp4a': "aac", b'alac': "alac"}.get(fourcc, fourcc.decode('latin-1').strip())
+            channels = struct.unpack('>H', entry[24:26])[0]
+            sample_rate = struct.unpack('>I', entry[32:36])[0] >> 16
+        return make_info(duration / timescale, codec, sample_rate or timescale, channels)
+
+    # 没有可识别的音轨时使用mvhd
+    mvhd = _find_atom(moov, [b'mvhd'])
+    if not mvhd:
+        return None
+    body = moov[mvhd[0]:mvhd[1]]
+    if body[0] == 1:
+        timescale, duration = struct.unpack('>IQ', body[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', body[12:20])
+    if not timescale:
+        return None
+    return make_info(duration / timescale)
+
+
+# 扩展名 -> 头部解析函数（按顺序尝试）
+_HEADER_PROBES = {
+    '.mp3': [_probe_mp3],
+    '.wav': [_probe_wav],
+    '.flac': [_probe_flac],
+    '.ogg': [_probe_ogg],
+    '.opus': [_probe_ogg],
+    '.m4a': [_probe_mp4],
+    '.mp4': [_probe_mp4],
+    '.aac': [_probe_mp4],
+}
+
+
+def probe_header(file_path):
+    """只读取文件头探测音频信息，无法识别时返回None"""
+    ext = os.path.splitext(file_path)[1].lower()
+    probes = _HEADER_PROBES.get(ext)
+    if not probes:
+        return None
+    try:
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            for probe in probes:
+                f.seek(0)
+                info = probe(f, file_size)
+                if info and info["duration"] > 0:
+                    return info
+    except (OSError, struct.error, IndexError, ValueError):
+        return None
+    return None
+
+
+def ffprobe_command(file_path):
+    """读取format.duration及首个音频流参数的ffprobe命令（JSON输出）"""
+    return [
+        cache_utils.get_ffprobe_path(),
+        '-v', 'quiet',
+        '-print_format', 'json',
+        '-show_format',
+        '-show_streams',
+        '-select_streams', 'a:0',
+        file_path
+    ]
+
+
+def probe_ffprobe(file_path):
+    """使用ffprobe读取format.duration及首个音频流参数，失败时返回None"""
+    try:
+        # 不使用check=True，避免命令失败时抛出异常
+        result = subprocess.run(ffprobe_command(file_path), capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        return parse_ffprobe_output(result.stdout)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def parse_ffprobe_output(output):
+    """解析ffprobe的JSON输出，无法获得时长时返回None"""
+    info = json.loads(output)
+    stream = (info.get('streams') or [{}])[0]
+    duration = info.get('format', {}).get('duration') or stream.get('duration')
+    if duration is None:
+        return None
+    sample_rate = stream.get('sample_rate')
+    return make_info(
+        float(duration),
+        stream.get('codec_name'),
+        int(sample_rate) if sample_rate else None,
+        stream.get('channels')
+    )
+
+
+def probe_decode(file_path):
+    """完整解码音频获取精确时长"""
+    from pydub import AudioSegment
+    audio = AudioSegment.from_file(file_path)
+    return make_info(len(audio) / 1000, None, audio.frame_rate, audio.channels)
+
+
+def probe_audio(file_path, exact=False):
+    """探测音频信息：默认只读文件头，失败时回退到ffprobe；exact=True时完整解码"""
+    if exact:
+        return probe_decode(file_path)
+    return probe_header(file_path) or probe_ffprobe(file_path)
@@ -6,8 +6,12 @@ import os
 import json
 import sys
 import time
+import shutil
+import itertools
 from collections import OrderedDict
 
+from src.constants import AUDIO_CACHE_MEMORY_FRACTION, AUDIO_CACHE_FALLBACK_BYTES, AUDIO_CACHE_SHARDS
+
 # 新增：动态获取ffprobe路径函数
 def get_ffprobe_path():
     """
@@ -21,7 +25,7 @@ def get_ffprobe_path():
     else:
         # 开发环境，获取项目根目录
         base_path = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-    return os.path.join(base_path, 'ffmpeg', 'ffprobe.exe')
+    return _bundled_or_system(os.path.join(base_path, 'ffmpeg', 'ffprobe.exe'), 'ffprobe')
 
 # 新增：动态获取ffmpeg路径函数
 def get_ffmpeg_path():
@@ -36,37 +40,275 @@ def get_ffmpeg_path():
     else:
         # 开发环境，获取项目根目录
         base_path = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-    return os.path.join(base_path, 'ffmpeg', 'ffmpeg.exe')
+    return _bundled_or_system(os.path.join(base_path, 'ffmpeg', 'ffmpeg.exe'), 'ffmpeg')
+
+def _bundled_or_system(bundled_path, name):
+    """优先使用项目内置的可执行文件，不存在时回退到PATH中的同名程序"""
+    # 未拉取LFS对象时，仓库中的exe只是一个很小的指针文本文件
+    if os.path.isfile(bundled_path) and os.path.getsize(bundled_path) > 1024:
+        return bundled_path
+    return shutil.which(name) or bundled_path
+
+def get_total_memory():
+    """获取物理内存总字节数，无法获取时返回None"""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [
+                    ('dwLength', ctypes.c_ulong),
+                    ('dwMemoryLoad', ctypes.c_ulong),
+                    ('ullTotalPhys', ctypes.c_ulonglong),
+                    ('ullAvailPhys', ctypes.c_ulonglong),
+                    ('ullTotalPageFile', ctypes.c_ulonglong),
+                    ('ullAvailPageFile', ctypes.c_ulonglong),
+                    ('ullTotalVirtual', ctypes.c_ulonglong),
+                    ('ullAvailVirtual', ctypes.c_ulonglong),
+                    ('ullAvailExtendedVirtual', ctypes.c_ulonglong),
+                ]
+            
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullTotalPhys
+            return None
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def default_cache_budget(fraction=AUDIO_CACHE_MEMORY_FRACTION):
+    """音频缓存的默认字节预算：物理内存的一定比例"""
+    total = get_total_memory()
+    if not total:
+        return AUDIO_CACHE_FALLBACK_BYTES
+    return int(total * fraction)
+
+def segment_size(value):
+    """缓存值占用的字节数，AudioSegment按PCM数据长度计算"""
+    raw_data = getattr(value, 'raw_data', None)
+    if raw_data is not None:
+        return len(raw_data)
+    return sys.getsizeof(value)
+
+class _CacheShard:
+    """LRUCache的一个分片，拥有独立的锁"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> [value, size, tick]，按访问顺序排列
+        self.pinned = {}              # key -> [value, size]，不参与淘汰
+        self.loading = {}             # key -> threading.Event，正在加载的键
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
 class LRUCache:
-    def __init__(self, capacity=100):
-        self.cache = OrderedDict()
+    """按字节数限制容量的LRU缓存
+    
+    - 容量按值的字节数计算（AudioSegment为len(raw_data)），也可同时限制条目数
+    - 固定（pin）的条目不会被淘汰，例如倒计时音频
+    - 按键分片加锁，不同键的读写互不阻塞；get_or_load保证同一个键只加载一次
+    - stats()返回命中、未命中、淘汰次数和占用字节数
+    """
+    
+    def __init__(self, capacity=None, max_bytes=None, shards=AUDIO_CACHE_SHARDS, size_func=segment_size):
         self.capacity = capacity
-        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.size_func = size_func
+        self._shards = [_CacheShard() for _ in range(max(1, shards))]
+        # 全局字节数和条目数只在这把锁下更新，临界区仅为整数加减
+        self._totals_lock = threading.Lock()
+        self._bytes = 0
+        self._count = 0
+        self._pinned_bytes = 0
+        self._tick = itertools.count()
+    
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+    
+    def _adjust(self, bytes_delta, count_delta, pinned_delta=0):
+        with self._totals_lock:
+            self._bytes += bytes_delta
+            self._count += count_delta
+            self._pinned_bytes += pinned_delta
+    
+    def _over_budget(self):
+        with self._totals_lock:
+            if self.max_bytes is not None and self._bytes > self.max_bytes:
+                return True
+            return self.capacity is not None and self._count > self.capacity
+    
+    def _evict(self):
+        """淘汰全局最久未访问的未固定条目，直到回到预算以内"""
+        while self._over_budget():
+            # 每个分片的队首是该分片最久未访问的条目，取其中最旧的一个
+            victim = None
+            for shard in self._shards:
+                with shard.lock:
+                    if shard.entries:
+                        key, entry = next(iter(shard.entries.items()))
+                        if victim is None or entry[2] < victim[2]:
+                            victim = (shard, key, entry[2])
+            if victim is None:
+                # 只剩固定条目
+                return
+            shard, key, tick = victim
+            with shard.lock:
+                entry = shard.entries.get(key)
+                if entry is None or entry[2] != tick:
+                    # 期间被其他线程访问或删除，重新选择
+                    continue
+                del shard.entries[key]
+                shard.evictions += 1
+            self._adjust(-entry[1], -1)
     
     def get(self, key):
-        with self.lock:
-            if key not in self.cache:
+        shard = self._shard(key)
+        with shard.lock:
+            pinned = shard.pinned.get(key)
+            if pinned is not None:
+                shard.hits += 1
+                return pinned[0]
+            entry = shard.entries.get(key)
+            if entry is None:
+                shard.misses += 1
                 return None
-            else:
-                self.cache.move_to_end(key)
-                return self.cache[key]
-    
-    def put(self, key, value):
-        with self.lock:
-            if key in self.cache:
-                del self.cache[key]
-            elif len(self.cache) >= self.capacity:
-                self.cache.popitem(last=False)
-            self.cache[key] = value
+            entry[2] = next(self._tick)
+            shard.entries.move_to_end(key)
+            shard.hits += 1
+            return entry[0]
+    
+    def put(self, key, value, pinned=False):
+        """写入缓存，返回是否已缓存（超过整个预算的未固定条目不会被缓存）"""
+        size = self.size_func(value)
+        too_large = not pinned and self.max_bytes is not None and size > self.max_bytes
+        shard = self._shard(key)
+        with shard.lock:
+            old = shard.entries.pop(key, None)
+            old_pinned = shard.pinned.pop(key, None)
+            if not too_large:
+                if pinned:
+                    shard.pinned[key] = [value, size]
+                else:
+                    shard.entries[key] = [value, size, next(self._tick)]
+        bytes_delta = -(old[1] if old else 0) - (old_pinned[1] if old_pinned else 0)
+        count_delta = -(1 if old else 0) - (1 if old_pinned else 0)
+        pinned_delta = -(old_pinned[1] if old_pinned else 0)
+        if not too_large:
+            bytes_delta += size
+            count_delta += 1
+            if pinned:
+                pinned_delta += size
+        self._adjust(bytes_delta, count_delta, pinned_delta)
+        self._evict()
+        return not too_large
+    
+    def get_or_load(self, key, loader, pinned=False):
+        """从缓存获取，不存在时调用loader加载并写入缓存
+        
+        多个线程同时请求同一个键时只有一个线程执行loader，其余线程等待结果；
+        加载在锁外进行，不会阻塞其他键的读写。
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        shard = self._shard(key)
+        with shard.lock:
+            event = shard.loading.get(key)
+            owner = event is None
+            if owner:
+                event = shard.loading[key] = threading.Event()
+        if not owner:
+            event.wait()
+            value = self.get(key)
+            if value is not None:
+                return value
+            # 其他线程加载失败或结果过大未缓存，自行加载
+            return loader()
+        try:
+            value = loader()
+            self.put(key, value, pinned=pinned)
+            return value
+        finally:
+            with shard.lock:
+                shard.loading.pop(key, None)
+            event.set()
+    
+    def pin(self, key):
+        """固定已缓存的条目，使其不会被淘汰，返回是否成功"""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.pop(key, None)
+            if entry is None:
+                return key in shard.pinned
+            shard.pinned[key] = [entry[0], entry[1]]
+        self._adjust(0, 0, entry[1])
+        return True
+    
+    def unpin(self, key):
+        """取消固定，条目重新参与LRU淘汰"""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.pinned.pop(key, None)
+            if entry is None:
+                return False
+            shard.entries[key] = [entry[0], entry[1], next(self._tick)]
+        self._adjust(0, 0, -entry[1])
+        self._evict()
+        return True
+    
+    def discard(self, key):
+        """删除一个条目（包括固定的条目）"""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.pop(key, None)
+            pinned = shard.pinned.pop(key, None)
+        if entry:
+            self._adjust(-entry[1], -1)
+        if pinned:
+            self._adjust(-pinned[1], -1, -pinned[1])
     
     def __contains__(self, key):
-        with self.lock:
-            return key in self.cache
+        shard = self._shard(key)
+        with shard.lock:
+            return key in shard.entries or key in shard.pinned
+    
+    def __len__(self):
+        with self._totals_lock:
+            return self._count
     
     def clear(self):
-        with self.lock:
-            self.cache.clear()
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.pinned.clear()
+        with self._totals_lock:
+            self._bytes = 0
+            self._count = 0
+            self._pinned_bytes = 0
+    
+    def stats(self):
+        """返回缓存统计信息"""
+        hits = misses = evictions = 0
+        for shard in self._shards:
+            with shard.lock:
+                hits += shard.hits
+                misses += shard.misses
+                evictions += shard.evictions
+        with self._totals_lock:
+            current_bytes, count, pinned_bytes = self._bytes, self._count, self._pinned_bytes
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": evictions,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": current_bytes,
+            "pinned_bytes": pinned_bytes,
+            "max_bytes": self.max_bytes,
+        }
 
 def load_duration_cache(cache_file, ttl=30*24*60*60):  # 默认TTL为30天
     """从JSON文件加载时长缓存，并应用TTL过滤"""
@@ -115,71 +357,70 @@ def load_duration_cache(cache_file, ttl=30*24*60*60):  # 默认TTL为30天
     return duration_cache
 
 def save_duration_cache(cache_file, duration_cache):
-    """将时长缓存保存到JSON文件"""
+    """将时长缓存保存到JSON文件，返回是否成功
+
+    先写入临时文件再原子替换，写入过程中崩溃不会损坏已有的缓存文件。
+    """
+    tmp_file = f"{cache_file}.{threading.get_ident()}.tmp"
     try:
-        # 保存缓存（已经是按文件名唯一的格式）
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(duration_cache, f, indent=4, ensure_ascii=False)
+        # 复制一份，其他线程可能仍在写入字典
+        snapshot = dict(duration_cache)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            # 保存缓存（已经是按文件名唯一的格式）
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, cache_file)
+        return True
     except Exception as e:
         print(f"保存时长缓存失败：{e}")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        return False
 
-def get_audio_duration(file_path, duration_cache, ttl=30*24*60*60):  # 默认TTL为30天
-    """获取音频文件的时长，优先从缓存获取（考虑TTL），没有时计算并更新缓存"""
+def get_audio_duration(file_path, duration_cache, ttl=30*24*60*60, exact=False, span=None):  # 默认TTL为30天
+    """获取音频文件的时长，优先从缓存获取（考虑TTL），没有时探测并更新缓存
+
+    默认只读取文件头（失败时回退到ffprobe），exact=True时完整解码获取精确时长；
+    传入span（tracing.Span）时记录是否命中缓存
+    """
+    from src.utils import audio_probe
+    
     # 仅使用文件名作为缓存键
     abs_path = os.path.abspath(file_path)
     cache_key = os.path.basename(abs_path)
     
     # 检查缓存并验证TTL
-    if cache_key in duration_cache:
+    if cache_key in duration_cache and not exact:
         cached_entry = duration_cache[cache_key]
         # 检查缓存是否过期
         if "cache_time" in cached_entry and (time.time() - cached_entry["cache_time"]) <= ttl:
+            if span is not None:
+                span.set(cache="hit")
             return cached_entry["duration"]
         # 缓存过期，需要重新计算
+    if span is not None:
+        span.set(cache="miss")
     
     try:
-        from pydub import AudioSegment
-        # 支持多种音频格式，而不仅仅是MP3
-        audio = AudioSegment.from_file(abs_path)
-        duration = len(audio) / 1000
-        
-        # 保存到缓存，增加缓存时长属性
-        duration_cache[cache_key] = {
-            "duration": duration,
-            "cache_time": time.time()
-        }
-        
-        return duration
+        info = audio_probe.probe_audio(abs_path, exact=exact)
     except Exception as e:
         print(f"计算{os.path.basename(abs_path)}时长失败：{e}")
-        # 尝试使用ffprobe命令行工具获取时长
+        info = None
+    if info is None and not exact:
+        # 文件头和ffprobe都无法识别时，最后尝试完整解码
         try:
-            import subprocess
-            import json
-            
-            # 使用ffprobe获取时长
-            cmd = [
-                get_ffprobe_path(),
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
-                abs_path
-            ]
-            # 不使用check=True，避免命令失败时抛出异常
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                info = json.loads(result.stdout)
-                duration = float(info['format']['duration'])
-                
-                # 保存到缓存，增加缓存时长属性
-                duration_cache[cache_key] = {
-                    "duration": duration,
-                    "cache_time": time.time()
-                }
-                return duration
-            else:
-                print(f"使用ffprobe计算{os.path.basename(abs_path)}时长失败，返回码：{result.returncode}")
-                return 0
-        except Exception as e2:
-            print(f"使用ffprobe计算{os.path.basename(abs_path)}时长也失败：{e2}")
-            return 0
+            info = audio_probe.probe_decode(abs_path)
+        except Exception as e:
+            print(f"解码{os.path.basename(abs_path)}获取时长也失败：{e}")
+    if info is None:
+        return 0
+    
+    # 保存到缓存，增加缓存时长属性
+    duration_cache[cache_key] = {
+        "duration": info["duration"],
+        "cache_time": time.time()
+    }
+    return info["duration"]
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""协作式取消
+
+后台任务在每个工作单元之间检查CancellationToken；取消时注册的回调立即执行
+（如终止ffmpeg子进程），让阻塞在子进程上的等待尽快返回。
+"""
+
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+# 等待子任务时检查取消状态的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.05
+
+
+class OperationCancelled(Exception):
+    """操作已被取消"""
+
+
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """请求取消，并执行已注册的回调（可从任意线程调用，重复调用无效果）"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise OperationCancelled()
+
+    def wait(self, timeout):
+        """等待最多timeout秒，已取消时返回True"""
+        return self._event.wait(timeout)
+
+    def register(self, callback):
+        """注册取消时执行的回调，已取消时立即执行；返回用于注销的函数"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+def wait_future(future, token=None):
+    """等待future的结果，期间每隔CANCEL_POLL_INTERVAL秒检查一次取消状态"""
+    if token is None:
+        return future.result()
+    while True:
+        token.raise_if_cancelled()
+        try:
+            return future.result(timeout=CANCEL_POLL_INTERVAL)
+        except FutureTimeoutError:
+            continue
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""自适应并发控制
+
+曲库探测（读取文件头、ffprobe进程）、随舞文件的时长获取和解码池的解码都通过
+ConcurrencyController.limiter()得到一个AdaptiveLimiter，每个任务占用一个名额：
+- 每个统计窗口（至少CONCURRENCY_WINDOW_SECONDS秒）按完成的任务计算吞吐量（记录了字节数时按MB/秒，
+  否则按文件/秒），与上一窗口比较：变好则沿同一方向继续调整并发数，变差则反向；持平时减少并发数，
+  用更少的线程/进程达到同样的吞吐量（爬山法）
+- 只有名额被占满过的窗口才参与比较（任务不够多时吞吐量与并发数无关）
+- CPU已接近满载时不再增加并发数；界面事件循环的延迟超过阈值时按比例减少并发数
+- 每台机器上各类任务吞吐量最高的并发数保存在JSON文件中，下次从该值开始
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from loguru import logger
+
+from src.constants import (
+    CONCURRENCY_WINDOW_SECONDS, CONCURRENCY_TOLERANCE, CONCURRENCY_BACKOFF_FACTOR,
+    CONCURRENCY_CPU_BUSY_THRESHOLD, CONCURRENCY_UI_LAG_THRESHOLD_MS
+)
+from src.utils import cancellation
+
+
+def machine_key():
+    """区分机器的键（程序目录可能在多台机器之间共用）"""
+    return f"{platform.node()}|{platform.machine()}|{os.cpu_count()}"
+
+
+def _cpu_times():
+    """返回 (空闲时间, 总时间)，无法获取时返回None"""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        idle, kernel, user = wintypes.FILETIME(), wintypes.FILETIME(), wintypes.FILETIME()
+        if not ctypes.windll.kernel32.GetSystemTimes(ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)):
+            return None
+        to_int = lambda t: (t.dwHighDateTime << 32) | t.dwLowDateTime
+        # 内核时间包含空闲时间
+        return to_int(idle), to_int(kernel) + to_int(user)
+    try:
+        with open('/proc/stat', 'r') as f:
+            values = [int(value) for value in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # idle + iowait
+    return values[3] + values[4], sum(values)
+
+
+class CpuLoad:
+    """整机CPU占用率（0-1），按两次采样之间的空闲时间计算；无法获取时使用平均负载或返回None"""
+
+    # 两次采样的最小间隔（秒），间隔太短时返回上一次的结果
+    MIN_INTERVAL = 0.5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = _cpu_times()
+        self._last_time = time.monotonic()
+        self._value = None
+
+    def sample(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_time < self.MIN_INTERVAL:
+                return self._value
+            times = _cpu_times()
+            if times is not None and self._last is not None and times[1] > self._last[1]:
+                self._value = 1 - (times[0] - self._last[0]) / (times[1] - self._last[1])
+            elif hasattr(os, 'getloadavg'):
+                self._value = os.getloadavg()[0] / (os.cpu_count() or 1)
+            self._last, self._last_time = times, now
+            return self._value
+
+
+class _Slot:
+    """占用中的名额，任务可以在bytes中记录处理的字节数"""
+    __slots__ = ('bytes',)
+
+    def __init__(self):
+        self.bytes = 0
+
+
+class AdaptiveLimiter:
+    """并发数可变的信号量，同时支持线程（acquire/slot）和asyncio协程（acquire_async）
+
+    controller为None时并发数固定为initial。
+    """
+
+    def __init__(self, name, minimum, maximum, initial, controller=None, watch_lag=True):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(self.maximum, max(self.minimum, initial))
+        self.controller = controller
+        # 是否在界面卡顿时减少并发数（在界面线程中同步等待的任务不应因界面卡顿而减速）
+        self.watch_lag = watch_lag
+        self._lock = threading.Lock()
+        self._active = 0
+        # 等待名额的线程（threading.Event）或协程（(事件循环, Future)），按先后顺序分配
+        self._waiters = deque()
+        self._direction = 1
+        self._best = None  # (吞吐量, 并发数)
+        self._reset_window(time.monotonic())
+        self._last_rate = None
+
+    def _reset_window(self, now):
+        self._window_start = now
+        self._window_count = 0
+        self._window_bytes = 0
+        self._saturated = self._active >= self.limit
+
+    def acquire(self, token=None):
+        """占用一个名额，没有空闲名额时等待；token被取消时抛出OperationCancelled"""
+        with self._lock:
+            if self._try_acquire_locked():
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        while not event.wait(cancellation.CANCEL_POLL_INTERVAL if token is not None else None):
+            if token.cancelled:
+                with self._lock:
+                    if event in self._waiters:
+                        self._waiters.remove(event)
+                        raise cancellation.OperationCancelled()
+                # 取消的同时被分配了名额：归还，不计入吞吐量
+                self.release(completed=False)
+                raise cancellation.OperationCancelled()
+
+    async def acquire_async(self):
+        """在协程中占用一个名额（可被asyncio取消）"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_acquire_locked():
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            # 已分配名额时由_wake_async发现Future被取消并归还
+            raise
+
+    def _try_acquire_locked(self):
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            self._saturated = self._saturated or self._active >= self.limit
+            return True
+        self._saturated = True
+        return False
+
+    def release(self, nbytes=0, completed=True):
+        """归还名额；completed为True时计入吞吐量统计"""
+        with self._lock:
+            self._active -= 1
+            if completed:
+                self._window_count += 1
+                self._window_bytes += nbytes
+                now = time.monotonic()
+                if now - self._window_start >= CONCURRENCY_WINDOW_SECONDS:
+                    self._adjust(now)
+            granted = self._grant_locked()
+        self._wake(granted)
+
+    @contextmanager
+    def slot(self, token=None):
+        """占用一个名额执行任务；任务抛出异常时不计入吞吐量"""
+        self.acquire(token)
+        slot = _Slot()
+        completed = False
+        try:
+            yield slot
+            completed = True
+        finally:
+            self.release(slot.bytes, completed)
+
+    def _grant_locked(self):
+        granted = []
+        while self._waiters and self._active < self.limit:
+            self._active += 1
+            granted.append(self._waiters.popleft())
+        return granted
+
+    def _wake(self, granted):
+        for waiter in granted:
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                loop.call_soon_threadsafe(self._wake_async, future)
+
+    def _wake_async(self, future):
+        if future.cancelled():
+            self.release(completed=False)
+        else:
+            future.set_result(None)
+
+    def _adjust(self, now):
+        """一个统计窗口结束，按吞吐量调整并发数（持有锁时调用）"""
+        elapsed = now - self._window_start
+        current = self.limit
+        rate = (self._window_bytes if self._window_bytes else self._window_count) / elapsed
+        saturated = self._saturated
+        self._reset_window(now)
+        if self.controller is None or self.minimum == self.maximum:
+            return
+
+        reason = self.controller.pressure(self.watch_lag)
+        if reason == "lag":
+            # 界面卡顿：立即按比例减少
+            self.limit = max(self.minimum, int(current * CONCURRENCY_BACKOFF_FACTOR))
+            self._direction = -1
+            self._last_rate = None
+        elif saturated:
+            if self._best is None or rate > self._best[0]:
+                self._best = (rate, current)
+            if self._last_rate is not None:
+                if rate < self._last_rate * (1 - CONCURRENCY_TOLERANCE):
+                    self._direction = -self._direction
+                elif rate <= self._last_rate * (1 + CONCURRENCY_TOLERANCE):
+                    self._direction = -1
+            if self._direction > 0 and reason == "cpu":
+                # CPU已满载，增加并发数没有意义
+                self._direction = -1
+            step = max(1, current // 4)
+            self.limit = min(self.maximum, max(self.minimum, current + self._direction * step))
+            if self.limit == current:
+                # 到达边界后反向探测
+                self._direction = -self._direction
+            self._last_rate = rate
+        if self.limit != current:
+            logger.debug(f"并发控制[{self.name}]：{current} -> {self.limit}（吞吐量 {rate:.1f}/秒{'，' + reason if reason else ''}）")
+
+    def finish(self):
+        """一批任务结束：记住吞吐量最高的并发数（下次从该值开始），重新开始统计"""
+        with self._lock:
+            best = self._best[1] if self._best else None
+            self._best = None
+            self._last_rate = None
+            self._reset_window(time.monotonic())
+        if self.controller is not None and best is not None:
+            self.controller.remember(self.name, best)
+
+
+class Counters:
+    """线程安全的计数器组，在各工作线程的完成回调中累加"""
+
+    def __init__(self, *names):
+        self._lock = threading.Lock()
+        self._values = dict.fromkeys(names, 0)
+
+    def add(self, name, amount=1):
+        """累加并返回新值"""
+        with self._lock:
+            value = self._values.get(name, 0) + amount
+            self._values[name] = value
+            return value
+
+    def __getitem__(self, name):
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+def fixed_limiter(name, limit):
+    """并发数固定的AdaptiveLimiter（不使用并发控制器时）"""
+    return AdaptiveLimiter(name, limit, limit, limit)
+
+
+class ConcurrencyController:
+    """按机器保存各类任务调优后的并发数，并提供统一的背压信号
+
+    state_file为None时不保存；lag_func返回界面事件循环当前的延迟（毫秒），由界面设置。
+    """
+
+    def __init__(self, state_file=None, lag_func=None):
+        self.state_file = state_file
+        self.lag_func = lag_func
+        self.cpu_load = CpuLoad()
+        self._lock = threading.Lock()
+        self._limiters = {}
+        self._machine = machine_key()
+        self._state = self._load()
+
+    def _load(self):
+        if not (self.state_file and os.path.exists(self.state_file)):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return {name: int(limit) for name, limit in data.get(self._machine, {}).items()}
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            logger.debug(f"读取并发调优结果失败：{e}")
+            return {}
+
+    def limiter(self, name, minimum, maximum, default, watch_lag=True):
+        """返回名为name的AdaptiveLimiter（同名只创建一次），初始并发数为本机上次调优的结果或default"""
+        with self._lock:
+            limiter = self._limiters.get(name)
+            if limiter is None:
+                limiter = AdaptiveLimiter(
+                    name, minimum, maximum, self._state.get(name, default), controller=self, watch_lag=watch_lag
+                )
+                self._limiters[name] = limiter
+            return limiter
+
+    def pressure(self, watch_lag=True):
+        """返回当前的背压原因："lag"（界面卡顿）、"cpu"（CPU满载）或None"""
+        if watch_lag and self.lag_func is not None:
+            try:
+                if self.lag_func() > CONCURRENCY_UI_LAG_THRESHOLD_MS:
+                    return "lag"
+            except Exception:
+                pass
+        load = self.cpu_load.sample()
+        if load is not None and load >= CONCURRENCY_CPU_BUSY_THRESHOLD:
+            return "cpu"
+        return None
+
+    def remember(self, name, limit):
+        """记录调优结果并保存"""
+        with self._lock:
+            if self._state.get(name) == limit:
+                return
+            self._state[name] = limit
+            state = dict(self._state)
+        self.save(state)
+
+    def save(self, state=None):
+        if not self.state_file:
+            return
+        if state is None:
+            with self._lock:
+                state = dict(self._state)
+        try:
+            data = {}
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            data[self._machine] = state
+            tmp_path = f"{self.state_file}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.state_file)
+        except (OSError, ValueError) as e:
+            logger.debug(f"保存并发调优结果失败：{e}")
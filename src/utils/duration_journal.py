@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""时长缓存的预写日志
+
+音轨索引不可用时使用文件名为键的时长缓存。DurationJournal是一个映射（键为文件名，
+值为 {"duration", "cache_time"}），由三部分组成：
+- 二进制快照（duration_cache.bin，见duration_snapshot）：mmap映射，查询时才读取条目
+- 预写日志：写入的条目先缓冲，每DURATION_JOURNAL_BATCH条以一行紧凑JSON追加到
+  duration_cache.json.journal并fsync，启动时重放到内存中
+- 日志积累到DURATION_JOURNAL_COMPACT_RECORDS条后在后台线程压缩：先把日志改名为
+  .compacting（之后的写入进入新日志），再把快照和内存中的条目合并写入临时文件并原子替换快照
+过期在查询时检查（过期条目视为不存在），压缩时才真正丢弃；崩溃时写了一半的最后一行被忽略。
+旧版duration_cache.json只在没有快照或比快照新时读取，下一次压缩后转为二进制快照。
+"""
+
+import os
+import json
+import time
+import threading
+from collections.abc import Mapping
+
+from loguru import logger
+
+from src.constants import (
+    CACHE_EXPIRATION, DURATION_JOURNAL_SUFFIX, DURATION_JOURNAL_BATCH, DURATION_JOURNAL_COMPACT_RECORDS,
+    DURATION_SNAPSHOT_EXTENSION
+)
+from src.utils import cache_utils
+from src.utils import duration_snapshot
+
+_COMPACTING_SUFFIX = ".compacting"
+
+
+def snapshot_path(cache_file):
+    """JSON时长缓存文件对应的二进制快照路径"""
+    return os.path.splitext(cache_file)[0] + DURATION_SNAPSHOT_EXTENSION
+
+
+def _replay(journal_file, entries):
+    """把日志中的记录写入entries（不检查过期），返回 (有效记录数, 文件是否以换行结尾)"""
+    if not os.path.exists(journal_file):
+        return 0, True
+    with open(journal_file, 'rb') as f:
+        data = f.read()
+    count = 0
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+            entries[record["k"]] = {"duration": float(record["d"]), "cache_time": float(record["t"])}
+        except (ValueError, KeyError, TypeError):
+            # 崩溃时未写完的行
+            continue
+        count += 1
+    return count, not data or data.endswith(b'\n')
+
+
+def load(cache_file, ttl=CACHE_EXPIRATION):
+    """读取快照并重放日志，返回未过期条目的字典（用于一次性导入）"""
+    journal = DurationJournal(cache_file, ttl=ttl)
+    try:
+        return dict(journal.items())
+    finally:
+        journal.close_snapshot()
+
+
+class DurationJournal(Mapping):
+    """带预写日志的时长缓存，写入（d[key] = value）会记入日志；可在多个线程中使用"""
+
+    def __init__(self, cache_file, ttl=CACHE_EXPIRATION, batch_size=DURATION_JOURNAL_BATCH,
+                 compact_records=DURATION_JOURNAL_COMPACT_RECORDS):
+        self.cache_file = cache_file
+        self.snapshot_file = snapshot_path(cache_file)
+        self.journal_file = cache_file + DURATION_JOURNAL_SUFFIX
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.compact_records = compact_records
+        # 快照、内存中的条目和缓冲区
+        self._lock = threading.Lock()
+        self._snapshot = duration_snapshot.DurationSnapshot.open(self.snapshot_file)
+        # 快照之后写入的条目（日志重放的和新写入的）
+        self._entries = {}
+        self._buffer = []
+        # 日志文件的追加、改名
+        self._io_lock = threading.Lock()
+        self._compactor = None
+        self._journal_records = 0
+        self._needs_newline = False
+
+        if self._legacy_json_newer():
+            self._entries.update(cache_utils.load_duration_cache(cache_file, ttl=ttl))
+            # 下一次写入日志后转为二进制快照
+            self._journal_records = self.compact_records
+        for path in (self.journal_file + _COMPACTING_SUFFIX, self.journal_file):
+            try:
+                count, ends_with_newline = _replay(path, self._entries)
+            except OSError as e:
+                logger.warning(f"读取时长缓存日志失败 {os.path.basename(path)}：{e}")
+                continue
+            self._journal_records += count
+            if path == self.journal_file:
+                self._needs_newline = not ends_with_newline
+        if os.path.exists(self.journal_file + _COMPACTING_SUFFIX):
+            # 上次压缩未完成，启动后重新压缩
+            self._journal_records = max(self._journal_records, self.compact_records)
+
+    def _legacy_json_newer(self):
+        """旧版JSON缓存存在，且没有二进制快照或比快照新（如被旧版本程序或update_cache更新过）"""
+        if not os.path.exists(self.cache_file):
+            return False
+        if self._snapshot is None:
+            return True
+        try:
+            return os.path.getmtime(self.cache_file) > os.path.getmtime(self.snapshot_file)
+        except OSError:
+            return False
+
+    def _expired(self, entry, now=None):
+        return (now or time.time()) - entry["cache_time"] > self.ttl
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._snapshot is not None:
+                entry = self._snapshot.get(key)
+        if entry is None or self._expired(entry):
+            raise KeyError(key)
+        return entry
+
+    def _raw_items(self):
+        """快照和内存中的全部条目（包括已过期的），内存中的条目优先"""
+        with self._lock:
+            entries = dict(self._entries)
+            snapshot = self._snapshot
+            # 压缩线程替换快照时，旧映射等遍历结束后才关闭
+            if snapshot is not None and not snapshot.acquire():
+                snapshot = None
+        if snapshot is not None:
+            try:
+                for key, entry in snapshot.items():
+                    if key not in entries:
+                        yield key, entry
+            finally:
+                snapshot.release()
+        yield from entries.items()
+
+    def __iter__(self):
+        now = time.time()
+        for key, entry in self._raw_items():
+            if not self._expired(entry, now):
+                yield key
+
+    def __len__(self):
+        """条目数（包括尚未清理的过期条目）"""
+        with self._lock:
+            if self._snapshot is None:
+                return len(self._entries)
+            return len(self._snapshot) + sum(1 for key in self._entries if self._snapshot.get(key) is None)
+
+    def __setitem__(self, key, value):
+        record = json.dumps(
+            {"k": key, "d": value["duration"], "t": value["cache_time"]}, ensure_ascii=False, separators=(',', ':')
+        )
+        with self._lock:
+            self._entries[key] = value
+            self._buffer.append(record)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def flush(self):
+        """把缓冲的记录追加到日志并fsync；日志足够长时在后台压缩"""
+        # 取出缓冲区和追加都在_io_lock内，多个线程同时写入时日志中的顺序与内存一致
+        with self._io_lock:
+            with self._lock:
+                records, self._buffer = self._buffer, []
+            if records:
+                data = ("\n" if self._needs_newline else "") + "\n".join(records) + "\n"
+                try:
+                    with open(self.journal_file, 'a', encoding='utf-8') as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._needs_newline = False
+                    self._journal_records += len(records)
+                except OSError as e:
+                    logger.error(f"写入时长缓存日志失败：{e}")
+                    with self._lock:
+                        self._buffer[:0] = records
+                    return
+            compact = self._journal_records >= self.compact_records
+        if compact:
+            self.compact()
+
+    def compact(self, wait=False):
+        """把当前内容写成新快照并清空日志（后台线程执行，wait为True时等待完成）"""
+        with self._io_lock:
+            if self._compactor is None or not self._compactor.is_alive():
+                self._compactor = threading.Thread(target=self._compact, name="duration-journal", daemon=True)
+                self._compactor.start()
+            compactor = self._compactor
+        if wait:
+            compactor.join()
+
+    def _compact(self):
+        compacting = self.journal_file + _COMPACTING_SUFFIX
+        with self._io_lock:
+            try:
+                # 上次压缩未完成时.compacting仍在，本次的快照同样包含其中的记录，日志留到下次压缩
+                if os.path.exists(self.journal_file) and not os.path.exists(compacting):
+                    os.replace(self.journal_file, compacting)
+                    self._needs_newline = False
+            except OSError as e:
+                logger.error(f"压缩时长缓存失败：{e}")
+                return
+            self._journal_records = 0
+            # 已追加到日志的记录都已在内存中；之后的写入进入新日志
+            with self._lock:
+                written = dict(self._entries)
+
+        # 合并时丢弃过期条目；快照只由压缩线程替换，读取时无需加锁
+        now = time.time()
+        merged = {key: entry for key, entry in self._raw_items() if not self._expired(entry, now)}
+        tmp_path = f"{self.snapshot_file}.tmp"
+        try:
+            duration_snapshot.write_snapshot(tmp_path, merged)
+        except OSError as e:
+            logger.error(f"写入时长缓存快照失败：{e}")
+            return
+        with self._lock:
+            # Windows上不能替换仍被映射的文件，先关闭旧快照（仍在遍历时替换失败，留到下次压缩）
+            if self._snapshot is not None:
+                self._snapshot.close()
+                self._snapshot = None
+            try:
+                os.replace(tmp_path, self.snapshot_file)
+                replaced = True
+            except OSError as e:
+                logger.error(f"替换时长缓存快照失败：{e}")
+                replaced = False
+            self._snapshot = duration_snapshot.DurationSnapshot.open(self.snapshot_file)
+            if replaced and self._snapshot is not None:
+                # 已写入快照的条目不再占用内存（压缩期间被再次写入的除外）
+                for key, entry in written.items():
+                    if self._entries.get(key) is entry:
+                        del self._entries[key]
+        if replaced and os.path.exists(compacting):
+            try:
+                os.remove(compacting)
+            except OSError as e:
+                logger.debug(f"删除已压缩的日志失败：{e}")
+
+    def close_snapshot(self):
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot.close()
+                self._snapshot = None
+
+    def close(self):
+        """写入缓冲的记录，等待正在进行的压缩并关闭快照"""
+        self.flush()
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        self.close_snapshot()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""时长缓存的二进制快照
+
+JSON快照启动时要整体解析，并为每个条目建立一个字典；二进制快照通过mmap映射，
+打开时只读取文件头，查询时按需读取单个条目：
+- 32字节文件头：magic、条目数、键字符串表的字节数
+- 时长数组和缓存时间数组（little-endian float64，各count个）
+- 键在字符串表中的偏移数组（uint32，count+1个）和字符串表（按UTF-8字节排序、依次存放的键）
+第一次查询时为全部键（UTF-8字节，不解码）计算哈希，建立 哈希 -> 序号 的字典，之后每次查询是一次
+字典查找加一次与映射中的键的比较；哈希冲突的键回退到二分查找。条目按需从映射中读取，
+过期检查由调用方在查询时进行。
+映射在读取者用完之前不会被关闭：遍历前acquire()，遍历后release()，close()等最后一个读取者结束后才真正关闭。
+"""
+
+import os
+import sys
+import mmap
+import array
+import struct
+import threading
+from itertools import accumulate
+
+from loguru import logger
+
+DURATION_SNAPSHOT_MAGIC = b'OTKDUR1\x00'
+# 文件头：magic、条目数、字符串表字节数
+_HEADER_STRUCT = struct.Struct('<8sIQ')
+HEADER_SIZE = 32
+_DOUBLE = struct.Struct('<d')
+_OFFSET_PAIR = struct.Struct('<II')
+# 索引中哈希冲突的标记（这些键用二分查找）
+_COLLISION = -1
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_snapshot(path, entries):
+    """把 {键: {"duration", "cache_time"}} 写入二进制快照文件并fsync"""
+    encoded = sorted((key.encode('utf-8'), entry) for key, entry in entries.items())
+    keys = [key for key, _ in encoded]
+    offsets = array.array('I', accumulate((len(key) for key in keys), initial=0))
+    durations = array.array('d', (float(entry["duration"]) for _, entry in encoded))
+    times = array.array('d', (float(entry["cache_time"]) for _, entry in encoded))
+    header = _HEADER_STRUCT.pack(DURATION_SNAPSHOT_MAGIC, len(keys), offsets[-1]).ljust(HEADER_SIZE, b'\x00')
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(_little_endian(durations))
+        f.write(_little_endian(times))
+        f.write(_little_endian(offsets))
+        f.write(b''.join(keys))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class DurationSnapshot:
+    """映射的二进制快照；get()返回新建的条目字典，用完后需调用close()
+
+    在其他线程中遍历时先调用acquire()（返回False表示已关闭），遍历结束后调用release()。
+    """
+
+    def __init__(self, buffer):
+        if len(buffer) < HEADER_SIZE:
+            raise ValueError("快照文件过短")
+        magic, count, blob_size = _HEADER_STRUCT.unpack_from(buffer, 0)
+        if magic != DURATION_SNAPSHOT_MAGIC:
+            raise ValueError("快照文件格式无效")
+        self._buffer = buffer
+        self.count = count
+        self._times_start = HEADER_SIZE + 8 * count
+        self._offsets_start = self._times_start + 8 * count
+        self._blob_start = self._offsets_start + 4 * (count + 1)
+        if self._blob_start + blob_size != len(buffer):
+            raise ValueError("快照文件长度不符")
+        self._index = None  # 键的哈希 -> 序号，第一次查询时建立
+        self._refs = 0
+        self._closing = False
+        self._closed = False
+        self._ref_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path):
+        """映射快照文件，不存在或无效时返回None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取时长缓存快照失败：{e}")
+            return None
+        try:
+            return cls(mapping)
+        except ValueError as e:
+            logger.warning(f"时长缓存快照无效，将忽略：{e}")
+            mapping.close()
+            return None
+
+    def __len__(self):
+        return self.count
+
+    def _key(self, index):
+        start, end = _OFFSET_PAIR.unpack_from(self._buffer, self._offsets_start + 4 * index)
+        return self._buffer[self._blob_start + start:self._blob_start + end]
+
+    def _entry(self, index):
+        return {
+            "duration": _DOUBLE.unpack_from(self._buffer, HEADER_SIZE + 8 * index)[0],
+            "cache_time": _DOUBLE.unpack_from(self._buffer, self._times_start + 8 * index)[0],
+        }
+
+    def _build_index(self):
+        """为全部键（UTF-8字节）计算哈希，返回 哈希 -> 序号 的字典"""
+        offsets = array.array('I')
+        offsets.frombytes(self._buffer[self._offsets_start:self._blob_start])
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        blob = self._buffer[self._blob_start:]
+        index = {}
+        for position, (start, end) in enumerate(zip(offsets, offsets[1:])):
+            if index.setdefault(hash(blob[start:end]), position) != position:
+                index[hash(blob[start:end])] = _COLLISION
+        return index
+
+    def _search(self, target):
+        """在映射上二分查找键（UTF-8字节），返回序号，不存在时返回None"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self._key(low) == target:
+            return low
+        return None
+
+    def get(self, key):
+        """查找键，返回 {"duration", "cache_time"}，不存在时返回None"""
+        index = self._index
+        if index is None:
+            # 多个线程同时第一次查询时可能重复建立，结果相同
+            index = self._index = self._build_index()
+        target = key.encode('utf-8')
+        position = index.get(hash(target))
+        if position is None:
+            return None
+        if position == _COLLISION:
+            position = self._search(target)
+        elif self._key(position) != target:
+            return None
+        return None if position is None else self._entry(position)
+
+    def items(self):
+        """按键的顺序依次返回 (键, 条目)"""
+        for index in range(self.count):
+            yield self._key(index).decode('utf-8'), self._entry(index)
+
+    def acquire(self):
+        """开始在映射上读取，映射已关闭时返回False"""
+        with self._ref_lock:
+            if self._closing:
+                return False
+            self._refs += 1
+            return True
+
+    def release(self):
+        with self._ref_lock:
+            self._refs -= 1
+            if not (self._closing and self._refs == 0):
+                return
+        self._close()
+
+    def close(self):
+        """关闭映射；仍有读取者时等最后一个读取者release()后关闭"""
+        with self._ref_lock:
+            self._closing = True
+            if self._refs:
+                return
+        self._close()
+
+    def _close(self):
+        with self._ref_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._index = None
+        close = getattr(self._buffer, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""预编码片段的磁盘缓存
+
+每个条目是一首音轨（已淡入淡出，可能带其后的倒计时）单独编码得到的MP3帧：
+64字节文件头、编码器写入的Xing/LAME头帧（拼接时作为输出文件头帧的模板）、
+每帧的长度（uint16数组）和音频帧数据。读取时通过mmap映射，拼接时直接写入输出文件。
+- 缓存键包含源文件路径、大小、修改时间、淡入淡出时长、倒计时文件的路径、大小、修改时间
+  、响度均衡增益以及编码参数，任何一项变化后旧条目自然失效
+- 配额和按最近访问时间淘汰与PCM缓存相同
+"""
+
+import os
+import mmap
+import array
+import struct
+import hashlib
+import threading
+
+from loguru import logger
+
+from src.utils import pcm_cache
+
+FRAGMENT_CACHE_MAGIC = b'OTKFRG1\x00'
+FRAGMENT_CACHE_EXTENSION = '.frag'
+# 文件头：magic、采样率、声道数、每帧样本数、帧数、片段样本数（不含末尾补齐的静音）、头帧长度、编码器延迟
+_HEADER_STRUCT = struct.Struct('<8sIHHIQII')
+HEADER_SIZE = 64
+
+
+class Fragment:
+    """一个预编码片段，buffer为映射的缓存文件或刚编码得到的bytes；用完后需调用close()"""
+
+    def __init__(self, buffer, frame_rate, channels, samples_per_frame, frame_count, samples, info_length, delay):
+        self._buffer = buffer
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.samples_per_frame = samples_per_frame
+        self.frame_count = frame_count
+        self.samples = samples
+        self.delay = delay
+        self.info_end = HEADER_SIZE + info_length
+        self.data_start = self.info_end + 2 * frame_count
+
+    @property
+    def info_frame(self):
+        return bytes(self._buffer[HEADER_SIZE:self.info_end])
+
+    @property
+    def frame_lengths(self):
+        lengths = array.array('H')
+        lengths.frombytes(self._buffer[self.info_end:self.data_start])
+        return lengths
+
+    @property
+    def data(self):
+        return memoryview(self._buffer)[self.data_start:]
+
+    @property
+    def raw(self):
+        """整个条目（文件头和全部数据），写入缓存时使用"""
+        return memoryview(self._buffer)
+
+    def padded_samples(self):
+        """包含末尾补齐静音的样本数（整帧）"""
+        return self.frame_count * self.samples_per_frame
+
+    def close(self):
+        close = getattr(self._buffer, 'close', None)
+        if close is None:
+            return
+        try:
+            close()
+        except BufferError:
+            # 仍有memoryview引用时由垃圾回收关闭
+            pass
+
+
+def pack_fragment(info_frame, frame_lengths, data, frame_rate, channels, samples_per_frame, samples, delay):
+    """按缓存条目的格式打包一个片段，返回Fragment"""
+    lengths = array.array('H', frame_lengths).tobytes()
+    header = _HEADER_STRUCT.pack(
+        FRAGMENT_CACHE_MAGIC, frame_rate, channels, samples_per_frame,
+        len(frame_lengths), samples, len(info_frame), delay
+    ).ljust(HEADER_SIZE, b'\x00')
+    return parse_fragment(b''.join((header, info_frame, lengths, data)))
+
+
+def parse_fragment(buffer):
+    """解析缓存条目，格式无效时返回None"""
+    if len(buffer) < HEADER_SIZE:
+        return None
+    header = _HEADER_STRUCT.unpack_from(buffer, 0)
+    if header[0] != FRAGMENT_CACHE_MAGIC or header[4] == 0:
+        return None
+    fragment = Fragment(buffer, *header[1:])
+    if fragment.data_start > len(buffer) or len(buffer) != fragment.data_start + sum(fragment.frame_lengths):
+        return None
+    return fragment
+
+
+class FragmentCache(pcm_cache.PcmDiskCache):
+    EXTENSION = FRAGMENT_CACHE_EXTENSION
+
+    @staticmethod
+    def make_key(file_path, fade_ms, countdown_file, settings, gain_db=0.0):
+        """计算片段的缓存键；countdown_file为None表示不带倒计时，gain_db为音轨的响度均衡增益，
+        源文件不存在时抛出OSError"""
+        abs_path = os.path.abspath(file_path)
+        st = os.stat(abs_path)
+        parts = [abs_path, st.st_size, repr(st.st_mtime), fade_ms]
+        if countdown_file:
+            countdown_path = os.path.abspath(countdown_file)
+            countdown_st = os.stat(countdown_path)
+            parts += [countdown_path, countdown_st.st_size, repr(countdown_st.st_mtime)]
+        else:
+            parts.append("-")
+        parts.append(settings)
+        if gain_db:
+            # 不均衡时的键与之前相同，已缓存的片段仍然有效
+            parts.append(f"gain{gain_db:+.2f}")
+        digest = hashlib.sha1("|".join(str(part) for part in parts).encode('utf-8')).hexdigest()
+        return digest + FRAGMENT_CACHE_EXTENSION
+
+    def get(self, key):
+        """读取缓存的片段（内存映射），未命中或条目损坏时返回None"""
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logger.debug(f"读取片段缓存失败 {key}: {e}")
+            return None
+
+        fragment = parse_fragment(mapping)
+        if fragment is None:
+            mapping.close()
+            self.discard(key)
+            return None
+        self._touch(key, path)
+        return fragment
+
+    def put(self, key, fragment):
+        """写入一个片段，返回是否成功"""
+        path = os.path.join(self.cache_dir, key)
+        raw = fragment.raw
+        size = len(raw)
+        if size > self.max_bytes:
+            return False
+
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f"写入片段缓存失败 {key}: {e}")
+            self._remove_file(tmp_path)
+            return False
+        finally:
+            del raw
+
+        self._register(key, path, size)
+        return True
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""曲库增量扫描
+
+用os.scandir遍历目录并记录每个音频文件的 (大小, 修改时间)，
+与索引中保存的记录比较，得出新增、变化、删除和未变化的文件。
+"""
+
+import os
+
+from src.constants import AUDIO_EXTENSIONS
+
+
+def is_audio_file(name):
+    """根据扩展名判断是否为支持的音频文件"""
+    return os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS
+
+
+def scan_directory(directory, token=None):
+    """递归扫描目录，返回 {绝对路径: (大小, 修改时间)}
+
+    传入token（CancellationToken）时每进入一个目录检查一次是否已取消。
+    """
+    signatures = {}
+    stack = [os.path.abspath(directory)]
+    while stack:
+        if token is not None:
+            token.raise_if_cancelled()
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and is_audio_file(entry.name):
+                            st = entry.stat()
+                            signatures[entry.path] = (st.st_size, st.st_mtime)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return signatures
+
+
+def diff_signatures(current, stored):
+    """比较扫描结果与已保存的记录
+
+    current和stored均为 {路径: (大小, 修改时间)}，
+    返回 {"added": [...], "changed": [...], "removed": [...], "unchanged": 数量}
+    """
+    added = []
+    changed = []
+    unchanged = 0
+    for path, signature in current.items():
+        old = stored.get(path)
+        if old is None:
+            added.append(path)
+        elif tuple(old) != tuple(signature):
+            changed.append(path)
+        else:
+            unchanged += 1
+    removed = [path for path in stored if path not in current]
+    return {
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "unchanged": unchanged,
+    }
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""曲库目录监视
+
+在后台线程中监视曲库和随舞目录，把变化的文件汇总后回调，由AudioProcessor增量探测并更新索引：
+- Linux上用inotify（通过ctypes调用libc，不需要额外依赖）：只关注写入完成、移入移出和删除，
+  不关注复制过程中的每次写入；新建或移入的子目录自动加入监视，事件队列溢出时整体重新扫描
+- 其他平台或inotify不可用（如监视数量达到上限）时定期扫描目录，按大小和修改时间比较
+- 变化先去重累积，静默WATCHER_DEBOUNCE_SECONDS秒后回调一次；持续批量复制时每
+  WATCHER_MAX_DELAY_SECONDS秒回调一次，数千个文件也只产生少量回调
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+
+from loguru import logger
+
+from src.constants import WATCHER_DEBOUNCE_SECONDS, WATCHER_MAX_DELAY_SECONDS, WATCHER_POLL_INTERVAL_SECONDS
+from src.utils import cancellation
+from src.utils import library_scan
+
+# 等待变化时最长阻塞的秒数（停止监视时最多等待这么久）
+_WAIT_SLICE = 0.5
+
+# inotify事件掩码（见inotify(7)）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+_EVENT_STRUCT = struct.Struct('iIII')
+_READ_SIZE = 64 * 1024
+
+
+class InotifyBackend:
+    """inotify监视（仅Linux），read()返回 (变化的文件, 需要重新扫描的目录)"""
+
+    def __init__(self, directories):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1失败")
+        self.roots = [os.path.abspath(directory) for directory in directories]
+        self._paths = {}  # wd -> 目录
+        self._missing = set(self.roots)
+        try:
+            self._attach_missing()
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add_watch(self, directory):
+        import ctypes
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(error, f"无法监视目录 {directory}：{os.strerror(error)}")
+        self._paths[wd] = directory
+        return True
+
+    def _add_tree(self, directory):
+        """监视目录及其全部子目录"""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            if not self._add_watch(current):
+                continue
+            try:
+                with os.scandir(current) as entries:
+                    stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def _attach_missing(self):
+        """监视之前不存在、现在已创建的根目录，返回这些目录"""
+        attached = [root for root in self._missing if os.path.isdir(root)]
+        for root in attached:
+            self._add_tree(root)
+            self._missing.discard(root)
+        return attached
+
+    def read(self, timeout):
+        files, directories = set(), set(self._attach_missing())
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return files, directories
+        while True:
+            try:
+                data = os.read(self.fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            self._parse(data, files, directories)
+        return files, directories
+
+    def _parse(self, data, files, directories):
+        offset = 0
+        while offset + _EVENT_STRUCT.size <= len(data):
+            wd, mask, _, length = _EVENT_STRUCT.unpack_from(data, offset)
+            name = data[offset + _EVENT_STRUCT.size:offset + _EVENT_STRUCT.size + length].rstrip(b'\x00')
+            offset += _EVENT_STRUCT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # 丢失了事件，整体重新扫描
+                directories.update(root for root in self.roots if root not in self._missing)
+                continue
+            parent = self._paths.get(wd)
+            if mask & IN_IGNORED:
+                self._paths.pop(wd, None)
+                continue
+            if parent is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                if parent in self.roots:
+                    # 根目录被删除或移走，重新创建后再监视
+                    self._missing.add(parent)
+                    directories.add(parent)
+                continue
+            path = os.path.join(parent, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                # 新建、移入或移出的子目录：其中的文件按目录重新扫描
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._add_tree(path)
+                    except OSError as e:
+                        logger.warning(f"{e}，目录中的后续变化需要重新扫描曲库才能发现")
+                directories.add(path)
+            elif not mask & IN_CREATE and library_scan.is_audio_file(path):
+                # 新建的文件等写入完成（IN_CLOSE_WRITE）后再处理
+                files.add(path)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingBackend:
+    """定期扫描目录并与上一次的结果比较"""
+
+    def __init__(self, directories, interval=WATCHER_POLL_INTERVAL_SECONDS):
+        self.roots = [os.path.abspath(directory) for directory in directories]
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._next_poll = time.monotonic() + interval
+
+    def _scan(self):
+        snapshot = {}
+        for root in self.roots:
+            snapshot.update(library_scan.scan_directory(root))
+        return snapshot
+
+    def read(self, timeout):
+        delay = self._next_poll - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return set(), set()
+        time.sleep(max(0.0, delay))
+        self._next_poll = time.monotonic() + self.interval
+        snapshot = self._scan()
+        delta = library_scan.diff_signatures(snapshot, self._snapshot)
+        self._snapshot = snapshot
+        return set(delta["added"] + delta["changed"] + delta["removed"]), set()
+
+    def close(self):
+        pass
+
+
+def create_backend(directories):
+    """Linux上优先使用inotify，不可用时定期扫描"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyBackend(directories)
+        except (OSError, AttributeError) as e:
+            logger.info(f"inotify不可用，改为每{WATCHER_POLL_INTERVAL_SECONDS}秒扫描一次曲库：{e}")
+    return PollingBackend(directories)
+
+
+class LibraryWatcher:
+    """监视目录，把变化去重累积后调用on_changes(文件列表, 需要重新扫描的目录列表, token)
+
+    on_changes在监视线程中调用，可以直接探测文件；stop()取消token并等待监视线程结束。
+    """
+
+    def __init__(self, directories, on_changes, debounce=WATCHER_DEBOUNCE_SECONDS,
+                 max_delay=WATCHER_MAX_DELAY_SECONDS, backend=None):
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.on_changes = on_changes
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.backend = backend
+        self.token = cancellation.CancellationToken()
+        self._thread = None
+
+    def start(self):
+        if self.backend is None:
+            self.backend = create_backend(self.directories)
+        self._thread = threading.Thread(target=self._run, name="library-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self.token.cancel()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        files, directories = set(), set()
+        first = last = None
+        try:
+            while not self.token.cancelled:
+                if first is None:
+                    timeout = _WAIT_SLICE
+                else:
+                    now = time.monotonic()
+                    timeout = max(0.0, min(_WAIT_SLICE, last + self.debounce - now, first + self.max_delay - now))
+                changed_files, changed_directories = self.backend.read(timeout)
+                now = time.monotonic()
+                if changed_files or changed_directories:
+                    files |= changed_files
+                    directories |= changed_directories
+                    first = first or now
+                    last = now
+                if first is not None and (now - last >= self.debounce or now - first >= self.max_delay):
+                    batch, files, directories = (sorted(files), sorted(directories)), set(), set()
+                    first = last = None
+                    self._dispatch(*batch)
+        finally:
+            self.backend.close()
+
+    def _dispatch(self, files, directories):
+        try:
+            self.on_changes(files, directories, self.token)
+        except cancellation.OperationCancelled:
+            pass
+        except Exception as e:
+            logger.error(f"处理曲库变化失败：{e}")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""响度分析与增益
+
+按EBU R128（ITU-R BS.1770）计算整合响度和采样峰值，全部用NumPy分块向量化计算：
+- K计权滤波（高架+高通两个二阶节）在频域求得冲激响应，截断为FIR后用重叠保留法做FFT卷积
+- 每100毫秒累计一次各声道能量，400毫秒块（75%重叠）由相邻4段求和得到
+- 先按-70 LUFS绝对门限，再按比平均响度低10 LU的相对门限筛选块
+拼接时在解码音轨的同时用analyze_segment()分析淡入淡出之前的PCM，不再为分析单独解码；
+analyze_file()用ffmpeg把文件解码为输出格式的PCM并逐块分析（内存占用与歌曲长度无关），
+只用于不解码整首的情况（音轨来自缓存、过渡试听）。结果存入音轨索引，每个文件版本只分析一次。
+"""
+
+import math
+import subprocess
+from functools import lru_cache
+
+from src.constants import (
+    OUTPUT_FRAME_RATE, OUTPUT_CHANNELS, OUTPUT_SAMPLE_WIDTH,
+    LOUDNESS_TARGET_LUFS, LOUDNESS_PEAK_CEILING_DB, LOUDNESS_MAX_GAIN_DB
+)
+
+# 绝对门限（LUFS）和相对门限（LU）；静音或低于绝对门限的音轨记为SILENCE_LUFS
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+SILENCE_LUFS = ABSOLUTE_GATE_LUFS
+# 全零音频的峰值（dBFS）
+SILENCE_PEAK_DB = -100.0
+
+# K计权FIR的长度和FFT长度（重叠保留法每次处理FFT_SIZE - FILTER_TAPS + 1个样本）
+FILTER_TAPS = 4096
+FFT_SIZE = 65536
+
+# 每次滤波（以及从ffmpeg读取）的帧数
+_READ_FRAMES = FFT_SIZE - FILTER_TAPS + 1
+
+# K计权的两个二阶节：高架（中心频率Hz、Q、增益dB）和高通（截止频率Hz、Q），
+# 按双线性变换换算到任意采样率，48kHz时与BS.1770给出的系数一致
+_SHELF_FREQUENCY, _SHELF_Q, _SHELF_GAIN_DB = 1681.974450955533, 0.7071752369554196, 3.999843853973347
+_HIGH_PASS_FREQUENCY, _HIGH_PASS_Q = 38.13547087602444, 0.5003270373238773
+
+# Windows上不为ffmpeg弹出控制台窗口（工作进程中没有替换Popen）
+_SUBPROCESS_KWARGS = (
+    {'creationflags': subprocess.CREATE_NO_WINDOW} if hasattr(subprocess, 'CREATE_NO_WINDOW') else {}
+)
+
+_SAMPLE_TYPES = {2: 'int16', 4: 'int32'}
+
+
+def _k_weighting_stages(frame_rate):
+    """返回K计权两个二阶节的 [(b, a), ...] 系数（a[0]为1）"""
+    k = math.tan(math.pi * _SHELF_FREQUENCY / frame_rate)
+    vh = 10 ** (_SHELF_GAIN_DB / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / _SHELF_Q + k * k
+    shelf = (
+        ((vh + vb * k / _SHELF_Q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / _SHELF_Q + k * k) / a0),
+        (1.0, 2 * (k * k - 1) / a0, (1 - k / _SHELF_Q + k * k) / a0),
+    )
+    k = math.tan(math.pi * _HIGH_PASS_FREQUENCY / frame_rate)
+    a0 = 1 + k / _HIGH_PASS_Q + k * k
+    high_pass = ((1.0, -2.0, 1.0), (1.0, 2 * (k * k - 1) / a0, (1 - k / _HIGH_PASS_Q + k * k) / a0))
+    return [shelf, high_pass]
+
+
+@lru_cache(maxsize=4)
+def k_weighting_spectrum(frame_rate):
+    """K计权FIR（截断的冲激响应）在FFT_SIZE点上的频谱"""
+    import numpy as np
+
+    # 在足够密的频率网格上求两个二阶节的频率响应，逆变换得到冲激响应（衰减很快，截断误差可忽略）
+    z = np.exp(-2j * np.pi * np.arange(FFT_SIZE // 2 + 1) / FFT_SIZE)
+    response = np.ones_like(z)
+    for b, a in _k_weighting_stages(frame_rate):
+        response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    impulse = np.fft.irfft(response, FFT_SIZE)[:FILTER_TAPS]
+    return np.fft.rfft(impulse, FFT_SIZE)
+
+
+class LoudnessMeter:
+    """逐块输入PCM，累计整合响度和采样峰值"""
+
+    def __init__(self, frame_rate=OUTPUT_FRAME_RATE, channels=OUTPUT_CHANNELS, sample_width=OUTPUT_SAMPLE_WIDTH):
+        import numpy as np
+
+        if sample_width not in _SAMPLE_TYPES:
+            raise ValueError(f"不支持的采样位宽：{sample_width}")
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_width = channels * sample_width
+        self._dtype = np.dtype(_SAMPLE_TYPES[sample_width])
+        self._scale = float(2 ** (8 * sample_width - 1))
+        self._spectrum = k_weighting_spectrum(frame_rate)
+        # 重叠保留法保留的上一块输入末尾
+        self._history = np.zeros((FILTER_TAPS - 1, channels))
+        # 每100毫秒一段的能量（各声道均方和的总和）和不满一段的剩余能量
+        self._step = max(1, round(frame_rate / 10))
+        self._step_energy = []
+        self._remainder = np.zeros(0)
+        self._peak = 0
+        self.frames = 0
+
+    def add(self, data):
+        """输入一块PCM（bytes或memoryview，整帧）"""
+        import numpy as np
+
+        samples = np.frombuffer(data, dtype=self._dtype)
+        if not samples.size:
+            return
+        self._peak = max(self._peak, int(np.abs(samples.astype(np.int64)).max()))
+        samples = samples.reshape(-1, self.channels)
+        self.frames += len(samples)
+        for start in range(0, len(samples), _READ_FRAMES):
+            self._filter(samples[start:start + _READ_FRAMES] / self._scale)
+
+    def _filter(self, block):
+        import numpy as np
+
+        buffer = np.concatenate((self._history, block))
+        self._history = buffer[len(buffer) - FILTER_TAPS + 1:]
+        spectrum = np.fft.rfft(buffer, FFT_SIZE, axis=0) * self._spectrum[:, None]
+        weighted = np.fft.irfft(spectrum, FFT_SIZE, axis=0)[FILTER_TAPS - 1:len(buffer)]
+        # BS.1770中左右声道（及单声道）的权重均为1
+        energy = np.concatenate((self._remainder, np.square(weighted).sum(axis=1)))
+        whole = len(energy) // self._step * self._step
+        if whole:
+            self._step_energy.append(energy[:whole].reshape(-1, self._step).sum(axis=1))
+        self._remainder = energy[whole:]
+
+    def peak_db(self):
+        """采样峰值（dBFS）"""
+        if not self._peak:
+            return SILENCE_PEAK_DB
+        return max(SILENCE_PEAK_DB, 20 * math.log10(self._peak / self._scale))
+
+    def integrated(self):
+        """整合响度（LUFS），全部低于绝对门限时返回SILENCE_LUFS"""
+        import numpy as np
+
+        steps = np.concatenate(self._step_energy) if self._step_energy else np.zeros(0)
+        if len(steps) >= 4:
+            # 400毫秒块，每100毫秒一块
+            blocks = (steps[:-3] + steps[1:-2] + steps[2:-1] + steps[3:]) / (4 * self._step)
+        else:
+            # 不足400毫秒的音频按整体计算一个块
+            total = steps.sum() + self._remainder.sum()
+            blocks = np.array([total / self.frames]) if self.frames else np.zeros(0)
+        with np.errstate(divide='ignore'):
+            levels = -0.691 + 10 * np.log10(blocks)
+        gated = blocks[levels > ABSOLUTE_GATE_LUFS]
+        if not gated.size:
+            return SILENCE_LUFS
+        relative_gate = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE_LU
+        gated = blocks[(levels > ABSOLUTE_GATE_LUFS) & (levels > relative_gate)]
+        return -0.691 + 10 * math.log10(gated.mean())
+
+
+def analyze_file(abs_file, frame_rate=OUTPUT_FRAME_RATE, channels=OUTPUT_CHANNELS):
+    """用ffmpeg解码文件并分析，返回 {"loudness": LUFS, "peak": dBFS, "duration": 秒}；解码失败时抛出RuntimeError"""
+    from src.utils import cache_utils
+
+    command = [
+        cache_utils.get_ffmpeg_path(), '-hide_banner', '-loglevel', 'error', '-nostdin',
+        '-i', abs_file, '-vn', '-f', 's16le', '-ac', str(channels), '-ar', str(frame_rate), 'pipe:1'
+    ]
+    meter = LoudnessMeter(frame_rate, channels, 2)
+    process = subprocess.Popen(
+        command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **_SUBPROCESS_KWARGS
+    )
+    try:
+        while True:
+            data = process.stdout.read(_READ_FRAMES * meter.frame_width)
+            if not data:
+                break
+            meter.add(data[:len(data) // meter.frame_width * meter.frame_width])
+        error = process.stderr.read().decode('utf-8', errors='replace').strip()
+        if process.wait() != 0 or not meter.frames:
+            raise RuntimeError(f"解码失败：{error or process.returncode}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return {"loudness": meter.integrated(), "peak": meter.peak_db(), "duration": meter.frames / frame_rate}
+
+
+def analyze_segment(audio, frame_rate=OUTPUT_FRAME_RATE, channels=OUTPUT_CHANNELS):
+    """分析已解码的音频（AudioSegment），先转换为与analyze_file相同的输出格式，返回值与analyze_file一致"""
+    from src.utils import utils
+
+    audio = utils.normalize_segment(audio, frame_rate, channels, 2)
+    meter = LoudnessMeter(frame_rate, channels, 2)
+    data = memoryview(audio.raw_data)
+    step = _READ_FRAMES * meter.frame_width
+    for start in range(0, len(data), step):
+        meter.add(data[start:start + step])
+    if not meter.frames:
+        raise RuntimeError("音频为空")
+    return {"loudness": meter.integrated(), "peak": meter.peak_db(), "duration": meter.frames / frame_rate}
+
+
+def track_gain(loudness, peak, target=LOUDNESS_TARGET_LUFS, ceiling=LOUDNESS_PEAK_CEILING_DB,
+               max_gain=LOUDNESS_MAX_GAIN_DB):
+    """按分析结果计算达到目标响度所需的增益（dB），提升时峰值不超过ceiling；静音返回0"""
+    if loudness <= SILENCE_LUFS:
+        return 0.0
+    gain = min(target - loudness, max_gain)
+    if gain > 0:
+        gain = max(0.0, min(gain, ceiling - peak))
+    return gain
+
+
+def apply_gain(audio, gain_db, frame_rate=OUTPUT_FRAME_RATE, channels=OUTPUT_CHANNELS,
+               sample_width=OUTPUT_SAMPLE_WIDTH):
+    """把增益应用到音频（AudioSegment、CachedPcm或SharedPcm），返回输出格式的新AudioSegment（削波到满幅）"""
+    import numpy as np
+    from pydub import AudioSegment
+    from src.utils import utils
+
+    audio = utils.normalize_segment(audio, frame_rate, channels, sample_width)
+    dtype = np.dtype(_SAMPLE_TYPES[sample_width])
+    info = np.iinfo(dtype)
+    samples = np.frombuffer(audio.raw_data, dtype=dtype)
+    result = np.empty_like(samples)
+    factor = 10 ** (gain_db / 20)
+    # 分块计算，浮点临时数组的大小与音轨长度无关
+    for start in range(0, len(samples), _READ_FRAMES * channels):
+        block = samples[start:start + _READ_FRAMES * channels] * factor
+        np.clip(np.rint(block, out=block), info.min, info.max, out=block)
+        result[start:start + len(block)] = block
+    return AudioSegment(data=result.tobytes(), sample_width=sample_width, frame_rate=frame_rate, channels=channels)
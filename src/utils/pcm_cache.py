@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""解码后PCM的磁盘缓存
+
+每个条目是一个原始PCM文件，前面带一个64字节的文件头（采样参数、淡入淡出时长、
+源文件大小和修改时间）。读取时通过mmap映射文件，不需要再次调用ffmpeg解码。
+- 缓存键包含源文件路径、大小、修改时间和淡入淡出参数，源文件变化后旧条目自然失效
+- 总大小超过配额时按最近访问时间淘汰
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+import threading
+
+from loguru import logger
+
+PCM_CACHE_MAGIC = b'OTKPCM1\x00'
+PCM_CACHE_EXTENSION = '.pcm'
+# 文件头：magic、采样率、声道数、位宽、淡入、淡出、源文件大小、源文件修改时间、PCM数据长度
+_HEADER_STRUCT = struct.Struct('<8sIHHIIqdQ')
+HEADER_SIZE = 64
+
+
+class CachedPcm:
+    """映射到内存的缓存PCM数据
+
+    提供与AudioSegment相同的frame_rate/channels/sample_width/raw_data/len()接口，
+    流式编码时可以直接把映射的数据写入编码器而不复制到Python堆上。
+    """
+
+    def __init__(self, mapping, frame_rate, channels, sample_width, data_length):
+        self._mapping = mapping
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_width = channels * sample_width
+        self.data_length = data_length
+
+    @property
+    def raw_data(self):
+        return memoryview(self._mapping)[HEADER_SIZE:HEADER_SIZE + self.data_length]
+
+    def frame_count(self):
+        return self.data_length // self.frame_width
+
+    def __len__(self):
+        """时长（毫秒），与AudioSegment的计算方式一致"""
+        return round(1000 * (self.frame_count() / self.frame_rate))
+
+    def to_segment(self):
+        """复制数据生成AudioSegment"""
+        from pydub import AudioSegment
+        return AudioSegment(
+            data=bytes(self.raw_data),
+            sample_width=self.sample_width,
+            frame_rate=self.frame_rate,
+            channels=self.channels
+        )
+
+    def close(self):
+        try:
+            self._mapping.close()
+        except BufferError:
+            # 仍有memoryview引用时由垃圾回收关闭
+            pass
+
+
+class PcmDiskCache:
+    # 缓存条目的扩展名，目录中其他文件不计入配额
+    EXTENSION = PCM_CACHE_EXTENSION
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 文件名 -> [大小, 最近访问时间]
+        self._entries = {}
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_entries()
+
+    def _load_entries(self):
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith('.tmp'):
+                    # 上次写入中断留下的临时文件
+                    self._remove_file(entry.path)
+                    continue
+                if entry.name.endswith(self.EXTENSION):
+                    st = entry.stat()
+                    self._entries[entry.name] = [st.st_size, st.st_mtime]
+                    self._total_bytes += st.st_size
+
+    @staticmethod
+    def make_key(abs_path, size, mtime, fade_in, fade_out):
+        digest = hashlib.sha1(f"{abs_path}|{size}|{mtime!r}|{fade_in}|{fade_out}".encode('utf-8')).hexdigest()
+        return digest + PCM_CACHE_EXTENSION
+
+    def _entry_path(self, file_path, fade_in, fade_out):
+        abs_path = os.path.abspath(file_path)
+        st = os.stat(abs_path)
+        name = self.make_key(abs_path, st.st_size, st.st_mtime, fade_in, fade_out)
+        return name, os.path.join(self.cache_dir, name), st
+
+    def get(self, file_path, fade_in, fade_out):
+        """读取缓存的PCM，未命中或源文件已变化时返回None"""
+        try:
+            name, path, st = self._entry_path(file_path, fade_in, fade_out)
+        except OSError:
+            return None
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logger.debug(f"读取PCM缓存失败 {os.path.basename(file_path)}: {e}")
+            return None
+
+        header = _HEADER_STRUCT.unpack_from(mapping, 0) if len(mapping) >= HEADER_SIZE else None
+        if (
+            header is None or header[0] != PCM_CACHE_MAGIC
+            or header[4:8] != (fade_in, fade_out, st.st_size, st.st_mtime)
+            or HEADER_SIZE + header[8] > len(mapping)
+        ):
+            mapping.close()
+            self.discard(name)
+            return None
+
+        _, frame_rate, channels, sample_width, _, _, _, _, data_length = header
+        self._touch(name, path)
+        return CachedPcm(mapping, frame_rate, channels, sample_width, data_length)
+
+    def put(self, file_path, fade_in, fade_out, segment):
+        """写入一个解码后的音轨，返回是否成功"""
+        try:
+            name, path, st = self._entry_path(file_path, fade_in, fade_out)
+        except OSError:
+            return False
+        data = segment.raw_data
+        size = HEADER_SIZE + len(data)
+        if size > self.max_bytes:
+            return False
+
+        header = _HEADER_STRUCT.pack(
+            PCM_CACHE_MAGIC, segment.frame_rate, segment.channels, segment.sample_width,
+            fade_in, fade_out, st.st_size, st.st_mtime, len(data)
+        ).ljust(HEADER_SIZE, b'\x00')
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f"写入PCM缓存失败 {os.path.basename(file_path)}: {e}")
+            self._remove_file(tmp_path)
+            return False
+
+        self._register(name, path, size)
+        return True
+
+    def _touch(self, name, path):
+        """更新条目的访问时间，用于LRU淘汰"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            if name in self._entries:
+                self._entries[name][1] = os.path.getmtime(path)
+
+    def _register(self, name, path, size):
+        """记录新写入的条目，超出配额时淘汰"""
+        with self._lock:
+            old = self._entries.get(name)
+            if old:
+                self._total_bytes -= old[0]
+            self._entries[name] = [size, os.path.getmtime(path)]
+            self._total_bytes += size
+        self.evict()
+
+    def evict(self):
+        """按最近访问时间淘汰条目，直到总大小不超过配额"""
+        with self._lock:
+            if self._total_bytes <= self.max_bytes:
+                return
+            victims = sorted(self._entries.items(), key=lambda item: item[1][1])
+        for name, (size, _) in victims:
+            with self._lock:
+                if self._total_bytes <= self.max_bytes:
+                    return
+            self.discard(name)
+
+    def discard(self, name):
+        """删除一个条目（文件仍被映射而无法删除时保留）"""
+        if not self._remove_file(os.path.join(self.cache_dir, name)):
+            return
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry:
+                self._total_bytes -= entry[0]
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+
+    def total_bytes(self):
+        with self._lock:
+            return self._total_bytes
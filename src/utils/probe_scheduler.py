@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""异步探测调度
+
+曲库扫描时一次探测大量文件：文件头在一个小线程池中读取，无法识别的文件交给ffprobe，
+用asyncio.create_subprocess_exec同时运行最多max_processes个进程（不为每个文件占用一个线程），
+每个文件有独立的超时，结果按完成顺序逐个解析并回调。
+传入ConcurrencyController时，读取文件头的线程数和ffprobe进程数在上限内按吞吐量自动调整；
+传入executor时文件头在该常驻线程池中读取（由调用方关闭），否则每次探测创建一个线程池。
+probe_many()是同步接口，在调用线程中运行事件循环，供AudioProcessor和Qt线程直接调用。
+"""
+
+import os
+import asyncio
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from src.constants import PROBE_HEADER_WORKERS, PROBE_MAX_PROCESSES, PROBE_TIMEOUT
+from src.utils import audio_probe
+from src.utils import cancellation
+from src.utils import concurrency
+
+# Windows上不为ffprobe弹出控制台窗口（asyncio创建子进程不经过utils中替换的Popen）
+_SUBPROCESS_KWARGS = (
+    {'creationflags': subprocess.CREATE_NO_WINDOW} if hasattr(subprocess, 'CREATE_NO_WINDOW') else {}
+)
+
+# 终止超时的ffprobe后最多等待的秒数
+_KILL_WAIT_SECONDS = 2
+
+
+class ProbeScheduler:
+    def __init__(self, max_processes=PROBE_MAX_PROCESSES, timeout=PROBE_TIMEOUT,
+                 header_workers=PROBE_HEADER_WORKERS, controller=None, executor=None):
+        self.max_processes = max(1, max_processes)
+        self.timeout = timeout
+        self.header_workers = max(1, header_workers)
+        self.executor = executor
+        if controller is not None:
+            # 文件头读取以磁盘为瓶颈，从一半线程开始；ffprobe进程从CPU核数开始
+            self.header_limiter = controller.limiter(
+                "probe_header", 1, self.header_workers, max(1, self.header_workers // 2)
+            )
+            self.process_limiter = controller.limiter(
+                "probe_process", 1, self.max_processes, min(self.max_processes, os.cpu_count() or 4)
+            )
+        else:
+            self.header_limiter = concurrency.fixed_limiter("probe_header", self.header_workers)
+            self.process_limiter = concurrency.fixed_limiter("probe_process", self.max_processes)
+
+    def probe_many(self, file_paths, on_result=None, token=None):
+        """探测所有文件，返回 {路径: info或None}
+
+        on_result(路径, info)按完成顺序在调用线程中调用（info为None表示文件头和ffprobe都失败）；
+        token被取消时终止正在运行的ffprobe并抛出OperationCancelled，已回调的结果保持有效。
+        """
+        if not file_paths:
+            return {}
+        try:
+            return asyncio.run(self._probe_all(list(file_paths), on_result, token))
+        finally:
+            self.header_limiter.finish()
+            self.process_limiter.finish()
+
+    async def _probe_all(self, file_paths, on_result, token):
+        loop = asyncio.get_running_loop()
+        main_task = asyncio.current_task()
+        unregister = None
+        if token is not None:
+            # 从其他线程取消时在事件循环中取消主任务
+            unregister = token.register(lambda: loop.call_soon_threadsafe(main_task.cancel))
+        # 实际同时读取的文件数由header_limiter控制，线程池按上限创建
+        executor = self.executor or ThreadPoolExecutor(max_workers=self.header_limiter.maximum)
+
+        async def _probe_one(file_path):
+            await self.header_limiter.acquire_async()
+            completed = False
+            try:
+                info = await loop.run_in_executor(executor, audio_probe.probe_header, file_path)
+                completed = True
+            finally:
+                self.header_limiter.release(completed=completed)
+            if info is None:
+                await self.process_limiter.acquire_async()
+                completed = False
+                try:
+                    info = await self._ffprobe(file_path)
+                    completed = True
+                finally:
+                    self.process_limiter.release(completed=completed)
+            return file_path, info
+
+        tasks = [asyncio.create_task(_probe_one(file_path)) for file_path in file_paths]
+        results = {}
+        try:
+            for future in asyncio.as_completed(tasks):
+                file_path, info = await future
+                results[file_path] = info
+                if on_result:
+                    on_result(file_path, info)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            # 等待各任务终止自己的ffprobe进程
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise cancellation.OperationCancelled()
+        finally:
+            if unregister:
+                unregister()
+            if executor is not self.executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    async def _ffprobe(self, file_path):
+        """运行一个ffprobe进程并解析其JSON输出，失败或超时返回None"""
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *audio_probe.ffprobe_command(file_path),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                **_SUBPROCESS_KWARGS
+            )
+        except OSError as e:
+            logger.debug(f"启动ffprobe失败：{e}")
+            return None
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"ffprobe超时（{self.timeout}秒）：{os.path.basename(file_path)}")
+            await self._kill(process)
+            return None
+        except asyncio.CancelledError:
+            await self._kill(process)
+            raise
+        if process.returncode != 0:
+            return None
+        try:
+            return audio_probe.parse_ffprobe_output(stdout.decode('utf-8', errors='replace'))
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    @staticmethod
+    async def _kill(process):
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        try:
+            # 等待管道关闭；子孙进程仍占用管道时不无限等待
+            await asyncio.wait_for(process.wait(), _KILL_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.debug(f"ffprobe进程 {process.pid} 已终止但管道未关闭")
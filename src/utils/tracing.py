@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""阶段计时
+
+用span包住一次拼接或曲库扫描中的各个阶段（倒计时加载、每首解码、淡入淡出、合并、
+编码导出、写音乐顺序文件、时长探测），记录墙钟时间、当前线程的CPU时间、处理的
+字节数和缓存命中情况。任务结束时用loguru输出按阶段汇总的表格，并可导出为Chrome
+trace-event JSON（在chrome://tracing或Perfetto中打开）。
+
+未启用时span()直接返回共享的空span，不记录任何数据。设置环境变量
+AUDIO_SPLICER_TRACE=1后界面启用追踪，批量渲染使用--trace参数。
+"""
+
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+from loguru import logger
+
+from src.constants import TRACE_ENV_VAR, TRACE_DIR_NAME
+
+
+class _NullSpan:
+    """未启用追踪时使用的空span"""
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """一个阶段的计时，作为上下文管理器使用；set()补充字节数(bytes)、缓存情况(cache)等参数"""
+
+    __slots__ = ('tracer', 'name', 'category', 'args', 'thread_id', 'start_ns', 'wall_ns', 'cpu_start', 'cpu_ns')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread_id = None
+        self.start_ns = 0
+        self.wall_ns = 0
+        self.cpu_start = 0
+        self.cpu_ns = 0
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.cpu_start = time.thread_time_ns()
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wall_ns = time.perf_counter_ns() - self.start_ns
+        self.cpu_ns = time.thread_time_ns() - self.cpu_start
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer._record(self)
+        return False
+
+
+class Tracer:
+    """收集一个任务的span，线程安全；enabled为False时不记录"""
+
+    def __init__(self, enabled=True, trace_dir=None):
+        self.enabled = enabled
+        # 导出trace文件的目录，为None时只输出汇总表
+        self.trace_dir = trace_dir
+        self._spans = []
+        self._lock = threading.Lock()
+        self._origin_ns = time.perf_counter_ns()
+
+    def span(self, name, category="render", **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def _record(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def reset(self):
+        with self._lock:
+            self._spans = []
+            self._origin_ns = time.perf_counter_ns()
+
+    def chrome_trace(self):
+        """转换为Chrome trace-event格式（完整事件ph=X，时间单位为微秒）"""
+        pid = os.getpid()
+        events = []
+        thread_ids = {}
+        for span in self.spans():
+            # 线程号按出现顺序编号，便于在查看器中阅读
+            tid = thread_ids.setdefault(span.thread_id, len(thread_ids) + 1)
+            args = dict(span.args)
+            args["cpu_ms"] = round(span.cpu_ns / 1e6, 3)
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": (span.start_ns - self._origin_ns) / 1000,
+                "dur": span.wall_ns / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            })
+        for thread_id, tid in thread_ids.items():
+            events.append({
+                "name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                "args": {"name": "主线程" if thread_id == threading.main_thread().ident else f"线程{tid}"},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
+        return path
+
+    def summary(self):
+        """按阶段名汇总：次数、墙钟时间、CPU时间、字节数、缓存命中/未命中次数（按总墙钟时间降序）"""
+        rows = {}
+        for span in self.spans():
+            row = rows.setdefault(span.name, {
+                "name": span.name, "count": 0, "wall_ms": 0.0, "max_ms": 0.0, "cpu_ms": 0.0,
+                "bytes": 0, "hits": 0, "misses": 0,
+            })
+            wall_ms = span.wall_ns / 1e6
+            row["count"] += 1
+            row["wall_ms"] += wall_ms
+            row["max_ms"] = max(row["max_ms"], wall_ms)
+            row["cpu_ms"] += span.cpu_ns / 1e6
+            row["bytes"] += span.args.get("bytes", 0)
+            cache = span.args.get("cache")
+            if cache == "miss":
+                row["misses"] += 1
+            elif cache is not None:
+                # 内存缓存、磁盘缓存、索引命中都算命中
+                row["hits"] += 1
+        return sorted(rows.values(), key=lambda row: row["wall_ms"], reverse=True)
+
+    def format_summary(self):
+        lines = [f"{'阶段':<14}{'次数':>6}{'总耗时ms':>12}{'最长ms':>10}{'CPUms':>10}{'MB':>10}{'命中/未命中':>14}"]
+        for row in self.summary():
+            cache = f"{row['hits']}/{row['misses']}" if row["hits"] or row["misses"] else "-"
+            lines.append(
+                f"{row['name']:<14}{row['count']:>6}{row['wall_ms']:>12.1f}{row['max_ms']:>10.1f}"
+                f"{row['cpu_ms']:>10.1f}{row['bytes'] / 1024 / 1024:>10.1f}{cache:>14}"
+            )
+        return "\n".join(lines)
+
+    def finish(self, name):
+        """任务结束：输出汇总表，设置了trace_dir时导出trace文件，然后清空；返回trace文件路径"""
+        if not self.enabled or not self.spans():
+            return None
+        logger.info(f"{name} 阶段耗时：\n{self.format_summary()}")
+        path = None
+        if self.trace_dir:
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            try:
+                path = self.export_chrome_trace(os.path.join(self.trace_dir, f"{name}-{stamp}.json"))
+                logger.info(f"已导出trace文件：{path}")
+            except OSError as e:
+                logger.warning(f"导出trace文件失败：{e}")
+        self.reset()
+        return path
+
+
+# 未启用追踪时共用的Tracer
+NULL_TRACER = Tracer(enabled=False)
+
+
+def tracing_enabled():
+    """是否通过环境变量启用了追踪"""
+    return os.environ.get(TRACE_ENV_VAR, "").strip().lower() not in ("", "0", "false", "no")
+
+
+def make_tracer(program_dir, enabled=None):
+    """创建Tracer，trace文件导出到程序目录的traces目录；enabled为None时按环境变量决定"""
+    if enabled is None:
+        enabled = tracing_enabled()
+    if not enabled:
+        return NULL_TRACER
+    return Tracer(trace_dir=os.path.join(program_dir, TRACE_DIR_NAME))
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""持久化音轨索引
+
+使用SQLite（WAL模式）按绝对路径保存音频文件的时长、大小、修改时间、编码、
+采样率、声道数以及响度分析结果。文件大小或修改时间变化时条目自动失效。
+- 每个线程使用独立连接，读操作互不阻塞
+- 写入先进入内存缓冲，批量提交，保存成本与变化的行数成正比
+- 首次打开时可导入旧版duration_cache.json；旧版缓存只按文件名记录，不同目录的同名文件无法区分，
+  只在探测失败时作为估计值返回，不写入索引
+- 重新探测同一版本的文件时保留已有的响度分析结果，文件变化后响度随之清空
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from loguru import logger
+
+from src.constants import CACHE_EXPIRATION
+
+# 缓冲的写入条数达到该值时自动提交
+DEFAULT_BATCH_SIZE = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    duration REAL NOT NULL,
+    codec TEXT,
+    sample_rate INTEGER,
+    channels INTEGER,
+    cache_time REAL NOT NULL,
+    loudness REAL,
+    peak REAL
+);
+CREATE INDEX IF NOT EXISTS tracks_name ON tracks(name);
+CREATE TABLE IF NOT EXISTS legacy_durations (
+    name TEXT PRIMARY KEY,
+    duration REAL NOT NULL,
+    cache_time REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_COLUMNS = (
+    "path", "name", "size", "mtime", "duration", "codec", "sample_rate", "channels", "cache_time", "loudness", "peak"
+)
+# 旧版数据库中没有的列，打开时补上
+_ADDED_COLUMNS = (("loudness", "REAL"), ("peak", "REAL"))
+
+# 写入条目；同一版本（大小和修改时间相同）的文件重新探测时保留已有的响度分析结果
+_UPSERT = (
+    f"INSERT INTO tracks ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+    "ON CONFLICT(path) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in _COLUMNS[1:-2]) + ", "
+    + ", ".join(
+        f"{column} = CASE WHEN excluded.{column} IS NOT NULL THEN excluded.{column} "
+        f"WHEN tracks.size = excluded.size AND tracks.mtime = excluded.mtime THEN tracks.{column} END"
+        for column in _COLUMNS[-2:]
+    )
+)
+
+
+def file_signature(file_path):
+    """返回文件的 (大小, 修改时间)，用于判断索引条目是否仍然有效"""
+    st = os.stat(file_path)
+    return st.st_size, st.st_mtime
+
+
+class TrackIndex:
+    def __init__(self, db_path, batch_size=DEFAULT_BATCH_SIZE, legacy_ttl=CACHE_EXPIRATION):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.legacy_ttl = legacy_ttl
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # 尚未提交的写入：path -> 行元组（None表示待删除）
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(tracks)")}
+        for column, column_type in _ADDED_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE tracks ADD COLUMN {column} {column_type}")
+        conn.commit()
+
+    def _connection(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @staticmethod
+    def _row_to_entry(row):
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def get(self, file_path):
+        """按绝对路径查询条目（包括尚未提交的写入），不存在时返回None"""
+        abs_path = os.path.abspath(file_path)
+        with self._pending_lock:
+            if abs_path in self._pending:
+                return self._row_to_entry(self._pending[abs_path])
+        row = self._connection().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM tracks WHERE path = ?", (abs_path,)
+        ).fetchone()
+        return self._row_to_entry(row)
+
+    def lookup(self, file_path, size, mtime):
+        """查询条目，文件大小或修改时间与记录不一致时视为失效并返回None"""
+        entry = self.get(file_path)
+        if entry and entry["size"] == size and entry["mtime"] == mtime:
+            return entry
+        return None
+
+    def put(self, file_path, info, size, mtime):
+        """写入（或更新）一个条目；写入先缓冲，达到批量大小时自动提交"""
+        abs_path = os.path.abspath(file_path)
+        row = (
+            abs_path, os.path.basename(abs_path), size, mtime, info["duration"],
+            info.get("codec"), info.get("sample_rate"), info.get("channels"), time.time(),
+            info.get("loudness"), info.get("peak")
+        )
+        with self._pending_lock:
+            self._pending[abs_path] = row
+            should_flush = len(self._pending) >= self.batch_size
+        if should_flush:
+            self.flush()
+
+    def put_many(self, entries):
+        """批量写入 (路径, info, 大小, 修改时间)，只获取一次锁"""
+        now = time.time()
+        rows = []
+        for file_path, info, size, mtime in entries:
+            abs_path = os.path.abspath(file_path)
+            rows.append((
+                abs_path, os.path.basename(abs_path), size, mtime, info["duration"],
+                info.get("codec"), info.get("sample_rate"), info.get("channels"), now,
+                info.get("loudness"), info.get("peak")
+            ))
+        with self._pending_lock:
+            for row in rows:
+                self._pending[row[0]] = row
+            should_flush = len(self._pending) >= self.batch_size
+        if should_flush:
+            self.flush()
+
+    def get_loudness(self, file_path, size, mtime):
+        """返回文件当前版本的 (整合响度LUFS, 峰值dBFS)，尚未分析或文件已变化时返回None"""
+        abs_path = os.path.abspath(file_path)
+        with self._pending_lock:
+            row = self._pending.get(abs_path)
+        if row is not None and row[2] == size and row[3] == mtime and row[9] is not None:
+            return row[9], row[10]
+        # 缓冲中只更新了时长的条目，响度仍以数据库中同一版本的记录为准
+        row = self._connection().execute(
+            "SELECT loudness, peak FROM tracks WHERE path = ? AND size = ? AND mtime = ? AND loudness IS NOT NULL",
+            (abs_path, size, mtime)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def set_loudness(self, file_path, size, mtime, loudness, peak):
+        """记录响度分析结果；条目不存在或文件版本不一致时返回False"""
+        entry = self.get(file_path)
+        if not entry or entry["size"] != size or entry["mtime"] != mtime:
+            return False
+        entry.update(loudness=loudness, peak=peak)
+        row = tuple(entry[column] for column in _COLUMNS)
+        with self._pending_lock:
+            self._pending[row[0]] = row
+            should_flush = len(self._pending) >= self.batch_size
+        if should_flush:
+            self.flush()
+        return True
+
+    def remove(self, file_paths):
+        """删除条目"""
+        with self._pending_lock:
+            for file_path in file_paths:
+                self._pending[os.path.abspath(file_path)] = None
+            should_flush = len(self._pending) >= self.batch_size
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """提交缓冲中的写入，只写入发生变化的行"""
+        with self._flush_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            upserts = [row for row in pending.values() if row is not None]
+            deletes = [(path,) for path, row in pending.items() if row is None]
+            conn = self._connection()
+            try:
+                with conn:
+                    if upserts:
+                        conn.executemany(_UPSERT, upserts)
+                    if deletes:
+                        conn.executemany("DELETE FROM tracks WHERE path = ?", deletes)
+            except sqlite3.Error:
+                # 提交失败时放回缓冲，等待下次提交（缓冲中较新的写入优先）
+                with self._pending_lock:
+                    pending.update(self._pending)
+                    self._pending = pending
+                raise
+            return len(pending)
+
+    def signatures(self, directory):
+        """返回目录下所有已索引文件的 {绝对路径: (大小, 修改时间)}"""
+        self.flush()
+        prefix = os.path.join(os.path.abspath(directory), '')
+        # 路径前缀范围查询，可利用主键索引
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._connection().execute(
+            "SELECT path, size, mtime FROM tracks WHERE path >= ? AND path < ?",
+            (prefix, upper)
+        )
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def legacy_duration(self, file_path):
+        """按文件名查询从旧版JSON缓存导入的时长（考虑TTL），不存在时返回None"""
+        row = self._connection().execute(
+            "SELECT duration, cache_time FROM legacy_durations WHERE name = ?",
+            (os.path.basename(file_path),)
+        ).fetchone()
+        if row and (time.time() - row[1]) <= self.legacy_ttl:
+            return row[0]
+        return None
+
+    def get_duration(self, file_path, exact=False, span=None):
+        """获取音频时长：索引命中且文件未变化时直接返回，否则探测后写入索引
+
+        探测失败且索引中还没有该路径时返回旧版缓存中同名文件的时长（不写入索引）。
+        传入span（tracing.Span）时记录文件大小和是否命中索引。
+        """
+        from src.utils import audio_probe
+
+        abs_path = os.path.abspath(file_path)
+        try:
+            size, mtime = file_signature(abs_path)
+        except OSError as e:
+            logger.warning(f"读取{os.path.basename(abs_path)}文件信息失败：{e}")
+            return 0
+        if span is not None:
+            span.set(bytes=size, cache="miss")
+
+        entry = None
+        if not exact:
+            entry = self.get(abs_path)
+            if entry and entry["size"] == size and entry["mtime"] == mtime:
+                if span is not None:
+                    span.set(cache="hit")
+                return entry["duration"]
+
+        try:
+            info = audio_probe.probe_audio(abs_path, exact=exact)
+            if info is None and not exact:
+                # 文件头和ffprobe都无法识别时，最后尝试完整解码
+                info = audio_probe.probe_decode(abs_path)
+        except Exception as e:
+            logger.warning(f"计算{os.path.basename(abs_path)}时长失败：{e}")
+            info = None
+        if info is not None:
+            self.put(abs_path, info, size, mtime)
+            return info["duration"]
+
+        # 旧版缓存只按文件名记录（可能是另一个目录中的同名文件），只作为估计值，不写入索引
+        legacy = self.legacy_duration(abs_path) if entry is None and not exact else None
+        if legacy is not None:
+            if span is not None:
+                span.set(cache="legacy")
+            return legacy
+        return 0
+
+    def import_duration_cache(self, cache_file):
+        """一次性导入旧版duration_cache.json，返回导入的条目数（已导入过时返回0）"""
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_json_imported'").fetchone():
+            return 0
+        from src.utils import duration_journal
+
+        rows = []
+        # 快照加上预写日志中的条目
+        for name, entry in duration_journal.load(cache_file, ttl=self.legacy_ttl).items():
+            try:
+                rows.append((os.path.basename(name), float(entry["duration"]), float(entry["cache_time"])))
+            except (KeyError, TypeError, ValueError):
+                continue
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO legacy_durations (name, duration, cache_time) VALUES (?, ?, ?)",
+                rows
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_json_imported', ?)",
+                (json.dumps({"file": cache_file, "time": time.time(), "count": len(rows)}),)
+            )
+        return len(rows)
+
+    def __len__(self):
+        self.flush()
+        return self._connection().execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    def close(self):
+        """提交缓冲并关闭所有线程的连接"""
+        try:
+            self.flush()
+        finally:
+            with self._connections_lock:
+                connections, self._connections = self._connections, []
+            for conn in connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._local = threading.local()
@@ -4,7 +4,6 @@
 import os
 import subprocess
 import re
-from concurrent.futures import ThreadPoolExecutor
 
 # 禁止子进程弹出窗口
 
@@ -80,46 +79,86 @@ def next_power_of_2(n):
     return 1 << (n - 1).bit_length()
 
 
-def merge_segments(seg_list):
-    """递归合并音频片段，采用2的n次方合并策略"""
-    if len(seg_list) == 1:
-        return seg_list[0]
-    elif len(seg_list) == 2:
-        return seg_list[0] + seg_list[1]
-    else:
-        mid = len(seg_list) // 2
-        left = merge_segments(seg_list[:mid])
-        right = merge_segments(seg_list[mid:])
-        return left + right
+def normalize_segment(segment, frame_rate, channels, sample_width):
+    """把音频段转换为指定的采样率、声道数和位宽（参数相同时原样返回）"""
+    if (segment.frame_rate, segment.channels, segment.sample_width) == (frame_rate, channels, sample_width):
+        return segment
+    if hasattr(segment, 'to_segment'):
+        # 内存映射的磁盘缓存数据需要先复制为AudioSegment再转换
+        segment = segment.to_segment()
+    if segment.frame_rate != frame_rate:
+        segment = segment.set_frame_rate(frame_rate)
+    if segment.channels != channels:
+        segment = segment.set_channels(channels)
+    if segment.sample_width != sample_width:
+        segment = segment.set_sample_width(sample_width)
+    return segment
 
 
-def parallel_merge(segments, num_workers=8, min_segments=50, use_concurrency=True, status_callback=None):
-    """使用线程池并行合并音频片段"""
-    # 如果禁用了并发或者音频数量不足，不使用并发优化
-    if not use_concurrency or len(segments) < min_segments:
-        if status_callback:
-            status_callback(f"{'禁用并发' if not use_concurrency else f'音频数量不足{min_segments}个'}，使用串行合并")
-        return merge_segments(segments)
+def concat_segments(segments, frame_rate=None, channels=None, sample_width=None, status_callback=None,
+                    token=None):
+    """一次分配输出缓冲区拼接所有音频片段
     
-    if status_callback:
-        status_callback(f"音频数量超过{min_segments}个，使用并行合并")
+    先统一采样参数（默认取所有片段中的最大值，与pydub拼接时的行为一致）并计算总帧数，
+    分配一个bytearray，再通过memoryview把每个片段的数据复制到对应偏移处，每个样本只复制一次。
+    传入token（CancellationToken）时每复制一个片段检查一次是否已取消。
+    """
+    from pydub import AudioSegment
     
-    # 确保分块数是2的幂次方
-    num_chunks = next_power_of_2(len(segments))
-    if num_chunks < 4:
-        num_chunks = 4  # 至少8块
+    if not segments:
+        raise ValueError("没有可拼接的音频片段")
+    frame_rate = frame_rate or max(seg.frame_rate for seg in segments)
+    channels = channels or max(seg.channels for seg in segments)
+    sample_width = sample_width or max(seg.sample_width for seg in segments)
+    frame_width = channels * sample_width
     
-    # 计算每块的大小
-    chunk_size = (len(segments) + num_chunks - 1) // num_chunks
+    # 参数一致的片段直接使用原始数据长度；需要转换的片段按转换后的帧数估算，复制时再校正
+    def _frames(seg):
+        if (seg.frame_rate, seg.channels, seg.sample_width) == (frame_rate, channels, sample_width):
+            return len(seg.raw_data) // frame_width
+        return int(len(seg.raw_data) // (seg.channels * seg.sample_width) * frame_rate / seg.frame_rate) + 1
+    
+    total_bytes = sum(_frames(seg) for seg in segments) * frame_width
+    if status_callback:
+        status_callback(f"拼接{len(segments)}个音频片段，共 {total_bytes / 1024 / 1024:.1f}MB")
     
-    # 分块
-    chunks = []
-    for i in range(0, len(segments), chunk_size):
-        chunks.append(segments[i:i+chunk_size])
+    output = bytearray(total_bytes)
+    view = memoryview(output)
+    offset = 0
+    for seg in segments:
+        if token is not None and token.cancelled:
+            view.release()
+            token.raise_if_cancelled()
+        # 一次只转换一个片段，转换结果复制后即可释放
+        data = memoryview(normalize_segment(seg, frame_rate, channels, sample_width).raw_data).cast('B')
+        end = offset + len(data)
+        if end > len(output):
+            # 重采样后的长度超出估算，扩大缓冲区（只会发生在需要转换的片段上）
+            view.release()
+            output.extend(bytes(end - len(output)))
+            view = memoryview(output)
+        view[offset:end] = data
+        offset = end
+    view.release()
+    # 去掉估算多出的尾部
+    del output[offset:]
     
-    # 使用线程池合并每个块
-    with ThreadPoolExecutor(max_workers=num_workers) as executor:
-        merged_chunks = list(executor.map(merge_segments, chunks))
+    return AudioSegment(data=output, sample_width=sample_width, frame_rate=frame_rate, channels=channels)
+
+
+def merge_segments(seg_list):
+    """合并音频片段（一次分配输出缓冲区，见concat_segments）"""
+    if len(seg_list) == 1:
+        return seg_list[0]
+    return concat_segments(seg_list)
+
+
+def parallel_merge(segments, num_workers=8, min_segments=50, use_concurrency=True, status_callback=None):
+    """合并音频片段
     
-    # 递归合并所有块结果
-    return merge_segments(merged_chunks)
+    保留原有接口；拼接只是一次内存复制，多线程受GIL限制没有收益，
+    num_workers、min_segments和use_concurrency参数不再使用。
+    """
+    if len(segments) == 1:
+        return segments[0]
+    return concat_segments(segments, status_callback=status_callback)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""批量渲染的测试
+
+需要pydub和ffmpeg（项目内的ffmpeg目录或PATH中），缺少时跳过。
+运行：python -m pytest tests 或 python -m unittest discover tests
+"""
+
+import os
+import sys
+import wave
+import array
+import shutil
+import tempfile
+import unittest
+
+# 确保项目根目录在Python路径中
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.utils import cache_utils
+
+try:
+    import pydub  # noqa: F401
+    HAVE_PYDUB = True
+except ImportError:
+    HAVE_PYDUB = False
+
+HAVE_FFMPEG = os.path.exists(cache_utils.get_ffmpeg_path()) or shutil.which(cache_utils.get_ffmpeg_path()) is not None
+
+
+def write_tone(path, seconds, amplitude=10000, frame_rate=44100):
+    """写入一个音量恒定的双声道16位WAV文件（方波）"""
+    period = frame_rate // 441
+    samples = array.array('h')
+    for i in range(int(seconds * frame_rate)):
+        value = amplitude if i % period < period // 2 else -amplitude
+        samples.extend((value, value))
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(frame_rate)
+        f.writeframes(samples.tobytes())
+
+
+@unittest.skipUnless(HAVE_PYDUB and HAVE_FFMPEG, "需要pydub和ffmpeg")
+class FadeCacheTest(unittest.TestCase):
+    """同一批任务共享内存缓存，不同fade_ms的任务不能复用对方添加了淡入淡出的音轨"""
+
+    def setUp(self):
+        from src.core import batch_render
+
+        self.program_dir = tempfile.mkdtemp(prefix="batch_render_")
+        self.track = os.path.join(self.program_dir, "a.wav")
+        write_tone(self.track, 4)
+        self.renderer = batch_render.BatchRenderer(self.program_dir, use_concurrency=False, log=lambda message: None)
+        self.jobs = [
+            batch_render.normalize_job(
+                {"playlist": ["a.wav"], "countdown": None, "fade_ms": fade_ms, "normalize": False,
+                 "output": f"out_{fade_ms}.mp3"},
+                self.program_dir, self.program_dir, f"fade_{fade_ms}"
+            )
+            for fade_ms in (2000, 500)
+        ]
+
+    def tearDown(self):
+        self.renderer.close()
+        shutil.rmtree(self.program_dir, ignore_errors=True)
+
+    def test_jobs_with_different_fade_do_not_share_cached_audio(self):
+        results = self.renderer.run(self.jobs)
+        for job, (success, message) in zip(self.jobs, results):
+            self.assertTrue(success, f"{job['name']}：{message}")
+            self.assertTrue(os.path.exists(job["output"]))
+
+        long_fade = self.renderer.audio_cache.get((self.track, 2000))
+        short_fade = self.renderer.audio_cache.get((self.track, 500))
+        self.assertIsNotNone(long_fade)
+        self.assertIsNotNone(short_fade)
+        # 第0.9-1秒：500ms的淡入已经结束，2000ms的淡入还在进行
+        self.assertEqual(short_fade[900:1000].max, 10000)
+        self.assertLess(long_fade[900:1000].max, 10000 // 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,7 @@ a = Analysis(
     pathex=['.'],
     binaries=[('ffmpeg/ffmpeg.exe', 'ffmpeg'), ('ffmpeg/ffprobe.exe', 'ffmpeg')],
     datas=[('src/', 'src')],
-    hiddenimports=['src.utils', 'src.utils.cache_utils', 'src.utils.fix_encoding', 'src.utils.update_cache', 'src.threads.worker_threads', 'src.core.audio_processor', 'src.ui.ui_components'],
+    hiddenimports=['src.utils', 'src.utils.cache_utils', 'src.utils.duration_journal', 'src.utils.duration_snapshot', 'src.utils.audio_probe', 'src.utils.track_index', 'src.utils.library_scan', 'src.utils.library_watcher', 'src.utils.probe_scheduler', 'src.utils.cancellation', 'src.utils.concurrency', 'src.utils.tracing', 'src.utils.pcm_cache', 'src.utils.fragment_cache', 'src.utils.loudness', 'src.utils.fix_encoding', 'src.utils.update_cache', 'src.threads.worker_threads', 'src.core.audio_processor', 'src.core.stream_render', 'src.core.track_loader', 'src.core.decode_pool', 'src.core.mp3_encode', 'src.core.fragment_render', 'src.core.smart_render', 'src.core.preview_render', 'src.core.splice_job', 'src.core.batch_render', 'src.ui.ui_components', 'src.ui.lag_monitor'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],